@@ -0,0 +1,108 @@
+"""
+Бенчмарк пропускной способности /v1/chat/completions
+
+Сравнивает старое поведение (синхронный вызов провайдера прямо в event loop)
+с асинхронным выполнением через services.upstream. Провайдер подменяется
+заглушкой с фиксированной задержкой, сеть и база данных не нужны.
+
+Запуск (из каталога python-g4f):
+    python benchmarks/bench_concurrency.py --requests 64 --concurrency 16 --latency 0.2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+import config
+import main
+from services import upstream
+from services.key_cache import KeyInfo
+
+
+class FakeCompletions:
+    """Заглушка g4f: отвечает через latency секунд"""
+
+    def __init__(self, latency: float, blocking: bool):
+        self.latency = latency
+        self.blocking = blocking
+
+    async def create(self, model, messages, provider=None, **kwargs):
+        if self.blocking:
+            # Так вёл себя синхронный Client внутри async-обработчика
+            time.sleep(self.latency)
+        else:
+            await asyncio.sleep(self.latency)
+        message = SimpleNamespace(content="ok")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")])
+
+
+async def run_mode(http: httpx.AsyncClient, mode: str, args) -> dict:
+    upstream.client = SimpleNamespace(
+        chat=SimpleNamespace(completions=FakeCompletions(args.latency, blocking=mode == "blocking"))
+    )
+    semaphore = asyncio.Semaphore(args.concurrency)
+    headers = {"X-API-Key": "bench", "X-G4F-Cache": "off"}
+
+    async def one(index: int):
+        # Разные промпты, чтобы запросы не объединялись single-flight
+        body = {"model": "gpt-4", "messages": [{"role": "user", "content": f"ping {mode} {index}"}]}
+        async with semaphore:
+            response = await http.post("/v1/chat/completions", json=body, headers=headers)
+            response.raise_for_status()
+
+    async def probe_health(done: asyncio.Event) -> float:
+        # Задержка /health с учётом ожидания, пока event loop освободится
+        worst = 0.0
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            await http.get("/health")
+            worst = max(worst, time.perf_counter() - started - 0.01)
+        return worst
+
+    done = asyncio.Event()
+    prober = asyncio.create_task(probe_health(done))
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    health_worst = await prober
+
+    return {
+        "mode": mode,
+        "elapsed": elapsed,
+        "rps": args.requests / elapsed,
+        "health_worst": health_worst
+    }
+
+
+async def main_async(args):
+    main.app.dependency_overrides[main.api_key_check] = lambda: KeyInfo(valid=True)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        return [await run_mode(http, mode, args) for mode in ("blocking", "async")]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=64, help="Всего запросов")
+    parser.add_argument("--concurrency", type=int, default=16, help="Одновременных клиентов")
+    parser.add_argument("--latency", type=float, default=0.2, help="Задержка провайдера, с")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print("=" * 60)
+    print(f"Запросов: {args.requests}, клиентов: {args.concurrency}, "
+          f"задержка провайдера: {args.latency} с, G4F_MAX_CONCURRENCY: {config.G4F_MAX_CONCURRENCY}")
+    print("=" * 60)
+    for result in asyncio.run(main_async(args)):
+        print(f"{result['mode']:10} {result['elapsed']:7.2f} с  {result['rps']:8.1f} req/s  "
+              f"худший /health: {result['health_worst'] * 1000:8.1f} мс")
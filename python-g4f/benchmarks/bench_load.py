@@ -0,0 +1,216 @@
+"""
+Нагрузочный бенчмарк /v1/chat/completions с заглушкой провайдера
+
+Приложение вызывается напрямую по ASGI (без сети и uvicorn), провайдер
+подменяется заглушкой из stub_provider с настраиваемой задержкой, разбросом,
+скоростью чанков и долей ошибок. Для каждого сценария (completion, stream)
+считаются пропускная способность, p50/p95/p99 задержки и TTFT - время до
+первого байта тела ответа. Результат печатается в формате JSON.
+
+С --baseline результат сравнивается с сохранённым прогоном: если
+пропускная способность упала или p95 вырос больше чем на --tolerance,
+скрипт завершается с кодом 1.
+
+Запуск (из каталога python-g4f):
+    python benchmarks/bench_load.py --requests 200 --concurrency 32 --output bench.json
+    python benchmarks/bench_load.py --baseline bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from services import upstream
+from services.key_cache import KeyInfo
+from stub_provider import stub_client
+
+SCENARIOS = ("completion", "stream")
+
+
+async def asgi_request(app, path: str, body: dict, headers: Dict[str, str]) -> dict:
+    """
+    Выполнить POST запрос к ASGI приложению
+
+    Returns:
+        {"status", "ttft", "latency"}: ttft - время до первого непустого
+        фрагмента тела, latency - до конца ответа
+    """
+    payload = json.dumps(body).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json")]
+                   + [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    finished = asyncio.Event()
+    body_sent = False
+    result = {"status": None, "ttft": None, "latency": None}
+    started = time.perf_counter()
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        # Клиент "отключается" только после того, как дочитал ответ
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            if message.get("body") and result["ttft"] is None:
+                result["ttft"] = time.perf_counter() - started
+            if not message.get("more_body"):
+                result["latency"] = time.perf_counter() - started
+                finished.set()
+
+    await app(scope, receive, send)
+    finished.set()
+    return result
+
+
+def percentiles(values: List[float]) -> Optional[dict]:
+    """p50/p95/p99/max/mean в миллисекундах (nearest-rank)"""
+    if not values:
+        return None
+    values = sorted(values)
+
+    def rank(q: float) -> float:
+        return values[min(len(values) - 1, max(0, int(q * len(values) + 0.5) - 1))]
+
+    return {
+        "p50_ms": round(rank(0.50) * 1000, 2),
+        "p95_ms": round(rank(0.95) * 1000, 2),
+        "p99_ms": round(rank(0.99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2),
+        "mean_ms": round(sum(values) / len(values) * 1000, 2),
+    }
+
+
+async def run_scenario(scenario: str, args) -> dict:
+    upstream.client = stub_client(
+        latency=args.latency,
+        jitter=args.jitter,
+        chunks=args.chunks,
+        chunk_interval=args.chunk_interval,
+        failure_rate=args.failure_rate,
+        seed=args.seed
+    )
+    semaphore = asyncio.Semaphore(args.concurrency)
+    headers = {"X-API-Key": "bench", "X-G4F-Cache": "off"}
+    samples = []
+
+    async def one(index: int):
+        # Разные промпты, чтобы запросы не объединялись single-flight
+        body = {
+            "model": args.model,
+            "messages": [{"role": "user", "content": f"{scenario} {index}"}],
+            "stream": scenario == "stream"
+        }
+        async with semaphore:
+            samples.append(await asgi_request(main.app, "/v1/chat/completions", body, headers))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    ok = [sample for sample in samples if sample["status"] == 200]
+    stub = upstream.client.chat.completions
+    return {
+        "requests": args.requests,
+        "ok": len(ok),
+        "statuses": {str(status): count for status, count in Counter(s["status"] for s in samples).items()},
+        "upstream_calls": stub.calls,
+        "upstream_failures": stub.failures,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(ok) / elapsed, 2),
+        "latency": percentiles([sample["latency"] for sample in ok]),
+        "ttft": percentiles([sample["ttft"] for sample in ok if sample["ttft"] is not None]),
+    }
+
+
+async def main_async(args) -> dict:
+    main.app.dependency_overrides[main.api_key_check] = lambda: KeyInfo(valid=True)
+    report = {
+        "config": {
+            key: getattr(args, key)
+            for key in ("requests", "concurrency", "model", "latency", "jitter",
+                        "chunks", "chunk_interval", "failure_rate", "seed")
+        },
+        "scenarios": {}
+    }
+    for scenario in args.scenarios:
+        report["scenarios"][scenario] = await run_scenario(scenario, args)
+    return report
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Регрессии относительно baseline: падение rps или рост p95 больше tolerance"""
+    regressions = []
+    for scenario, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        if current["rps"] < previous["rps"] * (1 - tolerance):
+            regressions.append(f"{scenario}: rps {current['rps']} < {previous['rps']}")
+        for metric in ("latency", "ttft"):
+            if current[metric] and previous.get(metric):
+                now, before = current[metric]["p95_ms"], previous[metric]["p95_ms"]
+                if now > before * (1 + tolerance):
+                    regressions.append(f"{scenario}: {metric} p95 {now} мс > {before} мс")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="Запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=32, help="Одновременных клиентов")
+    parser.add_argument("--model", default="gpt-4", help="Модель (определяет список провайдеров)")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--latency", type=float, default=0.2, help="Задержка провайдера до ответа/первого чанка, с")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Разброс задержки ±, с")
+    parser.add_argument("--chunks", type=int, default=20, help="Чанков в потоковом ответе")
+    parser.add_argument("--chunk-interval", type=float, default=0.01, help="Интервал между чанками, с")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Доля ошибок провайдера (0..1)")
+    parser.add_argument("--seed", type=int, default=42, help="Seed генератора задержек и ошибок")
+    parser.add_argument("--output", help="Сохранить результат в JSON файл")
+    parser.add_argument("--baseline", help="JSON предыдущего прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Допустимое ухудшение относительно baseline")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(main_async(args))
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+    if report.get("regressions"):
+        sys.exit(1)
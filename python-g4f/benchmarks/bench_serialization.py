@@ -0,0 +1,118 @@
+"""
+Микробенчмарк сериализации ответов по размеру ответа
+
+Для ответов разного размера (символов в content) замеряет время на один
+ответ:
+
+- pydantic - путь response_model=ChatResponse: валидация ChatResponse и
+  сериализация через response_field маршрута /v1/chat/completions, затем
+  JSONResponse (то, что FastAPI делает без FAST_JSON);
+- fast_pydantic_core, fast_orjson - FastJSONResponse с кодировщиком
+  pydantic_core и orjson (FAST_JSON=true без orjson и с ним);
+- sse_chunk_* - кодирование одного SSE чанка всеми кодировщиками
+  (json - формат без FAST_JSON).
+
+Текст ответа - смесь латиницы и кириллицы. Результат печатается в
+формате JSON (микросекунды на ответ).
+
+Запуск (из каталога python-g4f):
+    python benchmarks/bench_serialization.py --sizes 100 1000 10000 100000 1000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+import main
+from services import fast_json
+
+TEXT = "Hello, мир! The quick brown fox прыгает через ленивую собаку. "
+
+
+def make_result(size: int) -> dict:
+    content = (TEXT * (size // len(TEXT) + 1))[:size]
+    return {"content": content, "model": "gpt-4", "finish_reason": "stop", "messages_count": 3}
+
+
+def measure(func: Callable[[], object], min_time: float) -> float:
+    """Среднее время вызова, микросекунды (повторяется не меньше min_time секунд)"""
+    func()
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        for _ in range(10):
+            func()
+        calls += 10
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            return round(elapsed / calls * 1e6, 2)
+
+
+def run(size: int, args, response_field, loop) -> dict:
+    result = make_result(size)
+
+    def pydantic_path():
+        content = loop.run_until_complete(serialize_response(
+            field=response_field,
+            response_content=main.ChatResponse(success=True, data=result),
+            is_coroutine=True
+        ))
+        return JSONResponse(content).body
+
+    chunk = {
+        "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4",
+        "choices": [{"index": 0, "delta": {"content": result["content"][:args.chunk_size]}, "finish_reason": None}],
+    }
+    body = {"success": True, "data": result, "error": None}
+
+    timings = {"pydantic": measure(pydantic_path, args.min_time)}
+    for backend, encode in fast_json.ENCODERS.items():
+        if backend != "json":
+            timings[f"fast_{backend}"] = measure(lambda: encode(body), args.min_time)
+    for backend, encode in fast_json.ENCODERS.items():
+        timings[f"sse_chunk_{backend}"] = measure(lambda: f"data: {encode(chunk).decode()}\n\n", args.min_time)
+
+    baseline = timings["pydantic"]
+    return {
+        "size_chars": size,
+        "body_bytes": len(fast_json.ENCODERS["pydantic_core"](body)),
+        "us_per_response": timings,
+        "speedup_vs_pydantic": {
+            name: round(baseline / value, 2) for name, value in timings.items()
+            if name.startswith("fast_") and value
+        },
+    }
+
+
+def main_bench(args) -> dict:
+    route = next(route for route in main.app.routes if getattr(route, "path", None) == "/v1/chat/completions")
+    loop = asyncio.new_event_loop()
+    try:
+        return {
+            "orjson_installed": "orjson" in fast_json.ENCODERS,
+            "chunk_size": args.chunk_size,
+            "results": [run(size, args, route.response_field, loop) for size in args.sizes],
+        }
+    finally:
+        loop.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000, 1000000],
+                        help="Размеры ответа, символов")
+    parser.add_argument("--chunk-size", type=int, default=16, help="Символов в SSE чанке")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Минимальное время замера одного варианта, с")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    print(json.dumps(main_bench(parse_args()), ensure_ascii=False, indent=2))
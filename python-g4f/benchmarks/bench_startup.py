@@ -0,0 +1,117 @@
+"""
+Бенчмарк времени запуска сервиса
+
+Запускает uvicorn с main:app в отдельном процессе и замеряет, через
+сколько после старта процесса /health/live и /health/ready начинают
+отвечать 200. Каждый прогон идёт во временном каталоге (своя база
+данных): первый запуск - холодный, со созданием схемы, остальные - с
+уже готовой схемой. Также отдельно замеряется время импорта main.
+Результат печатается в формате JSON.
+
+Запуск (из каталога python-g4f):
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def status(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 0
+
+
+def measure_import(workdir: str) -> float:
+    """Время `import main` в новом процессе, секунды"""
+    code = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=workdir, env=_env(), stderr=subprocess.DEVNULL)
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = APP_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    # Стартовый бенчмарк не должен обращаться к провайдерам
+    env.setdefault("PROBER_ENABLED", "false")
+    return env
+
+
+def measure_startup(workdir: str, timeout: float) -> dict:
+    """Запустить сервис и дождаться live и ready"""
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    result = {"live_s": None, "ready_s": None}
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Сервис завершился с кодом {process.returncode}")
+            if result["live_s"] is None and status(f"{base}/health/live") == 200:
+                result["live_s"] = round(time.perf_counter() - started, 3)
+            if result["live_s"] is not None and status(f"{base}/health/ready") == 200:
+                result["ready_s"] = round(time.perf_counter() - started, 3)
+                break
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    return result
+
+
+def main(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="g4f-startup-")
+    try:
+        runs = []
+        for index in range(args.runs):
+            run = measure_startup(workdir, args.timeout)
+            run["schema"] = "cold" if index == 0 else "current"
+            runs.append(run)
+
+        warm = [run for run in runs if run["schema"] == "current"]
+        return {
+            "import_main_s": round(measure_import(workdir), 3),
+            "runs": runs,
+            "cold": runs[0],
+            "warm_avg": {
+                key: round(sum(run[key] for run in warm) / len(warm), 3) if warm and all(run[key] for run in warm) else None
+                for key in ("live_s", "ready_s")
+            },
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Запусков сервиса (первый - с новой базой)")
+    parser.add_argument("--timeout", type=float, default=60, help="Сколько ждать готовности, с")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    print(json.dumps(main(parse_args()), ensure_ascii=False, indent=2))
@@ -0,0 +1,207 @@
+"""
+Бенчмарк масштабирования по числу процессов uvicorn (--workers)
+
+Для каждого числа worker'ов запускает uvicorn с benchmarks/stub_app.py
+(заглушка провайдера с задержкой и процессорным временем на ответ) и
+нагружает /v1/chat/completions из нескольких клиентских процессов в
+течение --duration секунд. При нескольких worker'ах включается общее
+состояние (SHARED_STATE_PATH), а квоты ключа (--rpm, --max-concurrent)
+проверяются через него. Печатает JSON: пропускная способность, p50/p95
+задержки и ускорение относительно первого прогона.
+
+Прирост ограничен числом ядер: процессы сервиса и клиенты делят одну
+машину (число ядер - в поле cpu_count отчёта).
+
+Запуск (из каталога python-g4f):
+    python benchmarks/bench_workers.py --workers 1 2 4 --duration 10 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from typing import List, Optional
+
+import aiohttp
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def status(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 0
+
+
+def percentiles(values: List[float]) -> Optional[dict]:
+    if not values:
+        return None
+    values = sorted(values)
+
+    def rank(q: float) -> float:
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    return {
+        "p50_ms": round(rank(0.50) * 1000, 2),
+        "p95_ms": round(rank(0.95) * 1000, 2),
+        "p99_ms": round(rank(0.99) * 1000, 2),
+    }
+
+
+async def _load(url: str, duration: float, concurrency: int, client: int, stream: bool) -> dict:
+    headers = {"X-API-Key": "bench", "X-G4F-Cache": "off"}
+    latencies = []
+    statuses = {}
+    deadline = time.perf_counter() + duration
+    counter = 0
+
+    async def one_client(session: aiohttp.ClientSession):
+        nonlocal counter
+        while time.perf_counter() < deadline:
+            counter += 1
+            # Разные промпты, чтобы запросы не объединялись single-flight
+            body = {
+                "model": "gpt-4",
+                "messages": [{"role": "user", "content": f"bench {client} {counter}"}],
+                "stream": stream
+            }
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=body, headers=headers) as response:
+                    await response.read()
+                    code = response.status
+            except aiohttp.ClientError:
+                code = 0
+            statuses[code] = statuses.get(code, 0) + 1
+            if code == 200:
+                latencies.append(time.perf_counter() - started)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(one_client(session) for _ in range(concurrency)))
+    return {"latencies": latencies, "statuses": statuses}
+
+
+def load_process(args: tuple) -> dict:
+    """Клиентский процесс: свой event loop и своя сессия aiohttp"""
+    return asyncio.run(_load(*args))
+
+
+def start_service(workers: int, workdir: str, port: int, args) -> subprocess.Popen:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([APP_DIR, BENCH_DIR, env.get("PYTHONPATH", "")])
+    env.update({
+        "PROBER_ENABLED": "false",
+        "WORKERS": str(workers),
+        "STUB_LATENCY": str(args.latency),
+        "STUB_CPU": str(args.cpu),
+        "BENCH_KEY_RPM": str(args.rpm),
+        "BENCH_KEY_MAX_CONCURRENT": str(args.max_concurrent),
+        "SHARED_STATE_PATH": os.path.join(workdir, "shared_state.sqlite3") if workers > 1 or args.shared else "",
+    })
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "stub_app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def run(workers: int, args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="g4f-workers-")
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    process = start_service(workers, workdir, port, args)
+    try:
+        deadline = time.perf_counter() + args.timeout
+        while status(f"{base}/health/ready") != 200:
+            if process.poll() is not None:
+                raise RuntimeError(f"Сервис завершился с кодом {process.returncode}")
+            if time.perf_counter() > deadline:
+                raise RuntimeError("Сервис не стал готов")
+            time.sleep(0.05)
+        # Остальные worker'ы могут запускаться чуть дольше первого
+        time.sleep(args.settle)
+
+        per_client = max(1, args.concurrency // args.clients)
+        jobs = [
+            (f"{base}/v1/chat/completions", args.duration, per_client, client, args.stream)
+            for client in range(args.clients)
+        ]
+        started = time.perf_counter()
+        with multiprocessing.Pool(args.clients) as pool:
+            results = pool.map(load_process, jobs)
+        elapsed = time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = [value for result in results for value in result["latencies"]]
+    statuses = {}
+    for result in results:
+        for code, count in result["statuses"].items():
+            statuses[str(code)] = statuses.get(str(code), 0) + count
+    return {
+        "workers": workers,
+        "shared_state": workers > 1 or args.shared,
+        "ok": len(latencies),
+        "statuses": statuses,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2),
+        "latency": percentiles(latencies),
+    }
+
+
+def main(args) -> dict:
+    runs = [run(workers, args) for workers in args.workers]
+    base_rps = runs[0]["rps"] or None
+    for item in runs:
+        item["speedup"] = round(item["rps"] / base_rps, 2) if base_rps else None
+    return {
+        "cpu_count": os.cpu_count(),
+        "config": {
+            key: getattr(args, key)
+            for key in ("duration", "concurrency", "clients", "latency", "cpu", "stream", "rpm", "max_concurrent")
+        },
+        "runs": runs,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Числа worker'ов для сравнения")
+    parser.add_argument("--duration", type=float, default=10, help="Длительность нагрузки на прогон, с")
+    parser.add_argument("--concurrency", type=int, default=64, help="Одновременных запросов (на всех клиентов)")
+    parser.add_argument("--clients", type=int, default=2, help="Клиентских процессов")
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка провайдера, с")
+    parser.add_argument("--cpu", type=float, default=0.002, help="Процессорное время на ответ в сервисе, с")
+    parser.add_argument("--stream", action="store_true", help="Потоковые запросы")
+    parser.add_argument("--rpm", type=int, default=0, help="Квота ключа запросов в минуту (0 - без ограничения)")
+    parser.add_argument("--max-concurrent", type=int, default=0, help="Квота одновременных запросов ключа")
+    parser.add_argument("--shared", action="store_true", help="Общее состояние и при одном worker'е")
+    parser.add_argument("--settle", type=float, default=1.0, help="Пауза после готовности перед нагрузкой, с")
+    parser.add_argument("--timeout", type=float, default=60, help="Сколько ждать готовности, с")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    print(json.dumps(main(parse_args()), ensure_ascii=False, indent=2))
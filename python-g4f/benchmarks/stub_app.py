@@ -0,0 +1,40 @@
+"""
+main:app с заглушкой провайдера для запуска через uvicorn
+
+Используется bench_workers.py: uvicorn запускает каждый worker как
+отдельный процесс, поэтому заглушка подключается при импорте модуля.
+Параметры берутся из переменных окружения:
+
+    STUB_LATENCY, STUB_CPU, STUB_CHUNKS - задержка провайдера (с),
+        процессорное время на ответ (с), чанков в потоковом ответе
+    BENCH_KEY_RPM, BENCH_KEY_MAX_CONCURRENT - квоты, с которыми проходит
+        любой X-API-Key (0 - без ограничения)
+
+Запуск (из каталога python-g4f):
+    uvicorn --app-dir benchmarks stub_app:app --workers 2
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from services import upstream
+from services.key_cache import KeyInfo
+from stub_provider import stub_client
+
+upstream.client = stub_client(
+    latency=float(os.getenv("STUB_LATENCY", "0.05")),
+    cpu=float(os.getenv("STUB_CPU", "0.002")),
+    chunks=int(os.getenv("STUB_CHUNKS", "20")),
+    chunk_interval=0.0
+)
+
+BENCH_KEY = KeyInfo(
+    valid=True,
+    requests_per_minute=int(os.getenv("BENCH_KEY_RPM", "0")),
+    max_concurrent=int(os.getenv("BENCH_KEY_MAX_CONCURRENT", "0"))
+)
+main.app.dependency_overrides[main.api_key_check] = lambda: BENCH_KEY
+
+app = main.app
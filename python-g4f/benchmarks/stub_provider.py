@@ -0,0 +1,91 @@
+"""
+Заглушка g4f клиента для бенчмарков
+
+Повторяет интерфейс AsyncClient, которым пользуется services.upstream:
+client.chat.completions.create(...) возвращает awaitable с ChatCompletion,
+а при stream=True - асинхронный итератор ChatCompletionChunk. Задержка,
+разброс, скорость чанков, доля ошибок и процессорное время на ответ
+(как у разбора ответа настоящего провайдера) настраиваются; сеть не нужна.
+"""
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+from typing import Optional
+
+
+class StubFailure(Exception):
+    """Ошибка, которую заглушка отдаёт вместо ответа"""
+
+
+class StubCompletions:
+    def __init__(
+        self,
+        latency: float = 0.2,
+        jitter: float = 0.0,
+        chunks: int = 20,
+        chunk_interval: float = 0.01,
+        failure_rate: float = 0.0,
+        cpu: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.chunks = chunks
+        self.chunk_interval = chunk_interval
+        self.failure_rate = failure_rate
+        self.cpu = cpu
+        self._random = random.Random(seed)
+
+        self.calls = 0
+        self.failures = 0
+
+    def _delay(self) -> float:
+        """Задержка до ответа (или первого чанка): latency ± jitter"""
+        return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def _burn(self):
+        """Занять процессор на cpu секунд (блокирует event loop, как синхронный разбор ответа)"""
+        deadline = time.perf_counter() + self.cpu
+        while time.perf_counter() < deadline:
+            pass
+
+    def _should_fail(self) -> bool:
+        self.calls += 1
+        if self._random.random() < self.failure_rate:
+            self.failures += 1
+            return True
+        return False
+
+    def create(self, model, messages, provider=None, stream: bool = False, **kwargs):
+        if stream:
+            return self._stream(model)
+        return self._complete(model)
+
+    async def _complete(self, model):
+        fail = self._should_fail()
+        await asyncio.sleep(self._delay())
+        if fail:
+            raise StubFailure(f"stub: провайдер не ответил ({model})")
+        self._burn()
+        message = SimpleNamespace(content="ok " * self.chunks)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")])
+
+    async def _stream(self, model):
+        fail = self._should_fail()
+        await asyncio.sleep(self._delay())
+        if fail:
+            raise StubFailure(f"stub: провайдер не начал поток ({model})")
+        self._burn()
+        for index in range(self.chunks):
+            if index:
+                await asyncio.sleep(self.chunk_interval)
+            last = index == self.chunks - 1
+            delta = SimpleNamespace(content="ok ", role="assistant")
+            choice = SimpleNamespace(delta=delta, finish_reason="stop" if last else None)
+            yield SimpleNamespace(choices=[choice])
+
+
+def stub_client(**kwargs) -> SimpleNamespace:
+    """Объект с интерфейсом g4f AsyncClient поверх StubCompletions"""
+    return SimpleNamespace(chat=SimpleNamespace(completions=StubCompletions(**kwargs)))
@@ -1,40 +1,120 @@
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import date
 
-from tortoise import Tortoise
-from models.api_key import APIKey
+from tortoise.functions import Sum
+from tortoise.transactions import in_transaction
+from models.api_key import APIKey, APIKeyQuota, APIKeyUsage
 
-from g4f.client import Client
+from services import batch, db, dispatch, metrics, streaming, upstream
+from services.admission import Overloaded, Ticket, admission
+from services.context_budget import ContextReport, context_budget
+from services.deadline import ClientDisconnected, Deadline, DeadlineExceeded, guard, parse as parse_deadline
+from services.fast_json import FastJSONResponse
+from services.http_pool import http_pool, provider_urls
+import config
+from services.key_cache import INVALID_KEY, KeyInfo, key_cache
+from services.model_registry import RegistryError, model_registry
+from services.prober import provider_prober
+from services.provider_router import provider_router
+from services.rate_limit import Lease, RateLimited, key_limiter
+from services.response_cache import CACHE_MODES, make_key, response_cache
+from services.shared_state import shared_state
+from services.similarity_cache import similarity_cache
+from services.singleflight import singleflight
+from services.tools import tool_orchestrator
+from services.usage import estimate_tokens, usage_recorder
+import asyncio
+import json
 import logging
+import math
 import os
+import time
 
 import secrets
-import nest_asyncio
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Исправление event loop конфликта
-nest_asyncio.apply()
-
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Готовность сервиса для /health/ready (g4f проверяется через upstream.is_loaded)
+readiness = {"database": False, "error": None}
+
+async def warm_up(started: float):
+    """Загрузить g4f в фоне; до окончания прогрева /health/ready отвечает 503"""
+    try:
+        await upstream.get_client()
+    except Exception as e:
+        readiness["error"] = f"Не удалось загрузить g4f: {e}"
+        logger.error(readiness["error"])
+        return
+    http_pool.attach_g4f()
+    logger.info(f"g4f загружен, сервис готов через {time.perf_counter() - started:.2f} с после старта")
+
+    if config.HTTP_POOL_PRECONNECT:
+        await http_pool.preconnect(provider_urls(model_registry.current.provider_models))
+
 async def lifespan(app):
-    # Инициализация базы данных Tortoise ORM
-    await Tortoise.init(
-        db_url='sqlite://db.sqlite3',
-        modules={'models': ['models.api_key']}
-    )
-    await Tortoise.generate_schemas()
+    started = time.perf_counter()
+
+    # Инициализация базы данных Tortoise ORM (схема создаётся только при изменении моделей)
+    await db.init_db()
+    readiness["database"] = True
     logger.info("База данных инициализирована")
+
+    # Синхронные провайдеры g4f выполняются в ограниченном пуле потоков
+    executor = upstream.create_executor()
+    asyncio.get_running_loop().set_default_executor(executor)
+
+    # Общий пул HTTP соединений к провайдерам (подключается к g4f после прогрева)
+    http_pool.open()
+
+    # Несколько процессов: квоты, проверка провайдеров и дисковый кэш ответов общие
+    if config.SHARED_STATE_PATH:
+        shared_state.open()
+        key_limiter.shared = shared_state
+        provider_prober.shared = shared_state
+
+    disk_cache_path = config.RESPONSE_CACHE_DISK_PATH or config.SHARED_STATE_PATH
+    if disk_cache_path:
+        response_cache.open_disk(disk_cache_path, config.RESPONSE_CACHE_DISK_MAX_ENTRIES)
+
+    # Фоновые задачи: прогрев g4f, перезагрузка реестра моделей, синхронизация процессов и проверка провайдеров
+    background = [asyncio.create_task(warm_up(started))]
+    if shared_state.enabled:
+        background.append(asyncio.create_task(shared_state.run()))
+    if config.REGISTRY_RELOAD_INTERVAL > 0:
+        background.append(asyncio.create_task(model_registry.watch(config.REGISTRY_RELOAD_INTERVAL)))
+    if config.USAGE_ENABLED:
+        background.append(asyncio.create_task(usage_recorder.run()))
+    if config.PROBER_ENABLED:
+        background.append(asyncio.create_task(
+            provider_prober.run(lambda: model_registry.current.text_model_providers())
+        ))
+
     yield
     
-    await Tortoise.close_connections()
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    # Остаток статистики использования записывается до закрытия базы данных
+    await usage_recorder.flush()
+    response_cache.close_disk()
+    await key_limiter.drain()
+    key_limiter.shared = None
+    provider_prober.shared = None
+    shared_state.close()
+    await http_pool.close()
+    executor.shutdown(wait=False, cancel_futures=True)
+    
+    await db.close_db()
 
 async def admin_key_check(admin_key: str = Header(alias="X-Admin-Key")):
     expected_key = os.getenv("ADMIN_BASE_KEY")
@@ -42,13 +122,53 @@ async def admin_key_check(admin_key: str = Header(alias="X-Admin-Key")):
         raise HTTPException(status_code=403, detail="Недействительный административный ключ")
     return True
 
-async def api_key_check(api_key: str = Header(alias="X-API-Key")):
-    api_key_obj = await APIKey.get_or_none(key=api_key)
+async def api_key_check(api_key: str = Header(alias="X-API-Key")) -> KeyInfo:
+    started = time.perf_counter()
+
+    info = key_cache.get(api_key)
+    source = "cache"
+    if info is None:
+        info = INVALID_KEY
+        if await APIKey.exists(key=api_key):
+            quota = await APIKeyQuota.get_or_none(key=api_key)
+            info = KeyInfo(
+                valid=True,
+                requests_per_minute=quota.requests_per_minute if quota else None,
+                max_concurrent=quota.max_concurrent if quota else None
+            )
+        key_cache.put(api_key, info)
+        source = "db"
 
-    if api_key_obj is None:
+    elapsed = time.perf_counter() - started
+    key_cache.observe_lookup(elapsed)
+    metrics.AUTH_LOOKUP.observe(source, value=elapsed)
+
+    if not info.valid:
         raise HTTPException(status_code=403, detail="Недействительный API ключ")
 
-    return True
+    return info
+
+async def key_quota_check(api_key: str = Header(alias="X-API-Key"), info: KeyInfo = Depends(api_key_check)):
+    """
+    Проверить квоты ключа и занять слот на время запроса
+
+    Потоковый ответ забирает Lease через detach() и освобождает его сам,
+    когда поток закончится.
+    """
+    try:
+        lease = await key_limiter.acquire(api_key, info.requests_per_minute, info.max_concurrent)
+    except RateLimited as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        )
+
+    try:
+        yield lease
+    finally:
+        if not lease.detached:
+            await lease.arelease()
 
 # Создание FastAPI приложения
 app = FastAPI(
@@ -67,98 +187,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Метрики HTTP запросов для /metrics
+app.add_middleware(metrics.MetricsMiddleware)
 
-# Инициализация G4F клиента
-client = Client()
-
-# Модели и их провайдеры (проверено - работают без API ключей)
-MODEL_PROVIDERS = {
-    # ==========================================
-    # GPT MODELS (OpenAI)
-    # ==========================================
-    "gpt-4": ["ApiAirforce"],
-    "gpt-4o": ["ApiAirforce"],
-    "gpt-4o-mini": ["ApiAirforce"],
-    "gpt-3.5-turbo": ["ApiAirforce"],
-    
-    # ==========================================
-    # CLAUDE MODELS (Anthropic)
-    # ==========================================
-    "claude-sonnet-4": ["ApiAirforce"],
-    "claude-sonnet-4.5": ["ApiAirforce"],
-    "claude-haiku-4.5": ["ApiAirforce"],
-    "claude-3.5-sonnet": ["ApiAirforce"],
-    "claude-3-sonnet": ["ApiAirforce"],
-    "claude-3-haiku": ["ApiAirforce"],
-    
-    # ==========================================
-    # GEMINI MODELS (Google)
-    # ==========================================
-    "gemini-2.5-pro": ["ApiAirforce"],
-    "gemini-2.5-flash": ["ApiAirforce"],
-    "gemini-2.5-flash-lite": ["ApiAirforce"],
-    
-    # ==========================================
-    # LLAMA MODELS (Meta)
-    # ==========================================
-    "llama-3.3": ["MetaAI", "DeepInfra", "HuggingFace"],
-    "llama-4-maverick": ["MetaAI", "DeepInfra"],
-    "llama-4-scout": ["MetaAI", "DeepInfra"],
-    
-    # ==========================================
-    # DEEPSEEK MODELS
-    # ==========================================
-    "deepseek-v3": ["DeepInfra"],
-    "deepseek-v3.1": ["DeepInfra"],
-    "deepseek-v3.2": ["DeepInfra"],
-    "deepseek-r1": ["DeepInfra"],
-    "deepseek-chat": ["DeepInfra"],
-    "deepseek-reasoner": ["DeepInfra"],
-    
-    # ==========================================
-    # MISTRAL MODELS
-    # ==========================================
-    "mistral-small-3.1-24b": ["DeepInfra", "HuggingFace"],
-    "mistral-medium-3": ["DeepInfra", "HuggingFace"],
-    
-    # ==========================================
-    # QWEN MODELS (Alibaba)
-    # ==========================================
-    "qwen2.5-coder-32b": ["Qwen", "DeepInfra", "HuggingFace"],
-    "qwen3-coder": ["Qwen", "DeepInfra"],
-    "qwen3-coder-big": ["Qwen"],
-    "qwen3-next": ["Qwen"],
-    "qwen3-omni": ["Qwen"],
-    
-    # ==========================================
-    # GLM MODELS (Zhipu AI)
-    # ==========================================
-    "glm-4.5": ["GLM"],
-    "glm-4.5-air": ["GLM"],
-    "glm-4.6": ["GLM"],
-    
-    # ==========================================
-    # HERMES MODELS
-    # ==========================================
-    "hermes-3-405b": ["DeepInfra", "HuggingFace"],
-    "hermes-4-405b": ["DeepInfra"],
-    
-    # ==========================================
-    # OTHER TEXT MODELS
-    # ==========================================
-    "goliath-120b": ["DeepInfra"],
-    "qwq-32b-fast": ["HuggingFace"],
-    
-    # ==========================================
-    # IMAGE GENERATION MODELS
-    # ==========================================
-    "dall-e-3": ["PollinationsAI", "PollinationsImage"],
-    "sdxl": ["PollinationsImage"],
-    "sd-3.5": ["PollinationsImage"],
-    "sd-3.5-large": ["StabilityAI_SD35Large", "PollinationsImage"],
-    "flux-schnell": ["BlackForestLabs_Flux1Dev", "PollinationsImage"],
-    "flux-dev": ["BlackForestLabs_Flux1Dev"],
-}
 
 # Модели данных
 class Message(BaseModel):
@@ -170,11 +201,341 @@ class ChatRequest(BaseModel):
     model: Optional[str] = "gpt-4"
     stream: Optional[bool] = False
 
+class ToolChatRequest(BaseModel):
+    messages: List[dict]
+    tools: List[dict]
+    model: Optional[str] = "gpt-4"
+    tool_choice: Optional[Any] = "auto"
+    tool_session: Optional[str] = None
+    max_steps: Optional[int] = Field(None, ge=1)
+
+class BatchRequest(BaseModel):
+    requests: List[ChatRequest]
+    concurrency: Optional[int] = None
+
+class BulkGenerateRequest(BaseModel):
+    count: int
+    remark: Optional[str] = None
+
+class BulkRevokeRequest(BaseModel):
+    keys: List[str]
+
 class ChatResponse(BaseModel):
     success: bool
     data: Optional[dict] = None
     error: Optional[str] = None
 
+async def forget_keys(keys: List[str]):
+    """Сбросить кэш и квоты ключей после отзыва или смены квот - во всех процессах"""
+    for key in keys:
+        key_cache.invalidate(key)
+        await key_limiter.forget(key)
+    if shared_state.enabled and keys:
+        await shared_state.offload(shared_state.publish_keys, keys)
+
+def record_fallback_index(model: str, provider: str):
+    """Учесть, какой по счёту провайдер из реестра моделей ответил"""
+    static_providers = model_registry.providers(model)
+    index = static_providers.index(provider) if provider in static_providers else -1
+    metrics.FALLBACK_INDEX.inc(model_registry.metric_label(model), index)
+
+async def admit() -> Ticket:
+    """Занять слот admission control или сразу отказать с 503 при перегрузке"""
+    started = time.perf_counter()
+    try:
+        ticket = await admission.acquire()
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        )
+    metrics.ADMISSION_WAIT.observe(value=time.perf_counter() - started)
+    return ticket
+
+async def admit_unless_joining(request_key: str, stream: bool) -> Ticket:
+    """
+    Admission control для completion-запроса
+
+    Запрос, который присоединится к уже идущему (single-flight), слот не занимает.
+    """
+    if config.SINGLEFLIGHT_ENABLED and singleflight.in_flight(request_key, stream=stream):
+        return Ticket()
+    return await admit()
+
+def prepare_messages(request: ChatRequest) -> List[dict]:
+    """Проверить сообщения запроса и привести их к формату OpenAI"""
+    # Валидация сообщений
+    if not request.messages or len(request.messages) == 0:
+        raise HTTPException(
+            status_code=400, 
+            detail="Массив messages обязателен и должен содержать хотя бы одно сообщение"
+        )
+    
+    # Проверка ролей
+    valid_roles = {'system', 'user', 'assistant'}
+    for msg in request.messages:
+        if msg.role not in valid_roles:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Роль '{msg.role}' недопустима. Используйте: {valid_roles}"
+            )
+    
+    return [{"role": msg.role, "content": msg.content} for msg in request.messages]
+
+def prepare_tool_request(request: ToolChatRequest) -> List[dict]:
+    """Проверить историю и определения функций запроса /v1/chat/tools"""
+    if not request.messages:
+        raise HTTPException(status_code=400, detail="Массив messages обязателен и должен содержать хотя бы одно сообщение")
+    valid_roles = {'system', 'user', 'assistant', 'tool'}
+    for msg in request.messages:
+        if msg.get("role") not in valid_roles:
+            raise HTTPException(status_code=400, detail=f"Роль '{msg.get('role')}' недопустима. Используйте: {valid_roles}")
+        if msg.get("content") is not None and not isinstance(msg["content"], str):
+            raise HTTPException(status_code=400, detail="content сообщения должен быть строкой")
+    if not request.tools:
+        raise HTTPException(status_code=400, detail="Массив tools обязателен")
+    for tool in request.tools:
+        if tool.get("type") != "function" or not (tool.get("function") or {}).get("name"):
+            raise HTTPException(status_code=400, detail="Поддерживаются только tools с type=function и function.name")
+    return request.messages
+
+def fit_context(model: str, messages: List[dict]) -> Tuple[List[dict], ContextReport]:
+    """Обрезать историю под контекст модели из реестра"""
+    messages, report = context_budget.fit(messages, model_registry.context_tokens(model))
+    if report.trimmed:
+        logger.info(
+            f"История для {model} обрезана: {report.trimmed_messages} сообщений, "
+            f"{report.original_tokens - report.prompt_tokens} из {report.original_tokens} токенов"
+        )
+    return messages, report
+
+def context_headers(report: ContextReport) -> dict:
+    """Заголовок ответа: сколько токенов истории обрезано"""
+    if not report.trimmed:
+        return {}
+    return {"X-G4F-Context-Trimmed": str(report.original_tokens - report.prompt_tokens)}
+
+def with_context(result: dict, report: ContextReport) -> dict:
+    """Результат completion с отчётом об обрезке истории (результат из кэша не меняется)"""
+    if not report.trimmed:
+        return result
+    return {**result, "context": report.as_dict()}
+
+def request_deadline(value: Optional[str], stream: bool = False) -> Deadline:
+    """Срок запроса из заголовка X-Request-Deadline (без него - срок по умолчанию)"""
+    try:
+        return parse_deadline(value, config.STREAM_DEADLINE_DEFAULT if stream else config.REQUEST_DEADLINE_DEFAULT)
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Недопустимый X-Request-Deadline '{value}'. Укажите секунды на запрос или время UNIX в будущем"
+        )
+
+async def within_deadline(awaitable, deadline: Deadline, http_request: Optional[Request] = None):
+    """
+    Дождаться работы с провайдерами в пределах срока запроса
+
+    Если срок истёк (504) или клиент отключился (499), работа отменяется
+    и слоты провайдеров освобождаются.
+    """
+    try:
+        return await guard(awaitable, deadline, http_request.receive if http_request is not None else None)
+    except DeadlineExceeded:
+        metrics.ERRORS.inc("request", "DeadlineExceeded")
+        # Срок этого запроса не истёк - истёк срок общего вызова single-flight
+        budget = deadline.budget if deadline.expired() else config.REQUEST_DEADLINE_MAX
+        raise HTTPException(status_code=504, detail=f"Истёк срок запроса ({budget:g} с)")
+    except ClientDisconnected:
+        metrics.ERRORS.inc("request", "ClientDisconnected")
+        logger.info("Клиент отключился, запрос к провайдерам отменён")
+        raise HTTPException(status_code=499, detail="Клиент отключился")
+
+def upstream_deadline(deadline: Deadline) -> Deadline:
+    """
+    Срок, который делится между попытками провайдеров
+
+    Общий вызов single-flight ждут запросы с разными сроками, поэтому он
+    идёт со сроком REQUEST_DEADLINE_MAX, а каждый запрос ждёт его в пределах
+    своего срока (within_deadline).
+    """
+    return Deadline(config.REQUEST_DEADLINE_MAX) if config.SINGLEFLIGHT_ENABLED else deadline
+
+def check_cache_mode(cache_mode: Optional[str]) -> str:
+    """Режим кэша ответов из заголовка X-G4F-Cache (по умолчанию RESPONSE_CACHE_DEFAULT)"""
+    cache_mode = (cache_mode or config.RESPONSE_CACHE_DEFAULT).lower()
+    if cache_mode not in CACHE_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Недопустимый X-G4F-Cache '{cache_mode}'. Используйте: {', '.join(CACHE_MODES)}"
+        )
+    return cache_mode
+
+def order_providers(model: str) -> List[str]:
+    """Провайдеры модели: самые быстрые здоровые идут первыми, отключённые пропускаются"""
+    providers = provider_router.order(model, model_registry.providers(model))
+    if not providers:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Все провайдеры для модели {model} временно отключены после ошибок",
+            headers={"Retry-After": str(int(config.ROUTER_OPEN_SECONDS))}
+        )
+    return providers
+
+async def complete_chat(model: str, messages: List[dict], cache_mode: str, started: float,
+                        deadline: Optional[Deadline] = None) -> Tuple[dict, bool]:
+    """
+    Обычный (не потоковый) chat completion: кэш, admission control, перебор провайдеров
+    
+    Args:
+        model: Название модели
+        messages: Сообщения в формате OpenAI
+        cache_mode: Режим кэша ответов: on, off или refresh
+        started: Время начала запроса (perf_counter) для TTFT
+        deadline: Срок запроса (без single-flight делится между попытками провайдеров)
+        
+    Returns:
+        (данные ответа, ответ взят из кэша)
+    """
+    request_key = make_key(model, messages)
+    cache_key = request_key if cache_mode != "off" else None
+    if cache_mode == "on":
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Ответ взят из кэша")
+            return {**cached, "model": model, "messages_count": len(messages)}, True
+
+        # Почти такой же запрос (пробелы, регистр, пунктуация, несколько слов)
+        similar = similarity_cache.get(model, messages)
+        if similar is not None:
+            cached, similarity = similar
+            logger.info(f"Ответ взят из кэша похожих запросов (сходство {similarity:.2f})")
+            return {**cached, "model": model, "messages_count": len(messages), "cache_similarity": similarity}, True
+
+    # Отправка запроса к G4F
+    logger.info(f"Отправка запроса к G4F с моделью {model}")
+    providers = order_providers(model)
+    ticket = await admit_unless_joining(request_key, stream=False)
+
+    # Попробовать провайдеров по очереди (или с hedging, если он включён для модели)
+    policy = model_registry.hedging_policy(model) if config.HEDGING_ENABLED else None
+    try:
+        complete = lambda: dispatch.complete(model, messages, providers, policy, deadline=upstream_deadline(deadline))
+        if config.SINGLEFLIGHT_ENABLED:
+            # Одинаковые одновременные запросы ждут один ответ провайдера
+            provider, response = await singleflight.do(request_key, complete)
+        else:
+            provider, response = await complete()
+    except dispatch.AllProvidersFailed as e:
+        metrics.ERRORS.inc("request", "AllProvidersFailed")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Все провайдеры для модели {model} недоступны. Последняя ошибка: {e}"
+        )
+    finally:
+        ticket.release()
+
+    metrics.TTFT.observe(model_registry.metric_label(model), "false", value=time.perf_counter() - started)
+    record_fallback_index(model, provider)
+
+    # Формирование ответа
+    result = {
+        "content": response.choices[0].message.content,
+        "model": model,
+        "finish_reason": response.choices[0].finish_reason,
+        "messages_count": len(messages)
+    }
+
+    if cache_key is not None and result["content"]:
+        value = {"content": result["content"], "finish_reason": result["finish_reason"]}
+        await response_cache.put(cache_key, value)
+        similarity_cache.put(model, messages, value)
+
+    return result, False
+
+# Допустимые поля группировки статистики использования
+USAGE_GROUP_FIELDS = ("key", "model", "day")
+
+# Ключей в одном SQL запросе массовых операций
+BULK_CHUNK = 500
+
+async def api_keys_page(cursor: Optional[str], limit: int) -> List[dict]:
+    """Страница API ключей после cursor (keyset pagination по первичному ключу)"""
+    query = APIKey.all()
+    if cursor is not None:
+        query = query.filter(key__gt=cursor)
+    return await query.order_by("key").limit(limit).values("key", "created_at", "remark")
+
+def etag_response(body: bytes, etag: str, if_none_match: Optional[str]) -> Response:
+    """Готовый JSON с ETag или 304 Not Modified, если клиент прислал тот же ETag"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def collect_service_metrics():
+    """Перенести статистику сервисов в метрики перед сбором"""
+    metrics.UPSTREAM_IN_FLIGHT.set(value=upstream.in_flight())
+
+    stats = admission.stats()
+    metrics.ADMISSION_QUEUE_DEPTH.set(value=stats["queue_depth"])
+    metrics.ADMISSION_ACTIVE.set(value=stats["active"])
+    metrics.ADMISSION_SHED.set("queue_full", value=stats["shed_queue_full"])
+    metrics.ADMISSION_SHED.set("wait_estimate", value=stats["shed_wait_estimate"])
+    metrics.ADMISSION_SHED.set("timeout", value=stats["shed_timeout"])
+
+    stats = key_cache.stats()
+    metrics.KEY_CACHE_LOOKUPS.set("hit", value=stats["hits"])
+    metrics.KEY_CACHE_LOOKUPS.set("miss", value=stats["misses"])
+    metrics.KEY_CACHE_ENTRIES.set(value=stats["size"])
+
+    stats = key_limiter.stats()
+    metrics.RATE_LIMITED.set("rate", value=stats["rejected_rate"])
+    metrics.RATE_LIMITED.set("concurrency", value=stats["rejected_concurrency"])
+
+    stats = response_cache.stats()
+    metrics.RESPONSE_CACHE_LOOKUPS.set("memory_hit", value=stats["memory_hits"])
+    metrics.RESPONSE_CACHE_LOOKUPS.set("disk_hit", value=stats["disk_hits"])
+    metrics.RESPONSE_CACHE_LOOKUPS.set("miss", value=stats["misses"])
+    metrics.RESPONSE_CACHE_EVICTIONS.set("memory", value=stats["evictions"])
+    metrics.RESPONSE_CACHE_EVICTIONS.set("disk", value=stats["disk_evictions"])
+    metrics.RESPONSE_CACHE_BYTES.set(value=stats["bytes"])
+
+    stats = similarity_cache.stats()
+    metrics.SIMILARITY_CACHE_LOOKUPS.set("exact_hit", value=stats["exact_hits"])
+    metrics.SIMILARITY_CACHE_LOOKUPS.set("near_hit", value=stats["near_hits"])
+    metrics.SIMILARITY_CACHE_LOOKUPS.set("miss", value=stats["misses"])
+
+    stats = singleflight.stats()
+    metrics.SINGLEFLIGHT_REQUESTS.set("completion", "leader", value=stats["leaders"])
+    metrics.SINGLEFLIGHT_REQUESTS.set("completion", "joined", value=stats["coalesced"])
+    metrics.SINGLEFLIGHT_REQUESTS.set("stream", "leader", value=stats["stream_leaders"])
+    metrics.SINGLEFLIGHT_REQUESTS.set("stream", "joined", value=stats["stream_coalesced"])
+
+    for model, stats in dispatch.hedging_snapshot().items():
+        metrics.HEDGES.set(model, "fired", value=stats["fired"])
+        metrics.HEDGES.set(model, "won", value=stats["won"])
+
+    for host, stats in http_pool.stats()["hosts"].items():
+        metrics.HTTP_POOL_CONNECTIONS.set(host, "new", value=stats["new_connections"])
+        metrics.HTTP_POOL_CONNECTIONS.set(host, "reused", value=stats["reused"])
+
+    for provider in set(provider_prober.results) | set(provider_prober.shared_results):
+        status = provider_prober.status(provider)["status"]
+        if status in ("active", "down"):
+            metrics.PROVIDER_UP.set(provider, value=int(status == "active"))
+
+    # Модели вне реестра в метриках объединены в "other": breaker не закрыт хотя бы у одной
+    circuit_open: Dict[Tuple[str, str], int] = {}
+    for model, providers in provider_router.snapshot()["models"].items():
+        for provider, stats in providers.items():
+            key = (model_registry.metric_label(model), provider)
+            circuit_open[key] = max(circuit_open.get(key, 0), int(stats["state"] != "closed"))
+    for (model, provider), value in circuit_open.items():
+        metrics.CIRCUIT_OPEN.set(model, provider, value=value)
+
+metrics.registry.add_collector(collect_service_metrics)
+
 # Роуты
 @app.get("/")
 async def root():
@@ -184,129 +545,361 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "chat": "/v1/chat/completions",
+            "batch": "/v1/batch/chat/completions",
             "models": "/v1/models",
             "test": "/v1/test",
+            "metrics": "/metrics",
             "docs": "/docs"
         }
     }
 
 @app.get("/health")
+@app.get("/health/live")
 async def health():
-    """Health check endpoint"""
+    """Liveness: процесс жив и обрабатывает запросы"""
     return {"status": "ok", "service": "g4f-api"}
 
-@app.post("/v1/chat/completions", response_model=ChatResponse, dependencies=[Depends(api_key_check)])
-async def chat_completions(request: ChatRequest):
+@app.get("/health/ready")
+async def health_ready(response: Response):
+    """
+    Readiness: база данных подключена и g4f загружен
+    
+    Returns:
+        Состояние проверок; 503, пока прогрев не закончился
+    """
+    checks = {
+        "database": readiness["database"],
+        "g4f": upstream.is_loaded()
+    }
+    ready = all(checks.values())
+    if not ready:
+        response.status_code = 503
+    return {
+        "status": "ready" if ready else "starting",
+        "service": "g4f-api",
+        "checks": checks,
+        "error": readiness["error"]
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.post("/v1/chat/completions", response_model=ChatResponse)
+async def chat_completions(
+    request: ChatRequest,
+    http_request: Request,
+    http_response: Response,
+    lease: Lease = Depends(key_quota_check),
+    api_key: str = Header(alias="X-API-Key"),
+    cache_mode: Optional[str] = Header(None, alias="X-G4F-Cache"),
+    deadline_header: Optional[str] = Header(None, alias="X-Request-Deadline")
+):
     """
     Создать chat completion через G4F
     
     Args:
         request: ChatRequest с messages, model и stream
+        cache_mode: Режим кэша ответов для запроса: on, off или refresh
+        deadline_header: Срок запроса: секунды или время UNIX
         
     Returns:
-        ChatResponse с ответом от AI
+        ChatResponse с ответом от AI или text/event-stream при stream=true
     """
+    started = time.perf_counter()
+    prompt_chars = None
     try:
         logger.info(f"Получен запрос с моделью: {request.model}")
         
-        # Валидация сообщений
-        if not request.messages or len(request.messages) == 0:
-            raise HTTPException(
-                status_code=400, 
-                detail="Массив messages обязателен и должен содержать хотя бы одно сообщение"
-            )
+        messages, context = fit_context(request.model, prepare_messages(request))
+        prompt_chars = sum(len(message["content"]) for message in messages)
         
-        # Проверка ролей
-        valid_roles = {'system', 'user', 'assistant'}
-        for msg in request.messages:
-            if msg.role not in valid_roles:
+        # Кэш ответов (только для обычных, не потоковых запросов)
+        cache_mode = check_cache_mode(cache_mode)
+        deadline = request_deadline(deadline_header, stream=bool(request.stream))
+
+        # Потоковый режим: чанки отдаются клиенту по мере генерации
+        if request.stream:
+            request_key = make_key(request.model, messages)
+            providers = order_providers(request.model)
+            ticket = await admit_unless_joining(request_key, stream=True)
+
+            open_source = lambda: streaming.provider_stream(
+                request.model, messages, providers,
+                on_open=lambda provider: record_fallback_index(request.model, provider),
+                deadline=upstream_deadline(deadline)
+            )
+            if config.SINGLEFLIGHT_ENABLED:
+                # Одинаковые потоки читают один ответ провайдера
+                stream = singleflight.stream(request_key, open_source)
+            else:
+                stream = open_source()
+
+            try:
+                first_chunk = await within_deadline(anext(stream), deadline, http_request)
+            except streaming.StreamUnavailable as e:
+                ticket.release()
+                metrics.ERRORS.inc("request", "AllProvidersFailed")
                 raise HTTPException(
-                    status_code=400,
-                    detail=f"Роль '{msg.role}' недопустима. Используйте: {valid_roles}"
+                    status_code=500,
+                    detail=f"Все провайдеры для модели {request.model} недоступны. Последняя ошибка: {e}"
                 )
-        
-        # Преобразование сообщений
-        messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
-        
-        # Отправка запроса к G4F
-        logger.info(f"Отправка запроса к G4F с моделью {request.model}")
+            except Exception:
+                ticket.release()
+                await stream.aclose()
+                raise
 
-        # Получить список провайдеров для модели
-        providers = MODEL_PROVIDERS.get(request.model, ["auto"])
+            metrics.TTFT.observe(model_registry.metric_label(request.model), "true", value=time.perf_counter() - started)
 
-        # Попробовать каждый провайдер
-        last_error = None
-        for provider in providers:
-            try:
-                logger.info(f"Пробуем провайдер: {provider}")
-
-                if provider == "auto":
-                    # Автоматический выбор провайдера
-                    response = client.chat.completions.create(
-                        model=request.model,
-                        messages=messages,
-                        stream=request.stream
-                    )
-                else:
-                    # Явно указанный провайдер
-                    response = client.chat.completions.create(
-                        model=request.model,
-                        messages=messages,
-                        provider=provider,
-                        stream=request.stream
-                    )
-
-                logger.info(f"Успешно! Провайдер: {provider}")
-                break  # Выход из цикла при успехе
-
-            except Exception as e:
-                error_msg = str(e)
-                logger.warning(f"Провайдер {provider} не работает: {error_msg}")
-                last_error = error_msg
-
-                # Если это последний провайдер, выбросить ошибку
-                if provider == providers[-1]:
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"Все провайдеры для модели {request.model} недоступны. Последняя ошибка: {last_error}"
-                    )
-                continue  # Попробовать следующий провайдер
-        
-        # Формирование ответа
-        result = {
-            "content": response.choices[0].message.content,
-            "model": request.model,
-            "finish_reason": response.choices[0].finish_reason,
-            "messages_count": len(messages)
-        }
+            # Слоты квоты ключа и admission control освобождаются, когда поток закончится
+            lease.detach()
+
+            def close_stream(completion_chars: int, failed: bool):
+                lease.release()
+                ticket.release()
+                usage_recorder.record(api_key, request.model, prompt_chars, completion_chars, error=failed)
+
+            def release_slots():
+                lease.release()
+                ticket.release()
+
+            return streaming.ClosingStreamingResponse(
+                streaming.sse_events(request.model, first_chunk, stream, on_close=close_stream, deadline=deadline),
+                on_finish=release_slots,
+                media_type="text/event-stream",
+                headers={**streaming.SSE_HEADERS, **context_headers(context)}
+            )
+
+        result, cached = await within_deadline(
+            complete_chat(request.model, messages, cache_mode, started, deadline), deadline, http_request
+        )
+        usage_recorder.record(api_key, request.model, prompt_chars, len(result["content"] or ""), cached=cached)
+        result = with_context(result, context)
+
+        headers = {"X-Cache": "HIT" if cached else "MISS"} if cache_mode != "off" else {}
+        headers.update(context_headers(context))
         
         logger.info("Запрос успешно обработан")
         
+        if config.FAST_JSON:
+            # Готовый ответ отдаётся как есть, без повторной валидации через response_model
+            return FastJSONResponse({"success": True, "data": result, "error": None}, headers=headers)
+        http_response.headers.update(headers)
         return ChatResponse(success=True, data=result)
         
     except HTTPException as he:
+        if prompt_chars is not None and he.status_code >= 500:
+            usage_recorder.record(api_key, request.model, prompt_chars, error=True)
         raise he
     except Exception as e:
         logger.error(f"Ошибка при обработке запроса: {str(e)}")
+        if prompt_chars is not None:
+            usage_recorder.record(api_key, request.model, prompt_chars, error=True)
+        metrics.ERRORS.inc("request", type(e).__name__)
         return ChatResponse(
             success=False,
             error=f"Ошибка при обращении к AI: {str(e)}"
         )
 
+@app.post("/v1/chat/tools")
+async def chat_tools(
+    request: ToolChatRequest,
+    http_request: Request,
+    lease: Lease = Depends(key_quota_check),
+    api_key: str = Header(alias="X-API-Key"),
+    deadline_header: Optional[str] = Header(None, alias="X-Request-Deadline")
+):
+    """
+    Chat completion с вызовом функций: цикл модель -> функции -> модель в сервисе
+    
+    Args:
+        request: ToolChatRequest с messages, tools, tool_choice, tool_session
+            (идентификатор запроса в Node.js для обратного вызова TOOLS_CALLBACK_URL) и max_steps
+        deadline_header: Срок запроса на все шаги: секунды или время UNIX
+        
+    Returns:
+        Финальный ответ модели, выполненные вызовы функций (tool_calls) и
+        сообщения, добавленные в историю (messages)
+    """
+    messages = prepare_tool_request(request)
+    deadline = request_deadline(deadline_header)
+    prompt_chars = sum(len(message.get("content") or "") for message in messages)
+    policy = model_registry.hedging_policy(request.model) if config.HEDGING_ENABLED else None
+
+    async def complete_step(history: List[dict], options: dict):
+        providers = order_providers(request.model)
+        ticket = await admit()
+        try:
+            provider, response = await dispatch.complete(request.model, history, providers, policy, options, deadline)
+        except dispatch.AllProvidersFailed as e:
+            metrics.ERRORS.inc("request", "AllProvidersFailed")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Все провайдеры для модели {request.model} недоступны. Последняя ошибка: {e}"
+            )
+        finally:
+            ticket.release()
+        record_fallback_index(request.model, provider)
+        return response
+
+    try:
+        logger.info(f"Получен запрос с {len(request.tools)} функциями, модель: {request.model}")
+        response, executed, added = await within_deadline(tool_orchestrator.run(
+            messages, request.tools, request.tool_choice, request.tool_session, request.max_steps, complete_step
+        ), deadline, http_request)
+    except HTTPException as he:
+        if he.status_code >= 500:
+            usage_recorder.record(api_key, request.model, prompt_chars, error=True)
+        raise he
+    except Exception as e:
+        logger.error(f"Ошибка при обработке запроса с функциями: {str(e)}")
+        usage_recorder.record(api_key, request.model, prompt_chars, error=True)
+        metrics.ERRORS.inc("request", type(e).__name__)
+        return {"success": False, "data": None, "error": f"Ошибка при обращении к AI: {str(e)}"}
+
+    content = response.choices[0].message.content
+    usage_recorder.record(api_key, request.model, prompt_chars, len(content or ""))
+    return {
+        "success": True,
+        "data": {
+            "content": content,
+            "model": request.model,
+            "finish_reason": response.choices[0].finish_reason,
+            "messages_count": len(messages) + len(added),
+            "tool_steps": sum(1 for message in added if message["role"] == "assistant"),
+            "tool_calls": executed,
+            "messages": added
+        },
+        "error": None
+    }
+
+@app.post("/v1/batch/chat/completions")
+async def batch_chat_completions(
+    batch_request: BatchRequest,
+    lease: Lease = Depends(key_quota_check),
+    info: KeyInfo = Depends(api_key_check),
+    api_key: str = Header(alias="X-API-Key"),
+    cache_mode: Optional[str] = Header(None, alias="X-G4F-Cache"),
+    deadline_header: Optional[str] = Header(None, alias="X-Request-Deadline")
+):
+    """
+    Пакет chat completion одним HTTP запросом
+    
+    Каждый элемент расходует квоты ключа как отдельный запрос: токен лимита
+    в минуту и слот одновременных запросов на время выполнения. Первый
+    элемент использует слот, занятый при проверке квот; элемент, для
+    которого квоты не хватило, получает 429 с retry_after.
+    
+    Args:
+        batch_request: BatchRequest со списком ChatRequest и concurrency
+            (не больше BATCH_MAX_CONCURRENCY и лимита одновременных запросов ключа)
+        cache_mode: Режим кэша ответов для всех элементов: on, off или refresh
+        deadline_header: Срок каждого элемента с момента его начала (секунды)
+            или общий срок пакета (время UNIX)
+        
+    Returns:
+        application/x-ndjson: по строке на элемент в порядке завершения -
+        {"index", "success", "data"} или {"index", "success": false, "status", "error"}
+        (при status 429 - ещё retry_after, секунды)
+    """
+    items = batch_request.requests
+    if not items:
+        raise HTTPException(status_code=400, detail="Массив requests обязателен и должен содержать хотя бы один запрос")
+    if len(items) > config.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком много запросов в пакете: {len(items)}, максимум {config.BATCH_MAX_ITEMS}"
+        )
+    cache_mode = check_cache_mode(cache_mode)
+    # Заголовок проверяется сразу, срок отсчитывается для каждого элемента отдельно
+    request_deadline(deadline_header)
+    concurrency = min(batch_request.concurrency or config.BATCH_MAX_CONCURRENCY, config.BATCH_MAX_CONCURRENCY)
+    max_concurrent = info.max_concurrent if info.max_concurrent is not None else key_limiter.default_max_concurrent
+    if max_concurrent:
+        concurrency = min(concurrency, max_concurrent)
+
+    logger.info(f"Получен пакет из {len(items)} запросов, параллельно {concurrency}")
+
+    # Слот, занятый при проверке квот, достаётся первому элементу
+    leases = [lease]
+
+    async def run_item(index: int, request: ChatRequest) -> dict:
+        try:
+            item_lease = leases.pop() if leases else await key_limiter.acquire(
+                api_key, info.requests_per_minute, info.max_concurrent
+            )
+        except RateLimited as e:
+            return {"index": index, "success": False, "status": 429, "error": str(e),
+                    "retry_after": max(1, math.ceil(e.retry_after))}
+        try:
+            return await run_limited_item(index, request)
+        finally:
+            # Следующий элемент сразу займёт этот слот
+            await item_lease.arelease()
+
+    async def run_limited_item(index: int, request: ChatRequest) -> dict:
+        started = time.perf_counter()
+        try:
+            deadline = parse_deadline(deadline_header, config.REQUEST_DEADLINE_DEFAULT)
+        except ValueError:
+            # Общий срок пакета (время UNIX) прошёл, пока элемент ждал очереди
+            metrics.ERRORS.inc("request", "DeadlineExceeded")
+            return {"index": index, "success": False, "status": 504, "error": "Истёк срок пакета"}
+        prompt_chars = None
+        try:
+            if request.stream:
+                raise HTTPException(status_code=400, detail="stream не поддерживается в пакетном режиме")
+            messages, context = fit_context(request.model, prepare_messages(request))
+            prompt_chars = sum(len(message["content"]) for message in messages)
+            result, cached = await within_deadline(
+                complete_chat(request.model, messages, cache_mode, started, deadline), deadline
+            )
+            result = with_context(result, context)
+        except HTTPException as he:
+            if prompt_chars is not None and he.status_code >= 500:
+                usage_recorder.record(api_key, request.model, prompt_chars, error=True)
+            return {"index": index, "success": False, "status": he.status_code, "error": he.detail}
+        except Exception as e:
+            logger.error(f"Ошибка при обработке запроса {index} пакета: {str(e)}")
+            metrics.ERRORS.inc("request", type(e).__name__)
+            if prompt_chars is not None:
+                usage_recorder.record(api_key, request.model, prompt_chars, error=True)
+            return {"index": index, "success": False, "status": 500, "error": f"Ошибка при обращении к AI: {str(e)}"}
+        usage_recorder.record(api_key, request.model, prompt_chars, len(result["content"] or ""), cached=cached)
+        return {"index": index, "success": True, "cached": cached, "data": result}
+
+    # Слот проверки квот освобождает первый элемент или, если пакет прервался раньше, on_finish
+    lease.detach()
+    return streaming.ClosingStreamingResponse(
+        batch.ndjson_results(items, run_item, concurrency),
+        on_finish=lease.release,
+        media_type="application/x-ndjson",
+        headers=batch.NDJSON_HEADERS
+    )
+
 @app.get("/v1/admin/api_keys", tags=["admin"], dependencies=[Depends(admin_key_check)])
-async def list_api_keys():
+async def list_api_keys(limit: int = 100, cursor: Optional[str] = None):
     """
-    Получить список всех API ключей
+    Получить страницу API ключей (по возрастанию ключа)
+    
+    Args:
+        limit: Размер страницы (не больше ADMIN_KEYS_PAGE_MAX)
+        cursor: next_cursor из предыдущей страницы; без него - первая страница
     
     Returns:
-        Список API ключей
+        Список API ключей и next_cursor (None - страница последняя)
     """
     try:
-        api_keys = await APIKey.all().values("key", "created_at", "remark")
+        limit = max(1, min(limit, config.ADMIN_KEYS_PAGE_MAX))
+        api_keys = await api_keys_page(cursor, limit + 1)
+        has_more = len(api_keys) > limit
+        api_keys = api_keys[:limit]
         return {
             "success": True,
             "data": {
-                "api_keys": api_keys
+                "api_keys": api_keys,
+                "next_cursor": api_keys[-1]["key"] if has_more else None
             }
         }
     except Exception as e:
@@ -315,6 +908,110 @@ async def list_api_keys():
             "success": False,
             "error": str(e)
         }
+
+@app.get("/v1/admin/api_keys/export", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def export_api_keys():
+    """
+    Выгрузить все API ключи
+    
+    Returns:
+        application/x-ndjson: по строке на ключ; ключи читаются из базы
+        страницами, поэтому вся таблица в памяти не держится
+    """
+    async def rows():
+        cursor = None
+        while True:
+            page = await api_keys_page(cursor, config.ADMIN_KEYS_PAGE_MAX)
+            for api_key in page:
+                yield json.dumps({**api_key, "created_at": api_key["created_at"].isoformat()}, ensure_ascii=False) + "\n"
+            if len(page) < config.ADMIN_KEYS_PAGE_MAX:
+                break
+            cursor = page[-1]["key"]
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+@app.post("/v1/admin/api_keys/bulk_generate", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def bulk_generate_api_keys(request: BulkGenerateRequest):
+    """
+    Сгенерировать несколько API ключей одной транзакцией
+    
+    Args:
+        request: count (не больше ADMIN_BULK_MAX) и необязательная пометка remark
+    
+    Returns:
+        Список новых API ключей
+    """
+    if not 1 <= request.count <= config.ADMIN_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"count должен быть от 1 до {config.ADMIN_BULK_MAX}")
+
+    try:
+        new_keys = [secrets.token_urlsafe(32) for _ in range(request.count)]
+        async with in_transaction():
+            await APIKey.bulk_create([APIKey(key=key, remark=request.remark) for key in new_keys])
+
+        for key in new_keys:
+            key_cache.invalidate(key)
+
+        logger.info(f"Сгенерировано API ключей: {len(new_keys)}")
+
+        return {
+            "success": True,
+            "data": {
+                "api_keys": new_keys
+            }
+        }
+        
+    except Exception as e:
+        logger.error(f"Ошибка при генерации API ключей: {str(e)}")
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+@app.post("/v1/admin/api_keys/bulk_revoke", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def bulk_revoke_api_keys(request: BulkRevokeRequest):
+    """
+    Отозвать несколько API ключей одной транзакцией
+    
+    Args:
+        request: keys - список ключей (не больше ADMIN_BULK_MAX)
+    
+    Returns:
+        Отозванные ключи и ключи, которых не было в базе
+    """
+    keys = list(dict.fromkeys(request.keys))
+    if not 1 <= len(keys) <= config.ADMIN_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"keys должен содержать от 1 до {config.ADMIN_BULK_MAX} ключей")
+
+    try:
+        revoked = []
+        async with in_transaction():
+            # Частями, чтобы не упереться в лимит параметров SQL запроса
+            for start in range(0, len(keys), BULK_CHUNK):
+                chunk = keys[start:start + BULK_CHUNK]
+                revoked += await APIKey.filter(key__in=chunk).values_list("key", flat=True)
+                await APIKey.filter(key__in=chunk).delete()
+                await APIKeyQuota.filter(key__in=chunk).delete()
+
+        await forget_keys(revoked)
+
+        revoked_set = set(revoked)
+        logger.info(f"Отозвано API ключей: {len(revoked)}")
+
+        return {
+            "success": True,
+            "data": {
+                "revoked": revoked,
+                "not_found": [key for key in keys if key not in revoked_set]
+            }
+        }
+        
+    except Exception as e:
+        logger.error(f"Ошибка при отзыве API ключей: {str(e)}")
+        return {
+            "success": False,
+            "error": str(e)
+        }
     
 @app.post("/v1/admin/generate_api_key", tags=["admin"], dependencies=[Depends(admin_key_check)])
 async def generate_api_key(remark: Optional[str] = None):
@@ -334,6 +1031,8 @@ async def generate_api_key(remark: Optional[str] = None):
             await APIKey.create(key=new_key)
         else:
             await APIKey.create(key=new_key, remark=remark)
+
+        key_cache.invalidate(new_key)
         
         logger.info(f"Сгенерирован новый API ключ: {new_key}")
         
@@ -369,6 +1068,8 @@ async def revoke_api_key(api_key: str):
             raise HTTPException(status_code=404, detail="API ключ не найден")
         
         await api_key_obj.delete()
+        await APIKeyQuota.filter(key=api_key).delete()
+        await forget_keys([api_key])
         
         logger.info(f"API ключ отозван: {api_key}")
         
@@ -388,150 +1089,385 @@ async def revoke_api_key(api_key: str):
             "error": str(e)
         }
 
-@app.get("/v1/models", dependencies=[Depends(api_key_check)])
-async def get_models():
+@app.get("/v1/admin/api_key_quota/{api_key}", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def get_api_key_quota(api_key: str):
     """
-    Получить список доступных моделей
+    Получить квоты API ключа и их текущее использование
     
+    Args:
+        api_key: API ключ
+        
     Returns:
-        Список моделей с их характеристиками
+        Квоты ключа (None - значение по умолчанию) и использование
     """
-    try:
-        # Список популярных моделей
-        models = [
-            {
-                "id": "gpt-4",
-                "name": "GPT-4",
-                "provider": "auto",
-                "description": "Мощная языковая модель от OpenAI"
-            },
-            {
-                "id": "gpt-4o",
-                "name": "GPT-4o",
-                "provider": "auto",
-                "description": "Оптимизированная версия GPT-4"
-            },
-            {
-                "id": "gpt-3.5-turbo",
-                "name": "GPT-3.5 Turbo",
-                "provider": "auto",
-                "description": "Быстрая и эффективная модель"
-            },
-            {
-                "id": "claude-sonnet-4.5",
-                "name": "Claude Sonnet 4.5",
-                "provider": "auto (с fallback)",
-                "description": "Anthropic Claude Sonnet 4.5 (без API ключа через провайдеры)"
-            },
-            {
-                "id": "claude-sonnet-4",
-                "name": "Claude Sonnet 4",
-                "provider": "auto (с fallback)",
-                "description": "Anthropic Claude Sonnet 4 (без API ключа через провайдеры)"
-            },
-            {
-                "id": "claude-haiku-4.5",
-                "name": "Claude Haiku 4.5",
-                "provider": "auto (с fallback)",
-                "description": "Anthropic Claude Haiku 4.5 (быстрая, без API ключа)"
-            },
-            {
-                "id": "gemini-2.5-flash",
-                "name": "Gemini 2.5 Flash",
-                "provider": "auto",
-                "description": "Google Gemini 2.5 Flash"
-            },
-            {
-                "id": "gemini-2.5-pro",
-                "name": "Gemini 2.5 Pro",
-                "provider": "auto",
-                "description": "Google Gemini 2.5 Pro"
-            },
-            {
-                "id": "deepseek-v3",
-                "name": "DeepSeek V3",
-                "provider": "auto",
-                "description": "DeepSeek V3"
-            },
-            {
-                "id": "deepseek-r1",
-                "name": "DeepSeek R1",
-                "provider": "auto",
-                "description": "DeepSeek R1 Reasoning"
+    if not await APIKey.exists(key=api_key):
+        raise HTTPException(status_code=404, detail="API ключ не найден")
+
+    quota = await APIKeyQuota.get_or_none(key=api_key)
+
+    return {
+        "success": True,
+        "data": {
+            "requests_per_minute": quota.requests_per_minute if quota else None,
+            "max_concurrent": quota.max_concurrent if quota else None,
+            "defaults": {
+                "requests_per_minute": config.API_KEY_DEFAULT_RPM,
+                "max_concurrent": config.API_KEY_DEFAULT_MAX_CONCURRENT
             },
-            {
-                "id": "llama-4-scout",
-                "name": "Llama 4 Scout",
-                "provider": "auto",
-                "description": "Meta Llama 4 Scout"
-            }
-        ]
+            "usage": await key_limiter.usage(api_key)
+        }
+    }
+
+@app.post("/v1/admin/api_key_quota/{api_key}", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def set_api_key_quota(api_key: str, requests_per_minute: Optional[int] = None, max_concurrent: Optional[int] = None):
+    """
+    Установить квоты API ключа
+    
+    Args:
+        api_key: API ключ
+        requests_per_minute: Запросов в минуту (не задано - по умолчанию, 0 - без ограничения)
+        max_concurrent: Одновременных запросов (не задано - по умолчанию, 0 - без ограничения)
         
+    Returns:
+        Результат операции
+    """
+    try:
+        if (requests_per_minute is not None and requests_per_minute < 0) or (max_concurrent is not None and max_concurrent < 0):
+            raise HTTPException(status_code=400, detail="Квоты не могут быть отрицательными")
+
+        if not await APIKey.exists(key=api_key):
+            raise HTTPException(status_code=404, detail="API ключ не найден")
+
+        await APIKeyQuota.update_or_create(
+            defaults={"requests_per_minute": requests_per_minute, "max_concurrent": max_concurrent},
+            key=api_key
+        )
+        await forget_keys([api_key])
+
+        logger.info(f"Квоты API ключа обновлены: rpm={requests_per_minute}, concurrent={max_concurrent}")
+
         return {
             "success": True,
             "data": {
-                "models": models,
-                "default_model": "gpt-4",
-                "total": len(models)
+                "requests_per_minute": requests_per_minute,
+                "max_concurrent": max_concurrent
             }
         }
-        
+
+    except HTTPException as e:
+        raise e
     except Exception as e:
-        logger.error(f"Ошибка при получении моделей: {str(e)}")
+        logger.error(f"Ошибка при обновлении квот API ключа: {str(e)}")
         return {
             "success": False,
             "error": str(e)
         }
 
-@app.get("/v1/providers", dependencies=[Depends(api_key_check)])
-async def get_providers():
+@app.get("/v1/admin/usage", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def get_usage(
+    api_key: Optional[str] = None,
+    model: Optional[str] = None,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    group_by: str = "key,model"
+):
     """
-    Получить список доступных провайдеров
+    Статистика использования API ключей
+    
+    Перед запросом накопленная в памяти статистика записывается в базу данных.
     
+    Args:
+        api_key: Только этот ключ
+        model: Только эта модель
+        since: С этого дня включительно (YYYY-MM-DD, UTC)
+        until: По этот день включительно (YYYY-MM-DD, UTC)
+        group_by: Поля группировки через запятую: key, model, day
+        
     Returns:
-        Список провайдеров
+        Запросы, ошибки, ответы из кэша, символы и оценка токенов по группам
     """
+    group_fields = [field.strip() for field in group_by.split(",") if field.strip()]
+    if not group_fields or any(field not in USAGE_GROUP_FIELDS for field in group_fields):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Недопустимый group_by '{group_by}'. Используйте поля: {', '.join(USAGE_GROUP_FIELDS)}"
+        )
+
     try:
-        providers = [
-            {
-                "name": "api.airforce",
-                "status": "active",
-                "models": ["gpt-4o-mini", "claude-sonnet-4", "gemini-2.5-flash"],
-                "description": "Airforce API провайдер"
-            },
-            {
-                "name": "deep-infra",
-                "status": "active",
-                "models": ["meta-llama", "mistral", "qwen"],
-                "description": "DeepInfra провайдер"
-            },
-            {
-                "name": "gemini",
-                "status": "active",
-                "models": ["gemini-2.5-flash", "gemini-2.5-pro"],
-                "description": "Google Gemini провайдер"
-            },
-            {
-                "name": "groq",
-                "status": "active",
-                "models": ["llama-3.3", "mixtral"],
-                "description": "Groq провайдер"
-            }
-        ]
-        
+        await usage_recorder.flush()
+
+        query = APIKeyUsage.all()
+        if api_key is not None:
+            query = query.filter(key=api_key)
+        if model is not None:
+            query = query.filter(model=model)
+        if since is not None:
+            query = query.filter(day__gte=since)
+        if until is not None:
+            query = query.filter(day__lte=until)
+
+        rows = await query.annotate(
+            total_requests=Sum("requests"),
+            total_errors=Sum("errors"),
+            total_cached=Sum("cached"),
+            total_prompt_chars=Sum("prompt_chars"),
+            total_completion_chars=Sum("completion_chars"),
+        ).group_by(*group_fields).order_by(*group_fields).values(
+            *group_fields, "total_requests", "total_errors", "total_cached",
+            "total_prompt_chars", "total_completion_chars"
+        )
+
+        usage = []
+        for row in rows:
+            item = {field: row[field] for field in group_fields}
+            item.update({
+                "requests": row["total_requests"],
+                "errors": row["total_errors"],
+                "cached": row["total_cached"],
+                "prompt_chars": row["total_prompt_chars"],
+                "completion_chars": row["total_completion_chars"],
+                "prompt_tokens_estimate": estimate_tokens(row["total_prompt_chars"]),
+                "completion_tokens_estimate": estimate_tokens(row["total_completion_chars"]),
+            })
+            usage.append(item)
+
         return {
             "success": True,
-            "data": providers
+            "data": {
+                "usage": usage,
+                "recorder": usage_recorder.stats()
+            }
         }
-        
     except Exception as e:
-        logger.error(f"Ошибка при получении провайдеров: {str(e)}")
+        logger.error(f"Ошибка при получении статистики использования: {str(e)}")
         return {
             "success": False,
             "error": str(e)
         }
 
-@app.get("/v1/test", dependencies=[Depends(api_key_check)])
+@app.get("/v1/admin/key_cache", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def key_cache_stats():
+    """
+    Статистика кэша API ключей
+    
+    Returns:
+        Hit ratio, размер кэша и время проверки ключа
+    """
+    return {
+        "success": True,
+        "data": key_cache.stats()
+    }
+
+@app.get("/v1/admin/router", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def router_state():
+    """
+    Состояние адаптивного выбора провайдеров
+    
+    Returns:
+        Задержки, доля ошибок и состояние circuit breaker по моделям и провайдерам
+    """
+    return {
+        "success": True,
+        "data": provider_router.snapshot()
+    }
+
+@app.get("/v1/admin/hedging", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def hedging_state():
+    """
+    Счётчики hedging по моделям
+    
+    Returns:
+        Сколько запросов шло с hedging, сколько hedge-запросов запущено и сколько из них победило
+    """
+    return {
+        "success": True,
+        "data": {
+            "enabled": config.HEDGING_ENABLED,
+            "policies": model_registry.current.hedging_policies,
+            "models": dispatch.hedging_snapshot()
+        }
+    }
+
+@app.get("/v1/admin/response_cache", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def response_cache_stats():
+    """
+    Статистика кэша ответов
+    
+    Returns:
+        Попадания в память и на диск, промахи, вытеснения и занятый объём
+    """
+    return {
+        "success": True,
+        "data": response_cache.stats()
+    }
+
+@app.get("/v1/admin/tools", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def tools_stats():
+    """
+    Вызов функций внутри сервиса
+    
+    Returns:
+        Адрес обратного вызова, число запросов, шагов и вызовов функций,
+        ошибки и суммарное время обратных вызовов
+    """
+    return {
+        "success": True,
+        "data": tool_orchestrator.stats()
+    }
+
+@app.get("/v1/admin/similarity_cache", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def similarity_cache_stats():
+    """
+    Статистика кэша похожих запросов
+    
+    Returns:
+        Точные и приближённые попадания, промахи, доля попаданий,
+        lsh_candidate_precision (доля кандидатов индекса LSH, прошедших
+        проверку сходством) и среднее сходство
+    """
+    return {
+        "success": True,
+        "data": similarity_cache.stats()
+    }
+
+@app.get("/v1/admin/admission", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def admission_stats():
+    """
+    Состояние admission control
+    
+    Returns:
+        Активные запросы, глубина очереди, время ожидания и число отказов
+    """
+    return {
+        "success": True,
+        "data": admission.stats()
+    }
+
+@app.get("/v1/admin/database", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def database_info():
+    """
+    Подключение к базе данных
+    
+    Returns:
+        Тип базы и действующие настройки: PRAGMA SQLite или размер пула PostgreSQL
+    """
+    return {
+        "success": True,
+        "data": await db.info()
+    }
+
+@app.get("/v1/admin/shared_state", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def shared_state_stats():
+    """
+    Общее состояние процессов (uvicorn --workers)
+    
+    Returns:
+        Файл состояния, этот процесс, лидер проверки провайдеров, живые процессы и счётчики синхронизации
+    """
+    return {
+        "success": True,
+        "data": await shared_state.stats()
+    }
+
+@app.get("/v1/admin/http_pool", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def http_pool_stats():
+    """
+    Пул HTTP соединений к провайдерам
+    
+    Returns:
+        Лимиты пула и по каждому хосту: запросы, новые и переиспользованные соединения
+    """
+    return {
+        "success": True,
+        "data": http_pool.stats()
+    }
+
+@app.get("/v1/admin/context", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def context_stats():
+    """
+    Обрезка истории под контекст модели
+    
+    Returns:
+        Настройки бюджета, доля попаданий кэша подсчёта токенов и сколько
+        запросов, сообщений и токенов обрезано
+    """
+    return {
+        "success": True,
+        "data": context_budget.stats()
+    }
+
+@app.get("/v1/admin/registry", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def registry_info():
+    """
+    Состояние реестра моделей
+    
+    Returns:
+        Путь к файлу, версия, время загрузки, число моделей и последняя ошибка перезагрузки
+    """
+    return {
+        "success": True,
+        "data": model_registry.info()
+    }
+
+@app.post("/v1/admin/registry/reload", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def reload_registry():
+    """
+    Перечитать файл реестра моделей без перезапуска
+    
+    Returns:
+        Изменился ли реестр и его текущее состояние; при ошибке в файле
+        остаётся прежний реестр
+    """
+    try:
+        changed = model_registry.load()
+    except RegistryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        "success": True,
+        "data": {
+            "changed": changed,
+            **model_registry.info()
+        }
+    }
+
+@app.get("/v1/admin/singleflight", tags=["admin"], dependencies=[Depends(admin_key_check)])
+async def singleflight_stats():
+    """
+    Статистика объединения одинаковых запросов
+    
+    Returns:
+        Сколько запросов ушло к провайдеру и сколько присоединилось к уже идущим
+    """
+    return {
+        "success": True,
+        "data": singleflight.stats()
+    }
+
+@app.get("/v1/models", dependencies=[Depends(api_key_check)])
+async def get_models(if_none_match: Optional[str] = Header(None, alias="If-None-Match")):
+    """
+    Получить список доступных моделей из реестра
+    
+    Returns:
+        Список моделей с их характеристиками; 304, если ETag не изменился
+    """
+    snapshot = model_registry.current
+    return etag_response(snapshot.models_body, snapshot.models_etag, if_none_match)
+
+@app.get("/v1/providers", dependencies=[Depends(api_key_check)])
+async def get_providers(if_none_match: Optional[str] = Header(None, alias="If-None-Match")):
+    """
+    Получить список провайдеров и их текущий статус
+    
+    Returns:
+        Список провайдеров: модели, статус (active, down, unknown, not_probed),
+        задержка и ошибка последней фоновой проверки; 304, если ETag не изменился
+    """
+    body, etag = model_registry.providers_listing(provider_prober.status, provider_prober.version)
+    return etag_response(body, etag, if_none_match)
+
+@app.get("/v1/test", dependencies=[Depends(key_quota_check)])
 async def test():
     """
     Тестовый endpoint для проверки работоспособности
@@ -541,18 +1477,32 @@ async def test():
     """
     try:
         logger.info("Выполнение тестового запроса")
-        
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "user", "content": "Say 'Hello from G4F Python API!'"}
-            ]
-        )
+
+        messages = [{"role": "user", "content": "Say 'Hello from G4F Python API!'"}]
+
+        # Повторные проверки в пределах TTL не обращаются к провайдеру
+        cache_key = make_key("gpt-4", messages)
+        cached = await response_cache.get(cache_key) if config.RESPONSE_CACHE_DEFAULT == "on" else None
+
+        if cached is not None:
+            content = cached["content"]
+        else:
+            response = await upstream.create_completion(
+                model="gpt-4",
+                messages=messages
+            )
+            content = response.choices[0].message.content
+            if config.RESPONSE_CACHE_DEFAULT != "off" and content:
+                await response_cache.put(cache_key, {
+                    "content": content,
+                    "finish_reason": response.choices[0].finish_reason
+                })
         
         return {
             "success": True,
             "data": {
-                "message": response.choices[0].message.content,
+                "message": content,
+                "cached": cached is not None,
                 "model": "gpt-4",
                 "status": "AI интеграция работает корректно",
                 "provider": "g4f-python"
@@ -568,4 +1518,5 @@ async def test():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=5000, log_level="info")
+    # Несколько процессов uvicorn запускает только по строке импорта приложения
+    uvicorn.run("main:app", host="0.0.0.0", port=5000, log_level="info", workers=config.WORKERS)
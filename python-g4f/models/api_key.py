@@ -4,4 +4,25 @@ class APIKey(models.Model):
     key = fields.TextField(pk=True) # UUID-4 API key
     created_at = fields.DatetimeField(auto_now_add=True)
     remark = fields.CharField(max_length=255, null=True)
-    
\ No newline at end of file
+    
+
+class APIKeyQuota(models.Model):
+    key = fields.TextField(pk=True) # API ключ из APIKey
+    requests_per_minute = fields.IntField(null=True) # None - значение по умолчанию, 0 - без ограничения
+    max_concurrent = fields.IntField(null=True) # None - значение по умолчанию, 0 - без ограничения
+    updated_at = fields.DatetimeField(auto_now=True)
+
+
+class APIKeyUsage(models.Model):
+    key = fields.CharField(max_length=255, index=True) # API ключ
+    model = fields.CharField(max_length=255) # Модель из запроса
+    day = fields.DateField() # День (UTC)
+    requests = fields.IntField(default=0)
+    errors = fields.IntField(default=0)
+    cached = fields.IntField(default=0) # Ответы из кэша
+    prompt_chars = fields.BigIntField(default=0)
+    completion_chars = fields.BigIntField(default=0)
+    updated_at = fields.DatetimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (("key", "model", "day"),)
@@ -0,0 +1,179 @@
+"""
+Контроль допуска запросов к провайдерам (admission control)
+
+Одновременно выполняется не больше ADMISSION_MAX_CONCURRENT запросов,
+остальные ждут в FIFO очереди. Запрос сразу получает отказ, если:
+
+- очередь уже длиной ADMISSION_MAX_QUEUE;
+- оценка ожидания (позиция в очереди x среднее время обслуживания /
+  число слотов) больше ADMISSION_MAX_WAIT.
+
+Если запрос дождался в очереди дольше ADMISSION_MAX_WAIT, он тоже
+получает отказ. Так при перегрузке часть запросов быстро получает 503,
+а не все подряд упираются в таймаут на стороне Node.js.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Optional
+
+import config
+
+# Сглаживание среднего времени обслуживания
+SERVICE_TIME_ALPHA = 0.2
+
+
+class Overloaded(Exception):
+    """Запрос отклонён из-за перегрузки"""
+
+    def __init__(self, message: str, reason: str, retry_after: float):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """Занятый слот; release() идемпотентен. Без controller - запрос не занимает слот"""
+
+    def __init__(self, controller: Optional["AdmissionController"] = None):
+        self._controller = controller
+        self._admitted_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            if self._controller is not None:
+                self._controller._release(time.monotonic() - self._admitted_at)
+
+    def __del__(self):
+        # Страховка: потоковый ответ, который так и не начался, не держит слот вечно
+        self.release()
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent: int, max_queue: int, max_wait: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._active = 0
+        self._waiters: deque = deque()
+        self._service_time: Optional[float] = None
+
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_wait_estimate = 0
+        self.shed_timeout = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def estimated_wait(self, position: int) -> float:
+        """Оценка ожидания для позиции в очереди (0 - первый)"""
+        if self._service_time is None:
+            return 0.0
+        return (position + 1) * self._service_time / self.max_concurrent
+
+    async def acquire(self) -> Ticket:
+        """
+        Дождаться слота
+
+        Returns:
+            Ticket, который нужно освободить по завершении запроса
+
+        Raises:
+            Overloaded: очередь полна или ожидание превысит ADMISSION_MAX_WAIT
+        """
+        if self._active < self.max_concurrent and not self._waiters:
+            self._active += 1
+            self._observe_wait(0.0)
+            return Ticket(self)
+
+        position = len(self._waiters)
+        if position >= self.max_queue:
+            self.shed_queue_full += 1
+            raise Overloaded(
+                f"Сервис перегружен: очередь заполнена ({self.max_queue})",
+                "queue_full",
+                self.estimated_wait(position) or 1
+            )
+
+        estimate = self.estimated_wait(position)
+        if estimate > self.max_wait:
+            self.shed_wait_estimate += 1
+            raise Overloaded(
+                f"Сервис перегружен: ожидание в очереди ~{estimate:.1f} с превышает {self.max_wait} с",
+                "wait_estimate",
+                estimate
+            )
+
+        started = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.max_wait)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # Слот уже передан этому запросу - возвращаем его
+                self._release(None)
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self.shed_timeout += 1
+                raise Overloaded(
+                    f"Сервис перегружен: запрос ждал в очереди дольше {self.max_wait} с",
+                    "timeout",
+                    self.estimated_wait(len(self._waiters)) or 1
+                )
+            raise
+
+        self._observe_wait(time.monotonic() - started)
+        return Ticket(self)
+
+    def _observe_wait(self, seconds: float):
+        self.admitted += 1
+        self.wait_time_total += seconds
+        self.wait_time_max = max(self.wait_time_max, seconds)
+
+    def _release(self, service_time: Optional[float]):
+        if service_time is not None:
+            if self._service_time is None:
+                self._service_time = service_time
+            else:
+                self._service_time += SERVICE_TIME_ALPHA * (service_time - self._service_time)
+
+        # Слот переходит первому живому ожидающему, иначе освобождается
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "max_concurrent": self.max_concurrent,
+            "queue_depth": len(self._waiters),
+            "max_queue": self.max_queue,
+            "max_wait": self.max_wait,
+            "service_time_avg": self._service_time,
+            "admitted": self.admitted,
+            "wait_avg": self.wait_time_total / self.admitted if self.admitted else 0.0,
+            "wait_max": self.wait_time_max,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_wait_estimate": self.shed_wait_estimate,
+            "shed_timeout": self.shed_timeout,
+        }
+
+
+admission = AdmissionController(
+    max_concurrent=config.ADMISSION_MAX_CONCURRENT,
+    max_queue=config.ADMISSION_MAX_QUEUE,
+    max_wait=config.ADMISSION_MAX_WAIT
+)
@@ -0,0 +1,66 @@
+"""
+Пакетные chat completion (/v1/batch/chat/completions)
+
+Элементы пакета выполняются параллельно, не больше concurrency одновременно.
+Результаты отдаются в формате NDJSON (одна JSON строка на элемент) в порядке
+завершения, а не в порядке элементов - каждый результат помечен index.
+Ошибка одного элемента не прерывает пакет.
+"""
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+
+from services import fast_json
+
+logger = logging.getLogger(__name__)
+
+NDJSON_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Отключает буферизацию в nginx, чтобы каждый результат уходил сразу
+    "X-Accel-Buffering": "no",
+}
+
+
+async def ndjson_results(
+    items: List,
+    run: Callable[[int, object], Awaitable[dict]],
+    concurrency: int,
+    on_close: Optional[Callable[[], None]] = None
+) -> AsyncIterator[str]:
+    """
+    Выполнить элементы пакета и отдавать результаты по мере готовности
+
+    Args:
+        items: Элементы пакета
+        run: Корутина (index, элемент) -> результат; не должна бросать исключения
+        concurrency: Сколько элементов выполняется одновременно
+        on_close: Вызывается после завершения пакета или отключения клиента
+
+    Yields:
+        Строки NDJSON
+    """
+    results: asyncio.Queue = asyncio.Queue()
+    pending = iter(enumerate(items))
+
+    async def worker():
+        # Общий итератор: каждый свободный воркер берёт следующий элемент
+        for index, item in pending:
+            try:
+                result = await run(index, item)
+            except Exception as e:
+                logger.error(f"Ошибка элемента пакета {index}: {e}")
+                result = {"index": index, "success": False, "status": 500, "error": str(e)}
+            results.put_nowait(result)
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, min(concurrency, len(items))))]
+    try:
+        for _ in range(len(items)):
+            result = await results.get()
+            yield fast_json.dumps_str(result) + "\n"
+    finally:
+        # Клиент отключился - незавершённые элементы отменяются
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if on_close is not None:
+            on_close()
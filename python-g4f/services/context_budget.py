@@ -0,0 +1,211 @@
+"""
+Бюджет контекста: обрезка длинной истории диалога перед отправкой провайдеру
+
+Node.js сервис присылает всю историю на каждом ходе. Перед отправкой число
+токенов каждого сообщения оценивается локально (tiktoken, если установлен,
+иначе быстрая оценка по словам) и кэшируется по хэшу сообщения, так что
+на следующем ходе считаются только новые сообщения.
+
+Если история не помещается в бюджет модели (context_tokens из реестра
+моделей или CONTEXT_DEFAULT_TOKENS, минус CONTEXT_RESPONSE_RESERVE на
+ответ), старые ходы отбрасываются. Историю модели, размер контекста
+которой неизвестен (нет в реестре, CONTEXT_DEFAULT_TOKENS = 0), сервис
+не обрезает - это решает провайдер. System сообщения и последние
+CONTEXT_KEEP_LAST сообщений сохраняются всегда. Сообщение на границе,
+которое целиком не помещается, укорачивается с начала, если для него
+осталось не меньше CONTEXT_MIN_PARTIAL_TOKENS токенов.
+"""
+import hashlib
+import math
+import re
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+import config
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Токенов на служебную разметку сообщения (роль, разделители)
+MESSAGE_OVERHEAD = 4
+
+TRUNCATED_PREFIX = "…"
+
+_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+def heuristic_tokens(text: str) -> int:
+    """Оценка числа токенов без токенизатора: ~4 символа латиницы или ~2 символа кириллицы на токен"""
+    tokens = 0
+    for piece in _PIECES.findall(text):
+        if piece.isascii():
+            tokens += (len(piece) + 3) // 4
+        else:
+            tokens += (len(piece) + 1) // 2
+    return tokens
+
+
+def _tokenizer():
+    if config.CONTEXT_TOKENIZER == "tiktoken" and tiktoken is not None:
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return "tiktoken", lambda text: len(encoding.encode(text, disallowed_special=()))
+    return "heuristic", heuristic_tokens
+
+
+class ContextReport(NamedTuple):
+    """Что сделано с историей запроса"""
+    budget: int
+    original_tokens: int
+    prompt_tokens: int
+    trimmed_messages: int
+    truncated: bool
+
+    @property
+    def trimmed(self) -> bool:
+        return bool(self.trimmed_messages) or self.truncated
+
+    def as_dict(self) -> dict:
+        return {
+            "budget": self.budget,
+            "original_tokens": self.original_tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "trimmed_tokens": self.original_tokens - self.prompt_tokens,
+            "trimmed_messages": self.trimmed_messages,
+            "truncated": self.truncated,
+        }
+
+
+class ContextBudget:
+    def __init__(self, enabled: bool, default_tokens: int, response_reserve: int, keep_last: int,
+                 min_partial_tokens: int, cache_size: int):
+        self.enabled = enabled
+        self.default_tokens = default_tokens
+        self.response_reserve = response_reserve
+        self.keep_last = keep_last
+        self.min_partial_tokens = min_partial_tokens
+        self.cache_size = cache_size
+        self.tokenizer, self._count = _tokenizer()
+        self._cache: "OrderedDict[bytes, int]" = OrderedDict()
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.requests = 0
+        self.trimmed_requests = 0
+        self.trimmed_messages = 0
+        self.trimmed_tokens = 0
+
+    def count(self, message: dict) -> int:
+        """Токены сообщения (с кэшем по хэшу роли и текста)"""
+        digest = hashlib.blake2b(
+            message["role"].encode() + b"\0" + message["content"].encode(), digest_size=16
+        ).digest()
+        tokens = self._cache.get(digest)
+        if tokens is not None:
+            self._cache.move_to_end(digest)
+            self.cache_hits += 1
+            return tokens
+
+        self.cache_misses += 1
+        tokens = self._count(message["content"]) + MESSAGE_OVERHEAD
+        self._cache[digest] = tokens
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return tokens
+
+    def budget(self, context_tokens: Optional[int]) -> Optional[int]:
+        """Токенов на историю (None - размер контекста неизвестен, история не обрезается)"""
+        context_tokens = context_tokens or self.default_tokens
+        if not context_tokens:
+            return None
+        return max(1, context_tokens - self.response_reserve)
+
+    def _truncate(self, message: dict, tokens: int, allowed: int) -> dict:
+        """Оставить конец сообщения примерно на allowed токенов"""
+        content = message["content"]
+        keep = max(1, math.floor(len(content) * (allowed - MESSAGE_OVERHEAD - 1) / max(1, tokens - MESSAGE_OVERHEAD)))
+        return {"role": message["role"], "content": TRUNCATED_PREFIX + content[-keep:]}
+
+    def fit(self, messages: List[dict], context_tokens: Optional[int] = None) -> Tuple[List[dict], ContextReport]:
+        """
+        Уложить историю в бюджет модели
+
+        Args:
+            messages: Сообщения в формате OpenAI
+            context_tokens: Размер контекста модели из реестра (None - CONTEXT_DEFAULT_TOKENS)
+
+        Returns:
+            (сообщения для отправки, отчёт об обрезке)
+        """
+        budget = self.budget(context_tokens)
+        counts = [self.count(message) for message in messages]
+        total = sum(counts)
+        self.requests += 1
+        if not self.enabled or budget is None or total <= budget:
+            return messages, ContextReport(budget or 0, total, total, 0, False)
+
+        # Обязательные: system сообщения и последние keep_last сообщений
+        dialog = [index for index, message in enumerate(messages) if message["role"] != "system"]
+        required = {index for index, message in enumerate(messages) if message["role"] == "system"}
+        required.update(dialog[-self.keep_last:] if self.keep_last > 0 else [])
+        used = sum(counts[index] for index in required)
+
+        # Остальные ходы - от новых к старым, пока помещаются
+        kept = set(required)
+        truncated = {}
+        for index in reversed([index for index in dialog if index not in required]):
+            if used + counts[index] <= budget:
+                kept.add(index)
+                used += counts[index]
+                continue
+            allowed = budget - used
+            if allowed >= self.min_partial_tokens:
+                truncated[index] = self._truncate(messages[index], counts[index], allowed)
+                kept.add(index)
+                used += allowed
+            break
+
+        # История после обрезки начинается с сообщения пользователя
+        for index in dialog:
+            if index in required or index not in kept:
+                continue
+            if messages[index]["role"] == "user":
+                break
+            kept.discard(index)
+            truncated.pop(index, None)
+
+        result = [truncated.get(index, message) for index, message in enumerate(messages) if index in kept]
+        prompt_tokens = sum(self.count(message) for message in result)
+        report = ContextReport(budget, total, prompt_tokens, len(messages) - len(result), bool(truncated))
+        if report.trimmed:
+            self.trimmed_requests += 1
+            self.trimmed_messages += report.trimmed_messages
+            self.trimmed_tokens += total - prompt_tokens
+        return result, report
+
+    def stats(self) -> dict:
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "enabled": self.enabled,
+            "tokenizer": self.tokenizer,
+            "default_tokens": self.default_tokens,
+            "response_reserve": self.response_reserve,
+            "keep_last": self.keep_last,
+            "cache_entries": len(self._cache),
+            "cache_hit_ratio": self.cache_hits / lookups if lookups else 0.0,
+            "requests": self.requests,
+            "trimmed_requests": self.trimmed_requests,
+            "trimmed_messages": self.trimmed_messages,
+            "trimmed_tokens": self.trimmed_tokens,
+        }
+
+
+context_budget = ContextBudget(
+    enabled=config.CONTEXT_TRIM_ENABLED,
+    default_tokens=config.CONTEXT_DEFAULT_TOKENS,
+    response_reserve=config.CONTEXT_RESPONSE_RESERVE,
+    keep_last=config.CONTEXT_KEEP_LAST,
+    min_partial_tokens=config.CONTEXT_MIN_PARTIAL_TOKENS,
+    cache_size=config.CONTEXT_TOKEN_CACHE_SIZE
+)
@@ -0,0 +1,132 @@
+"""
+Подключение к базе данных и создание схемы
+
+База данных задаётся DATABASE_URL: SQLite (по умолчанию) или PostgreSQL.
+SQLite открывается с PRAGMA из настроек (WAL, synchronous, busy_timeout,
+mmap_size), PostgreSQL - с пулом соединений DB_POOL_MIN..DB_POOL_MAX.
+Параметры, указанные в самом URL (?maxsize=20, ?synchronous=FULL), имеют
+приоритет над настройками.
+
+Генерация схемы Tortoise на каждом запуске не нужна: хэш DDL моделей
+хранится в служебной таблице, и схема создаётся только если модели
+изменились (или база новая).
+"""
+import hashlib
+import logging
+from urllib.parse import urlparse
+
+from tortoise import Tortoise, connections
+from tortoise.backends.base.config_generator import expand_db_url
+from tortoise.utils import get_schema_sql
+
+import config
+
+logger = logging.getLogger(__name__)
+
+DB_URL = config.DATABASE_URL
+MODEL_MODULES = {"models": ["models.api_key"]}
+
+POSTGRES_SCHEMES = ("postgres", "asyncpg", "psycopg")
+
+SCHEMA_TABLE = "g4f_schema_version"
+
+
+def backend(url: str = DB_URL) -> str:
+    """sqlite, postgres или схема URL для остальных баз"""
+    scheme = urlparse(url).scheme
+    return "postgres" if scheme in POSTGRES_SCHEMES else scheme
+
+
+def db_config(url: str = DB_URL) -> dict:
+    """
+    Конфигурация Tortoise для URL базы данных
+
+    Args:
+        url: URL базы данных (sqlite://..., postgres://...)
+
+    Returns:
+        Словарь для Tortoise.init(config=...) с PRAGMA SQLite или
+        настройками пула PostgreSQL
+    """
+    connection = expand_db_url(url)
+    credentials = connection["credentials"]
+    kind = backend(url)
+    if kind == "sqlite":
+        # journal_mode у Tortoise уже есть по умолчанию (WAL), настройка его заменяет
+        if "journal_mode" not in urlparse(url).query:
+            credentials["journal_mode"] = config.SQLITE_JOURNAL_MODE
+        credentials.setdefault("synchronous", config.SQLITE_SYNCHRONOUS)
+        credentials.setdefault("busy_timeout", config.SQLITE_BUSY_TIMEOUT)
+        credentials.setdefault("mmap_size", config.SQLITE_MMAP_SIZE)
+    elif kind == "postgres":
+        credentials.setdefault("minsize", config.DB_POOL_MIN)
+        credentials.setdefault("maxsize", config.DB_POOL_MAX)
+        credentials.setdefault("max_inactive_connection_lifetime", config.DB_POOL_MAX_INACTIVE)
+
+    return {
+        "connections": {"default": connection},
+        "apps": {
+            app: {"models": modules, "default_connection": "default"}
+            for app, modules in MODEL_MODULES.items()
+        },
+    }
+
+
+async def ensure_schema() -> bool:
+    """
+    Создать таблицы, если схема моделей изменилась с прошлого запуска
+
+    Returns:
+        True - схема создавалась, False - уже актуальна
+    """
+    connection = connections.get("default")
+    schema_hash = hashlib.sha256(get_schema_sql(connection, safe=True).encode()).hexdigest()
+
+    await connection.execute_script(f"CREATE TABLE IF NOT EXISTS {SCHEMA_TABLE} (schema_hash TEXT NOT NULL)")
+    _, rows = await connection.execute_query(f"SELECT schema_hash FROM {SCHEMA_TABLE}")
+    if rows and rows[0]["schema_hash"] == schema_hash:
+        return False
+
+    await Tortoise.generate_schemas(safe=True)
+    await connection.execute_script(f"DELETE FROM {SCHEMA_TABLE}")
+    await connection.execute_query(f"INSERT INTO {SCHEMA_TABLE} (schema_hash) VALUES ('{schema_hash}')")
+    return True
+
+
+async def init_db():
+    """Подключиться к базе данных и при необходимости создать схему"""
+    await Tortoise.init(config=db_config())
+    logger.info(f"База данных: {backend()}")
+    if await ensure_schema():
+        logger.info("Схема базы данных создана")
+    else:
+        logger.info("Схема базы данных актуальна, генерация пропущена")
+
+
+async def info() -> dict:
+    """
+    Фактические настройки подключения
+
+    Returns:
+        Тип базы; для SQLite - действующие PRAGMA, для PostgreSQL -
+        размер пула и число свободных соединений
+    """
+    connection = connections.get("default")
+    kind = backend()
+    data = {"backend": kind}
+    if kind == "sqlite":
+        for pragma in ("journal_mode", "synchronous", "busy_timeout", "mmap_size"):
+            _, rows = await connection.execute_query(f"PRAGMA {pragma}")
+            data[pragma] = rows[0][0] if rows else None
+    elif kind == "postgres":
+        data["pool_min"] = connection.pool_minsize
+        data["pool_max"] = connection.pool_maxsize
+        pool = getattr(connection, "_pool", None)
+        if hasattr(pool, "get_size"):
+            data["pool_size"] = pool.get_size()
+            data["pool_idle"] = pool.get_idle_size()
+    return data
+
+
+async def close_db():
+    await Tortoise.close_connections()
@@ -0,0 +1,124 @@
+"""
+Крайний срок запроса
+
+Срок задаётся заголовком X-Request-Deadline: секунды на запрос ("115")
+или абсолютное время UNIX ("1767225600.5"); без заголовка -
+REQUEST_DEADLINE_DEFAULT (чуть меньше таймаута Node.js сервиса) или
+STREAM_DEADLINE_DEFAULT для потоков, не больше REQUEST_DEADLINE_MAX.
+
+Оставшееся время делится между попытками fallback: каждый следующий
+провайдер получает поровну от того, что осталось, поэтому зависший первый
+провайдер не съедает весь срок. guard() отменяет работу с провайдерами,
+как только срок истёк или клиент отключился, и слоты провайдеров
+освобождаются сразу, а не после ответа, который уже никто не прочитает.
+
+Попытка, прерванная сроком клиента, считается отказом провайдера, только
+если у неё было не меньше DEADLINE_FAILURE_MIN_SECONDS: иначе клиент с
+коротким сроком открывал бы circuit breaker для всех.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import config
+
+T = TypeVar("T")
+
+# Значения заголовка больше этого - абсолютное время UNIX, а не секунды
+ABSOLUTE_THRESHOLD = 1e9
+
+
+class DeadlineExceeded(Exception):
+    """Срок запроса истёк"""
+
+
+class ClientDisconnected(Exception):
+    """Клиент отключился, не дождавшись ответа"""
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def attempt_timeout(self, attempts_left: int) -> float:
+        """Время на очередную попытку: поровну между оставшимися попытками"""
+        return self.remaining() / max(1, attempts_left)
+
+
+def blames_provider(attempt_timeout: Optional[float]) -> bool:
+    """Считать ли отказом провайдера попытку, прерванную сроком запроса"""
+    return attempt_timeout is None or attempt_timeout >= config.DEADLINE_FAILURE_MIN_SECONDS
+
+
+def parse(value: Optional[str], default: float) -> Deadline:
+    """
+    Срок из заголовка X-Request-Deadline
+
+    Args:
+        value: Значение заголовка (None - срок по умолчанию)
+        default: Срок по умолчанию, секунды
+
+    Raises:
+        ValueError: значение не число или срок уже истёк
+    """
+    if value is None or not value.strip():
+        return Deadline(default)
+    seconds = float(value)
+    if seconds != seconds:
+        raise ValueError("NaN")
+    if seconds > ABSOLUTE_THRESHOLD:
+        seconds -= time.time()
+    if seconds <= 0:
+        raise ValueError("срок уже истёк")
+    return Deadline(min(seconds, config.REQUEST_DEADLINE_MAX))
+
+
+async def _wait_disconnect(receive: Callable[[], Awaitable[dict]]):
+    try:
+        while (await receive())["type"] != "http.disconnect":
+            pass
+    except Exception:
+        # Отключение отследить нельзя - остаются только результат и срок
+        await asyncio.Event().wait()
+
+
+async def guard(awaitable: Awaitable[T], deadline: Deadline,
+                receive: Optional[Callable[[], Awaitable[dict]]] = None) -> T:
+    """
+    Дождаться результата, отменив работу при истечении срока или отключении клиента
+
+    Args:
+        awaitable: Работа с провайдерами
+        deadline: Срок запроса
+        receive: ASGI receive запроса (тело уже прочитано) - следить за отключением клиента
+
+    Raises:
+        DeadlineExceeded: срок истёк
+        ClientDisconnected: клиент отключился
+    """
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.create_task(_wait_disconnect(receive)) if receive is not None else None
+    waiting = {task, watcher} if watcher is not None else {task}
+    try:
+        done, _ = await asyncio.wait(waiting, timeout=deadline.remaining(), return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+    if task in done:
+        return task.result()
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    if watcher in done:
+        raise ClientDisconnected()
+    raise DeadlineExceeded()
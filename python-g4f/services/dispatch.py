@@ -0,0 +1,219 @@
+"""
+Перебор провайдеров для обычного (не потокового) chat completion
+
+Без политики hedging провайдеры пробуются по очереди: следующий - только
+после ошибки предыдущего. С политикой, если текущий провайдер не ответил
+за задержку hedging, параллельно запускается следующий; первый успешный
+ответ побеждает, остальные запросы отменяются.
+
+Со сроком запроса (Deadline) каждая попытка по очереди получает поровну от
+оставшегося времени на оставшихся провайдеров; с hedging срок ограничивает
+ожидание всех запущенных запросов.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from services import metrics, upstream
+from services.deadline import Deadline, DeadlineExceeded, blames_provider
+from services.model_registry import model_registry
+from services.provider_router import provider_router
+
+logger = logging.getLogger(__name__)
+
+# Минимум замеров задержки, чтобы доверять перцентилю
+MIN_PERCENTILE_SAMPLES = 10
+
+
+class AllProvidersFailed(Exception):
+    """Ни один провайдер не вернул ответ"""
+
+
+class HedgingStats:
+    def __init__(self):
+        self.requests = 0
+        self.fired = 0
+        self.won = 0
+
+
+hedging_stats: Dict[str, HedgingStats] = {}
+
+
+def hedging_snapshot() -> dict:
+    """Счётчики hedging по моделям"""
+    return {
+        model: {"requests": stats.requests, "fired": stats.fired, "won": stats.won}
+        for model, stats in hedging_stats.items()
+    }
+
+
+def hedge_delay(model: str, provider: str, policy: dict) -> float:
+    """
+    Через сколько секунд без ответа запускать следующий провайдер
+
+    Если в политике задан percentile и замеров достаточно, берётся
+    наблюдаемый перцентиль задержки провайдера, иначе - фиксированный delay.
+    """
+    percentile = policy.get("percentile")
+    if percentile:
+        stats = provider_router.stats(model, provider)
+        if len(stats.latencies) >= MIN_PERCENTILE_SAMPLES:
+            return stats.percentile(percentile)
+    return policy["delay"]
+
+
+async def _attempt(model: str, messages: List[dict], provider: str, options: Optional[dict] = None):
+    started = time.perf_counter()
+    try:
+        response = await upstream.create_completion(model=model, messages=messages, provider=provider, **(options or {}))
+    except asyncio.CancelledError:
+        # Попытку отменили (проигравший hedge, срок, отключение клиента) - пробный запрос не состоялся
+        provider_router.release_probe(model, provider)
+        raise
+    except Exception as e:
+        metrics.PROVIDER_LATENCY.observe(model_registry.metric_label(model), provider, "error", value=time.perf_counter() - started)
+        metrics.ERRORS.inc("provider", type(e).__name__)
+        raise
+
+    latency = time.perf_counter() - started
+    metrics.PROVIDER_LATENCY.observe(model_registry.metric_label(model), provider, "success", value=latency)
+    provider_router.record_success(model, provider, latency)
+    return response
+
+
+async def complete(model: str, messages: List[dict], providers: List[str], policy: Optional[dict] = None,
+                   options: Optional[dict] = None, deadline: Optional[Deadline] = None) -> Tuple[str, object]:
+    """
+    Получить ответ от первого успешного провайдера
+
+    Args:
+        model: Название модели
+        messages: Сообщения в формате OpenAI
+        providers: Провайдеры в порядке перебора
+        policy: Политика hedging ({"delay", "percentile", "max_hedges"}) или None
+        options: Дополнительные параметры запроса к g4f (например, tools)
+        deadline: Срок запроса или None
+
+    Returns:
+        (провайдер, ChatCompletion)
+
+    Raises:
+        AllProvidersFailed: ни один провайдер не ответил
+        DeadlineExceeded: срок истёк до ответа
+    """
+    if policy and len(providers) > 1:
+        return await _complete_hedged(model, messages, providers, policy, options, deadline)
+
+    last_error = None
+    for index, provider in enumerate(providers):
+        timeout = deadline.attempt_timeout(len(providers) - index) if deadline is not None else None
+        if timeout is not None and timeout <= 0:
+            raise DeadlineExceeded(last_error)
+        if not provider_router.claim(model, provider):
+            logger.info(f"Провайдер {provider} пропущен: пробный запрос half-open уже идёт")
+            continue
+        logger.info(f"Пробуем провайдер: {provider}")
+        attempt_deadline = asyncio.timeout(timeout)
+        try:
+            async with attempt_deadline:
+                response = await _attempt(model, messages, provider, options)
+        except asyncio.TimeoutError as e:
+            if not attempt_deadline.expired():
+                # Таймаут самого провайдера
+                last_error = str(e) or type(e).__name__
+                logger.warning(f"Провайдер {provider} не работает: {last_error}")
+                provider_router.record_failure(model, provider, last_error)
+                continue
+            last_error = f"нет ответа за {timeout:.1f} с"
+            logger.warning(f"Провайдер {provider} не уложился в срок: {last_error}")
+            metrics.ERRORS.inc("provider", "DeadlineExceeded")
+            if blames_provider(timeout):
+                provider_router.record_failure(model, provider, last_error)
+            continue
+        except Exception as e:
+            last_error = str(e)
+            logger.warning(f"Провайдер {provider} не работает: {last_error}")
+            provider_router.record_failure(model, provider, last_error)
+            continue
+
+        logger.info(f"Успешно! Провайдер: {provider}")
+        return provider, response
+
+    if deadline is not None and deadline.expired():
+        raise DeadlineExceeded(last_error)
+    raise AllProvidersFailed(last_error)
+
+
+async def _complete_hedged(model: str, messages: List[dict], providers: List[str], policy: dict,
+                           options: Optional[dict] = None, deadline: Optional[Deadline] = None) -> Tuple[str, object]:
+    stats = hedging_stats.setdefault(model, HedgingStats())
+    stats.requests += 1
+
+    max_hedges = policy.get("max_hedges", 1)
+    hedges = 0
+    pending: Dict[asyncio.Task, Tuple[str, bool]] = {}
+    next_index = 0
+    last_error = None
+
+    def launch(is_hedge: bool) -> bool:
+        """Запустить следующий провайдер, который можно пробовать; False - таких не осталось"""
+        nonlocal next_index
+        while next_index < len(providers):
+            provider = providers[next_index]
+            next_index += 1
+            if not provider_router.claim(model, provider):
+                logger.info(f"Провайдер {provider} пропущен: пробный запрос half-open уже идёт")
+                continue
+            logger.info(f"Пробуем провайдер: {provider}" + (" (hedge)" if is_hedge else ""))
+            task = asyncio.create_task(_attempt(model, messages, provider, options))
+            pending[task] = (provider, is_hedge)
+            return True
+        return False
+
+    launch(is_hedge=False)
+    try:
+        while pending:
+            hedge_timeout = None
+            if next_index < len(providers) and hedges < max_hedges:
+                newest_provider = list(pending.values())[-1][0]
+                hedge_timeout = hedge_delay(model, newest_provider, policy)
+            timeout = hedge_timeout
+            if deadline is not None and (timeout is None or deadline.remaining() < timeout):
+                timeout = deadline.remaining()
+
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done and timeout != hedge_timeout:
+                raise DeadlineExceeded(last_error)
+            if not done:
+                # Провайдер не ответил вовремя - запускаем следующий параллельно
+                if launch(is_hedge=True):
+                    hedges += 1
+                    stats.fired += 1
+                continue
+
+            for task in done:
+                provider, is_hedge = pending.pop(task)
+                error = task.exception()
+                if error is None:
+                    if is_hedge:
+                        stats.won += 1
+                    logger.info(f"Успешно! Провайдер: {provider}")
+                    return provider, task.result()
+
+                last_error = str(error)
+                logger.warning(f"Провайдер {provider} не работает: {last_error}")
+                provider_router.record_failure(model, provider, last_error)
+
+            # Все запущенные упали - обычный fallback на следующий провайдер
+            if not pending and next_index < len(providers):
+                launch(is_hedge=False)
+    finally:
+        # Проигравшие запросы отменяются и освобождают слоты провайдеров
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    raise AllProvidersFailed(last_error)
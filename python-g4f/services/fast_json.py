@@ -0,0 +1,66 @@
+"""
+Сериализация JSON на горячем пути
+
+Ответ /v1/chat/completions, SSE чанки потоков, строки NDJSON пакетных
+запросов и записи кэша ответов кодируются через dumps()/dumps_str()
+этого модуля.
+
+По умолчанию это json из стандартной библиотеки с прежним форматом. При
+FAST_JSON=true используется orjson, а если он не установлен - кодировщик
+pydantic_core (есть всегда вместе с pydantic); обычный ответ completion
+отдаётся готовым FastJSONResponse без повторной валидации и сериализации
+через response_model ChatResponse. Структура ответов не меняется.
+"""
+import json
+import logging
+from typing import Any, Callable, Dict
+
+import pydantic_core
+from starlette.responses import JSONResponse
+
+import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def _json(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+# Кодировщики: значение -> UTF-8 JSON
+ENCODERS: Dict[str, Callable[[Any], bytes]] = {
+    "json": _json,
+    "pydantic_core": pydantic_core.to_json,
+}
+if orjson is not None:
+    ENCODERS["orjson"] = orjson.dumps
+
+
+def select_backend(fast: bool) -> str:
+    """Кодировщик для режима FAST_JSON"""
+    if not fast:
+        return "json"
+    if orjson is None:
+        logger.info("FAST_JSON: orjson не установлен, используется кодировщик pydantic_core")
+        return "pydantic_core"
+    return "orjson"
+
+
+BACKEND = select_backend(config.FAST_JSON)
+dumps = ENCODERS[BACKEND]
+
+
+def dumps_str(value: Any) -> str:
+    return dumps(value).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse, который кодирует содержимое выбранным кодировщиком как есть"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
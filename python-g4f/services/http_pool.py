@@ -0,0 +1,162 @@
+"""
+Общий пул HTTP соединений к провайдерам
+
+Провайдеры g4f на aiohttp (StreamSession) без собственного connector'а
+берут общий connector event loop'а. Сервис создаёт его сам в lifespan -
+с keep-alive, кэшем DNS и лимитами из настроек - и подставляет в g4f после
+загрузки, поэтому соединения к одним и тем же хостам (api.airforce,
+deepinfra.com, huggingface.co, ...) переиспользуются между запросами, а
+не открываются заново с DNS, TCP и TLS на каждый вызов.
+
+При HTTP_POOL_PRECONNECT после прогрева открываются соединения к хостам
+провайдеров из реестра моделей. Статистика (запросы, новые соединения,
+переиспользованные) считается по хостам.
+
+HTTP/2 aiohttp не поддерживает; провайдеры, которые g4f запускает через
+curl_cffi (если он установлен), управляют соединениями сами и через этот
+пул не проходят.
+"""
+import asyncio
+import logging
+import sys
+from typing import Dict, Iterable, List, Optional
+
+import aiohttp
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class PoolConnector(aiohttp.TCPConnector):
+    """TCPConnector со счётчиками запросов и новых соединений по хостам"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Хост -> [запросов соединения, новых соединений]
+        self.host_stats: Dict[str, List[int]] = {}
+
+    def _host(self, host: str) -> List[int]:
+        stats = self.host_stats.get(host)
+        if stats is None:
+            stats = self.host_stats[host] = [0, 0]
+        return stats
+
+    async def connect(self, req, *args, **kwargs):
+        self._host(req.host)[0] += 1
+        return await super().connect(req, *args, **kwargs)
+
+    async def _create_connection(self, req, *args, **kwargs):
+        self._host(req.host)[1] += 1
+        return await super()._create_connection(req, *args, **kwargs)
+
+
+class HttpPool:
+    def __init__(self, limit: int, limit_per_host: int, keepalive: float, dns_ttl: int,
+                 preconnect_timeout: float):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive = keepalive
+        self.dns_ttl = dns_ttl
+        self.preconnect_timeout = preconnect_timeout
+        self.connector: Optional[PoolConnector] = None
+        self.attached = False
+        self.preconnected: Dict[str, Optional[str]] = {}
+
+    def open(self):
+        """Создать connector (вызывается из lifespan, нужен работающий event loop)"""
+        self.connector = PoolConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive,
+            ttl_dns_cache=self.dns_ttl,
+            enable_cleanup_closed=True
+        )
+
+    def attach_g4f(self) -> bool:
+        """
+        Подставить connector в g4f как общий для текущего event loop'а
+
+        Returns:
+            False - установленная версия g4f не поддерживает общий connector
+        """
+        if self.connector is None:
+            return False
+        # g4f уже загружен прогревом (upstream.get_client); здесь он не импортируется,
+        # чтобы не блокировать event loop (например, с заглушкой провайдера в бенчмарках)
+        g4f_aiohttp = sys.modules.get("g4f.requests.aiohttp")
+        loop_connectors = getattr(g4f_aiohttp, "_loop_connectors", None)
+        if loop_connectors is None:
+            logger.warning("g4f не загружен или не поддерживает общий connector, пул HTTP соединений не используется")
+            return False
+        loop_connectors[asyncio.get_running_loop()] = self.connector
+        self.attached = True
+        logger.info(f"Пул HTTP соединений подключён к g4f: до {self.limit} соединений, {self.limit_per_host} на хост")
+        return True
+
+    async def preconnect(self, urls: Iterable[str]):
+        """Открыть соединения к хостам провайдеров заранее (HEAD запрос, ошибки только логируются)"""
+        if self.connector is None:
+            return
+        timeout = aiohttp.ClientTimeout(total=self.preconnect_timeout)
+
+        async with aiohttp.ClientSession(connector=self.connector, connector_owner=False, timeout=timeout) as session:
+            async def one(url: str):
+                try:
+                    async with session.head(url, allow_redirects=False) as response:
+                        await response.release()
+                    self.preconnected[url] = None
+                except Exception as e:
+                    self.preconnected[url] = str(e) or type(e).__name__
+                    logger.warning(f"Не удалось заранее подключиться к {url}: {self.preconnected[url]}")
+
+            await asyncio.gather(*(one(url) for url in urls))
+        logger.info(f"Заранее открыты соединения: {sum(error is None for error in self.preconnected.values())} из {len(self.preconnected)}")
+
+    async def close(self):
+        if self.connector is not None:
+            await self.connector.close()
+            self.connector = None
+        self.attached = False
+
+    def stats(self) -> dict:
+        hosts = {}
+        if self.connector is not None:
+            for host, (requests, created) in sorted(self.connector.host_stats.items()):
+                hosts[host] = {
+                    "requests": requests,
+                    "new_connections": created,
+                    "reused": max(0, requests - created),
+                    "reuse_ratio": (requests - created) / requests if requests else 0.0,
+                }
+        return {
+            "open": self.connector is not None,
+            "attached_to_g4f": self.attached,
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "keepalive": self.keepalive,
+            "dns_ttl": self.dns_ttl,
+            "preconnected": self.preconnected,
+            "hosts": hosts,
+        }
+
+
+def provider_urls(providers: Iterable[str]) -> List[str]:
+    """Базовые URL провайдеров g4f (для предварительного подключения); g4f должен быть загружен"""
+    import g4f.Provider
+
+    urls = []
+    for name in providers:
+        url = getattr(getattr(g4f.Provider, name, None), "url", None)
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+
+http_pool = HttpPool(
+    limit=config.HTTP_POOL_LIMIT,
+    limit_per_host=config.HTTP_POOL_LIMIT_PER_HOST,
+    keepalive=config.HTTP_POOL_KEEPALIVE,
+    dns_ttl=config.HTTP_POOL_DNS_TTL,
+    preconnect_timeout=config.HTTP_POOL_PRECONNECT_TIMEOUT
+)
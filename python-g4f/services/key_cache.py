@@ -0,0 +1,101 @@
+"""
+Кэш проверки API ключей
+
+Хранит результат проверки ключа (и его квоты) в памяти процесса, чтобы
+не ходить в базу данных на каждый запрос. Валидные ключи живут API_KEY_CACHE_TTL
+секунд, невалидные - API_KEY_CACHE_NEGATIVE_TTL секунд. При переполнении
+вытесняются давно не использованные записи (LRU).
+"""
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+import config
+
+
+class KeyInfo(NamedTuple):
+    """Результат проверки ключа; квоты None - значения по умолчанию из config"""
+    valid: bool
+    requests_per_minute: Optional[int] = None
+    max_concurrent: Optional[int] = None
+
+
+INVALID_KEY = KeyInfo(valid=False)
+
+
+class KeyCache:
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lookups = 0
+        self.lookup_time_total = 0.0
+        self.lookup_time_max = 0.0
+
+    def get(self, key: str) -> Optional[KeyInfo]:
+        """
+        Найти ключ в кэше
+
+        Returns:
+            KeyInfo - результат проверки, None - ключа нет в кэше
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        info, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return info
+
+    def put(self, key: str, info: KeyInfo):
+        """Сохранить результат проверки ключа"""
+        ttl = self.ttl if info.valid else self.negative_ttl
+        self._entries[key] = (info, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: str):
+        """Удалить ключ из кэша (после создания, отзыва или смены квот)"""
+        self._entries.pop(key, None)
+
+    def observe_lookup(self, seconds: float):
+        """Учесть время полной проверки ключа (кэш + база данных)"""
+        self.lookups += 1
+        self.lookup_time_total += seconds
+        self.lookup_time_max = max(self.lookup_time_max, seconds)
+
+    def stats(self) -> dict:
+        """Статистика кэша"""
+        requests = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / requests if requests else 0.0,
+            "lookup_avg_ms": self.lookup_time_total / self.lookups * 1000 if self.lookups else 0.0,
+            "lookup_max_ms": self.lookup_time_max * 1000,
+        }
+
+
+key_cache = KeyCache(
+    max_size=config.API_KEY_CACHE_SIZE,
+    ttl=config.API_KEY_CACHE_TTL,
+    negative_ttl=config.API_KEY_CACHE_NEGATIVE_TTL
+)
@@ -0,0 +1,286 @@
+"""
+Метрики в текстовом формате Prometheus (/metrics)
+
+Собственная минимальная реализация без внешних зависимостей. Запись на
+горячем пути - поиск по словарю и bisect по границам бакетов, без
+блокировок: всё выполняется в одном event loop. Сложные вычисления
+(кумулятивные бакеты, значения из других сервисов) откладываются до
+момента сбора метрик.
+"""
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple
+
+# Бакеты задержек провайдеров: от быстрых ответов до долгих генераций
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60, 120)
+
+# Бакеты для быстрых операций (проверка API ключа)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def set(self, *label_values, value: float):
+        """Перенести накопленное значение из счётчиков другого сервиса"""
+        self._values[label_values] = value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for values, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, values)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) - amount
+
+    def set(self, *label_values, value: float):
+        self._values[label_values] = value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for values, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # label_values -> [счётчики по бакетам (не кумулятивные) + +Inf, сумма]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, *label_values, value: float):
+        entry = self._values.get(label_values)
+        if entry is None:
+            entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for values, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, values, f'le="{_format_value(float(bound))}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Функция, обновляющая gauge'и прямо перед сбором метрик"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# ==========================================
+# HTTP
+# ==========================================
+
+HTTP_REQUESTS = registry.register(Counter(
+    "g4f_http_requests_total", "HTTP запросы по маршруту и статусу", ("method", "route", "status")
+))
+HTTP_DURATION = registry.register(Histogram(
+    "g4f_http_request_duration_seconds", "Время обработки HTTP запроса", ("route",), buckets=LATENCY_BUCKETS
+))
+HTTP_IN_FLIGHT = registry.register(Gauge(
+    "g4f_http_in_flight", "HTTP запросы, обрабатываемые прямо сейчас"
+))
+
+# ==========================================
+# COMPLETIONS
+# ==========================================
+
+PROVIDER_LATENCY = registry.register(Histogram(
+    "g4f_provider_latency_seconds", "Задержка ответа провайдера", ("model", "provider", "outcome")
+))
+TTFT = registry.register(Histogram(
+    "g4f_time_to_first_token_seconds", "Время до первого чанка (для обычных запросов - до ответа)", ("model", "stream")
+))
+FALLBACK_INDEX = registry.register(Counter(
+    "g4f_fallback_index_total", "Успешные ответы по индексу провайдера в реестре моделей", ("model", "index")
+))
+ERRORS = registry.register(Counter(
+    "g4f_errors_total", "Ошибки по классу", ("stage", "error")
+))
+UPSTREAM_IN_FLIGHT = registry.register(Gauge(
+    "g4f_upstream_in_flight", "Запросы к провайдерам, выполняющиеся прямо сейчас"
+))
+
+ADMISSION_WAIT = registry.register(Histogram(
+    "g4f_admission_wait_seconds", "Ожидание в очереди admission control", buckets=FAST_BUCKETS + (2, 5, 10, 30)
+))
+ADMISSION_QUEUE_DEPTH = registry.register(Gauge(
+    "g4f_admission_queue_depth", "Запросов в очереди admission control"
+))
+ADMISSION_ACTIVE = registry.register(Gauge(
+    "g4f_admission_active", "Запросов, допущенных к провайдерам"
+))
+ADMISSION_SHED = registry.register(Counter(
+    "g4f_admission_shed_total", "Запросы, отклонённые при перегрузке", ("reason",)
+))
+
+# ==========================================
+# AUTH
+# ==========================================
+
+AUTH_LOOKUP = registry.register(Histogram(
+    "g4f_auth_lookup_seconds", "Время проверки API ключа", ("source",), buckets=FAST_BUCKETS
+))
+
+# ==========================================
+# КЭШИ, ОБЪЕДИНЕНИЕ ЗАПРОСОВ, HEDGING, ROUTER
+# (обновляются при сборе метрик)
+# ==========================================
+
+RATE_LIMITED = registry.register(Counter(
+    "g4f_rate_limited_total", "Отказы 429 по квотам ключей", ("reason",)
+))
+KEY_CACHE_LOOKUPS = registry.register(Counter(
+    "g4f_key_cache_lookups_total", "Обращения к кэшу API ключей", ("result",)
+))
+KEY_CACHE_ENTRIES = registry.register(Gauge(
+    "g4f_key_cache_entries", "Ключей в кэше API ключей"
+))
+RESPONSE_CACHE_LOOKUPS = registry.register(Counter(
+    "g4f_response_cache_lookups_total", "Обращения к кэшу ответов", ("result",)
+))
+RESPONSE_CACHE_EVICTIONS = registry.register(Counter(
+    "g4f_response_cache_evictions_total", "Вытеснения из кэша ответов", ("tier",)
+))
+RESPONSE_CACHE_BYTES = registry.register(Gauge(
+    "g4f_response_cache_bytes", "Объём кэша ответов в памяти"
+))
+SINGLEFLIGHT_REQUESTS = registry.register(Counter(
+    "g4f_singleflight_requests_total", "Запросы через single-flight: leader - вызвал провайдера, joined - присоединился",
+    ("kind", "role")
+))
+HEDGES = registry.register(Counter(
+    "g4f_hedges_total", "Hedge-запросы: fired - запущено, won - победило", ("model", "result")
+))
+CIRCUIT_OPEN = registry.register(Gauge(
+    "g4f_provider_circuit_open", "1 - circuit breaker провайдера не закрыт", ("model", "provider")
+))
+SIMILARITY_CACHE_LOOKUPS = registry.register(Counter(
+    "g4f_similarity_cache_lookups_total", "Обращения к кэшу похожих запросов", ("result",)
+))
+HTTP_POOL_CONNECTIONS = registry.register(Counter(
+    "g4f_http_pool_connections_total",
+    "Соединения пула HTTP к провайдерам: new - открыто новое, reused - взято из пула", ("host", "kind")
+))
+
+PROVIDER_UP = registry.register(Gauge(
+    "g4f_provider_up", "1 - провайдер прошёл последнюю фоновую проверку", ("provider",)
+))
+
+
+def render() -> str:
+    return registry.render()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: число, время и параллельность HTTP запросов
+
+    Маршрут берётся из шаблона FastAPI (/v1/admin/revoke_api_key/{api_key}),
+    чтобы значения параметров не раздували число серий.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            HTTP_REQUESTS.inc(scope["method"], route_path, status)
+            HTTP_DURATION.observe(route_path, value=time.perf_counter() - started)
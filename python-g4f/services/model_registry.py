@@ -0,0 +1,251 @@
+"""
+Реестр моделей (model_registry.json)
+
+Единственный источник списка моделей, их провайдеров, политик hedging и
+размеров контекста (context_tokens - бюджет обрезки истории).
+Файл перечитывается без перезапуска: фоновая задача раз в
+REGISTRY_RELOAD_INTERVAL секунд проверяет, изменился ли он, а
+POST /v1/admin/registry/reload перечитывает его сразу. Файл с ошибкой
+не применяется - продолжает работать прежний реестр.
+
+JSON ответа /v1/models и ETag готовятся один раз при загрузке; ответ
+/v1/providers пересобирается только после новых результатов фоновой
+проверки провайдеров.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Метка метрик для моделей, которых нет в реестре
+OTHER_MODEL = "other"
+
+
+class RegistryError(Exception):
+    """Файл реестра не найден или содержит ошибку"""
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def _dump(payload: dict) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class RegistrySnapshot:
+    """Загруженный реестр; после создания не меняется, перезагрузка подменяет объект целиком"""
+
+    def __init__(self, data: dict, version: str):
+        self.version = version
+        self.loaded_at = time.time()
+        self.default_model: str = data["default_model"]
+        self.models: Dict[str, dict] = data["models"]
+
+        self.model_providers: Dict[str, List[str]] = {
+            model: list(entry["providers"]) for model, entry in self.models.items()
+        }
+        self.hedging_policies: Dict[str, dict] = {
+            model: entry["hedging"] for model, entry in self.models.items() if entry.get("hedging")
+        }
+        self.context_tokens: Dict[str, int] = {
+            model: entry["context_tokens"] for model, entry in self.models.items() if entry.get("context_tokens")
+        }
+
+        # Провайдер -> модели, которые он обслуживает
+        self.provider_models: Dict[str, List[str]] = {}
+        for model, providers in self.model_providers.items():
+            for provider in providers:
+                self.provider_models.setdefault(provider, []).append(model)
+
+        models = [
+            {
+                "id": model,
+                "name": entry.get("name", model),
+                "family": entry.get("family"),
+                "type": entry.get("type", "text"),
+                "providers": entry["providers"],
+                "description": entry.get("description", entry.get("name", model)),
+            }
+            for model, entry in self.models.items()
+        ]
+        self.models_body = _dump({
+            "success": True,
+            "data": {
+                "models": models,
+                "default_model": self.default_model,
+                "total": len(models)
+            }
+        })
+        self.models_etag = make_etag(self.models_body)
+
+    def text_model_providers(self) -> Dict[str, List[str]]:
+        """Модели и их провайдеры без моделей генерации изображений"""
+        return {
+            model: providers for model, providers in self.model_providers.items()
+            if self.models[model].get("type", "text") == "text"
+        }
+
+
+def parse(raw: bytes) -> dict:
+    """
+    Разобрать и проверить содержимое файла реестра
+
+    Raises:
+        RegistryError: неверный JSON или структура
+    """
+    try:
+        data = json.loads(raw)
+    except ValueError as e:
+        raise RegistryError(f"Неверный JSON: {e}")
+
+    models = data.get("models") if isinstance(data, dict) else None
+    if not isinstance(models, dict) or not models:
+        raise RegistryError("Поле models должно быть непустым объектом")
+
+    for model, entry in models.items():
+        providers = entry.get("providers") if isinstance(entry, dict) else None
+        if not isinstance(providers, list) or not providers or not all(isinstance(p, str) for p in providers):
+            raise RegistryError(f"У модели {model} должен быть непустой список providers")
+        hedging = entry.get("hedging")
+        if hedging is not None and not isinstance(hedging.get("delay") if isinstance(hedging, dict) else None, (int, float)):
+            raise RegistryError(f"У политики hedging модели {model} должен быть delay (секунды)")
+        context_tokens = entry.get("context_tokens")
+        if context_tokens is not None and (not isinstance(context_tokens, int) or context_tokens <= 0):
+            raise RegistryError(f"context_tokens модели {model} должен быть положительным целым числом")
+
+    if data.get("default_model") not in models:
+        raise RegistryError("default_model должна быть одной из моделей реестра")
+    return data
+
+
+class ModelRegistry:
+    def __init__(self, path: str):
+        self.path = path
+        self._snapshot: Optional[RegistrySnapshot] = None
+        self._mtime: Optional[float] = None
+        self._providers_listing: Optional[Tuple[tuple, bytes, str]] = None
+
+        self.reloads = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def current(self) -> RegistrySnapshot:
+        return self._snapshot
+
+    def load(self) -> bool:
+        """
+        Прочитать файл реестра
+
+        Returns:
+            True - реестр изменился, False - содержимое то же
+
+        Raises:
+            RegistryError: файл не читается или содержит ошибку (прежний реестр остаётся)
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, "rb") as f:
+                raw = f.read()
+        except OSError as e:
+            self.last_error = str(e)
+            raise RegistryError(f"Не удалось прочитать реестр {self.path}: {e}")
+
+        self._mtime = mtime
+        version = hashlib.sha256(raw).hexdigest()[:16]
+        if self._snapshot is not None and self._snapshot.version == version:
+            return False
+
+        try:
+            snapshot = RegistrySnapshot(parse(raw), version)
+        except RegistryError as e:
+            self.last_error = str(e)
+            raise
+
+        self._snapshot = snapshot
+        self._providers_listing = None
+        self.last_error = None
+        self.reloads += 1
+        logger.info(f"Реестр моделей загружен: {len(snapshot.models)} моделей, версия {version}")
+        return True
+
+    def reload_if_changed(self) -> bool:
+        """Перечитать реестр, если файл изменился; ошибка только логируется"""
+        try:
+            if os.path.getmtime(self.path) == self._mtime:
+                return False
+            return self.load()
+        except (OSError, RegistryError) as e:
+            logger.error(f"Реестр моделей не перезагружен: {e}")
+            return False
+
+    async def watch(self, interval: float):
+        """Проверять изменения файла, пока задача не будет отменена"""
+        while True:
+            await asyncio.sleep(interval)
+            self.reload_if_changed()
+
+    def providers(self, model: str) -> List[str]:
+        """Провайдеры модели в порядке fallback (неизвестная модель - автовыбор g4f)"""
+        return self._snapshot.model_providers.get(model, ["auto"])
+
+    def metric_label(self, model: str) -> str:
+        """
+        Модель для меток метрик
+
+        Название модели приходит от клиента: модели вне реестра учитываются
+        под одной меткой OTHER_MODEL, иначе число серий не ограничено.
+        """
+        return model if model in self._snapshot.models else OTHER_MODEL
+
+    def hedging_policy(self, model: str) -> Optional[dict]:
+        return self._snapshot.hedging_policies.get(model)
+
+    def context_tokens(self, model: str) -> Optional[int]:
+        """Размер контекста модели (None - не задан в реестре)"""
+        return self._snapshot.context_tokens.get(model)
+
+    def providers_listing(self, status: Callable[[str], dict], status_version: int) -> Tuple[bytes, str]:
+        """
+        JSON ответа /v1/providers и его ETag
+
+        Args:
+            status: Провайдер -> статус последней фоновой проверки
+            status_version: Номер версии результатов проверки; пока он и
+                реестр не изменились, возвращается готовый ответ
+        """
+        snapshot = self._snapshot
+        key = (snapshot.version, status_version)
+        if self._providers_listing is None or self._providers_listing[0] != key:
+            body = _dump({
+                "success": True,
+                "data": [
+                    {"name": provider, "models": models, **status(provider)}
+                    for provider, models in snapshot.provider_models.items()
+                ]
+            })
+            self._providers_listing = (key, body, make_etag(body))
+        return self._providers_listing[1], self._providers_listing[2]
+
+    def info(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "path": self.path,
+            "version": snapshot.version,
+            "loaded_at": snapshot.loaded_at,
+            "models": len(snapshot.models),
+            "providers": len(snapshot.provider_models),
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+        }
+
+
+model_registry = ModelRegistry(config.MODEL_REGISTRY_PATH)
+model_registry.load()
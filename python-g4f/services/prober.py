@@ -0,0 +1,182 @@
+"""
+Фоновая проверка провайдеров (canary)
+
+Задача, запущенная из lifespan, раз в PROBER_INTERVAL секунд отправляет
+короткий промпт каждому провайдеру из реестра моделей (через первую
+текстовую модель, которую он обслуживает). Проверки разнесены во времени
+случайной задержкой и ограничены PROBER_CONCURRENCY одновременными запросами.
+
+Результаты хранятся в памяти и используются /v1/providers, а роутер
+ставит провайдеров, не прошедших последнюю проверку, в конец списка.
+При нескольких процессах проверяет только лидер (services.shared_state),
+остальные получают его результаты через apply_shared().
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Callable, Dict, List, Optional
+
+import config
+from services import upstream
+from services.provider_router import provider_router
+
+logger = logging.getLogger(__name__)
+
+
+class ProbeResult:
+    def __init__(self, provider: str, model: str):
+        self.provider = provider
+        self.model = model
+        self.ok: Optional[bool] = None
+        self.latency: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self.successes = 0
+        self.failures = 0
+
+    def status(self) -> str:
+        if self.ok is None:
+            return "unknown"
+        return "active" if self.ok else "down"
+
+    def as_dict(self) -> dict:
+        return {
+            "status": self.status(),
+            "probe_model": self.model,
+            "latency": self.latency,
+            "last_error": self.last_error,
+            "checked_at": self.checked_at,
+            "successes": self.successes,
+            "failures": self.failures,
+        }
+
+
+class ProviderProber:
+    def __init__(self, interval: float, jitter: float, concurrency: int, timeout: float, prompt: str, exclude: List[str]):
+        self.interval = interval
+        self.jitter = jitter
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.prompt = prompt
+        self.exclude = set(exclude)
+        self.results: Dict[str, ProbeResult] = {}
+        # Результаты, полученные от процесса-лидера через общее состояние
+        self.shared_results: Dict[str, dict] = {}
+        # services.shared_state.SharedState при нескольких процессах (подключается в lifespan)
+        self.shared = None
+        self.targeted: set = set()
+        self.rounds = 0
+        # Растёт с каждой проверкой: по нему пересобирается ответ /v1/providers
+        self.version = 0
+
+    def targets(self, model_providers: Dict[str, List[str]]) -> Dict[str, str]:
+        """Провайдер -> модель для проверки (первая модель провайдера в реестре)"""
+        targets: Dict[str, str] = {}
+        for model, providers in model_providers.items():
+            for provider in providers:
+                if provider != "auto" and provider not in self.exclude:
+                    targets.setdefault(provider, model)
+        return targets
+
+    async def probe(self, provider: str, model: str) -> ProbeResult:
+        """Отправить canary-промпт провайдеру и записать результат"""
+        result = self.results.get(provider)
+        if result is None or result.model != model:
+            result = self.results[provider] = ProbeResult(provider, model)
+
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                upstream.create_completion(
+                    model=model,
+                    messages=[{"role": "user", "content": self.prompt}],
+                    provider=provider
+                ),
+                self.timeout
+            )
+            if not response.choices[0].message.content:
+                raise ValueError("пустой ответ")
+        except Exception as e:
+            result.ok = False
+            result.last_error = str(e) or type(e).__name__
+            result.failures += 1
+            logger.warning(f"Проверка провайдера {provider} ({model}) не прошла: {result.last_error}")
+        else:
+            result.ok = True
+            result.latency = time.perf_counter() - started
+            result.successes += 1
+
+        result.checked_at = time.time()
+        self.version += 1
+        provider_router.set_provider_health(provider, result.ok)
+        if self.shared is not None:
+            try:
+                await self.shared.offload(self.shared.publish_provider_status, provider, result.ok, result.as_dict())
+            except Exception as e:
+                logger.warning(f"Не удалось записать проверку провайдера {provider} в общее состояние: {e}")
+        return result
+
+    def apply_shared(self, provider: str, status: dict):
+        """Принять результат проверки провайдера от другого процесса"""
+        self.shared_results[provider] = status
+        self.version += 1
+
+    async def probe_all(self, model_providers: Dict[str, List[str]]):
+        """Один раунд проверки всех провайдеров"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        spread = self.interval * self.jitter
+
+        async def one(provider: str, model: str):
+            # Случайная задержка, чтобы проверки не шли пачкой
+            await asyncio.sleep(random.uniform(0, spread))
+            async with semaphore:
+                await self.probe(provider, model)
+
+        targets = self.targets(model_providers)
+        self.targeted = set(targets)
+        await asyncio.gather(*(one(provider, model) for provider, model in targets.items()))
+        self.rounds += 1
+
+    async def run(self, model_providers: Callable[[], Dict[str, List[str]]]):
+        """
+        Проверять провайдеров, пока задача не будет отменена
+
+        Args:
+            model_providers: Возвращает актуальные модели и их провайдеров
+                (реестр может перезагрузиться между раундами)
+        """
+        logger.info(f"Фоновая проверка провайдеров: каждые {self.interval} с")
+        while True:
+            if self.shared is not None and not self.shared.leads():
+                # Проверяет другой процесс; ждём, не перейдёт ли аренда к этому
+                await asyncio.sleep(self.shared.sync_interval)
+                continue
+            try:
+                await self.probe_all(model_providers())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка фоновой проверки провайдеров: {e}")
+            await asyncio.sleep(self.interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def status(self, provider: str) -> dict:
+        """Последний результат проверки провайдера"""
+        result = self.results.get(provider)
+        shared = self.shared_results.get(provider)
+        if shared is not None and (result is None or (shared["checked_at"] or 0) > (result.checked_at or 0)):
+            return shared
+        if result is None:
+            probed = provider not in self.exclude and (not self.rounds or provider in self.targeted)
+            return {"status": "unknown" if probed else "not_probed"}
+        return result.as_dict()
+
+
+provider_prober = ProviderProber(
+    interval=config.PROBER_INTERVAL,
+    jitter=config.PROBER_JITTER,
+    concurrency=config.PROBER_CONCURRENCY,
+    timeout=config.PROBER_TIMEOUT,
+    prompt=config.PROBER_PROMPT,
+    exclude=config.PROBER_EXCLUDE
+)
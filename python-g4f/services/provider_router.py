@@ -0,0 +1,237 @@
+"""
+Адаптивный выбор провайдеров
+
+Для каждой пары (модель, провайдер) собирается статистика: EWMA и
+перцентили задержки, доля ошибок, ошибки подряд. Перед каждым запросом
+список провайдеров из реестра моделей переупорядочивается: первым идёт
+самый быстрый здоровый провайдер.
+
+Провайдеры, не прошедшие последнюю фоновую проверку (services.prober),
+ставятся в конец списка, но не исключаются.
+
+Circuit breaker: после ROUTER_FAILURE_THRESHOLD ошибок подряд провайдер
+отключается (open) на ROUTER_OPEN_SECONDS. Затем он переходит в half-open
+и получает один пробный запрос: успех закрывает breaker, ошибка снова
+открывает его. Слот пробного запроса занимает claim() в момент, когда
+попытка к провайдеру действительно начинается, а не order(): запрос,
+отклонённый квотами или присоединившийся к чужому single-flight, слот не
+занимает.
+"""
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+import config
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ProviderStats:
+    def __init__(self, window: int):
+        self.ewma_latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.latencies = deque(maxlen=window)
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_started_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_success_at: Optional[float] = None
+        self.last_failure_at: Optional[float] = None
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Перцентиль задержки по последним запросам (q от 0 до 1)"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def score(self) -> float:
+        """Ожидаемое время до успешного ответа, меньше - лучше"""
+        if self.ewma_latency is None:
+            # Новые провайдеры пробуем первыми, чтобы собрать статистику
+            return 0.0
+        return self.ewma_latency / max(0.05, 1.0 - self.error_rate)
+
+
+class ProviderRouter:
+    def __init__(self, failure_threshold: int, open_seconds: float, ewma_alpha: float, window: int,
+                 max_entries: int):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.ewma_alpha = ewma_alpha
+        self.window = window
+        self.max_entries = max_entries
+        # Статистика по названию модели из запроса; давно не использованные пары вытесняются (LRU)
+        self._stats: "OrderedDict[Tuple[str, str], ProviderStats]" = OrderedDict()
+        # Результат последней фоновой проверки провайдера: True - жив, False - нет
+        self._provider_health: Dict[str, bool] = {}
+
+    def stats(self, model: str, provider: str) -> ProviderStats:
+        key = (model, provider)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = ProviderStats(self.window)
+            if len(self._stats) > self.max_entries:
+                self._stats.popitem(last=False)
+        else:
+            self._stats.move_to_end(key)
+        return stats
+
+    def set_provider_health(self, provider: str, healthy: bool):
+        """Записать результат фоновой проверки провайдера"""
+        self._provider_health[provider] = healthy
+
+    def order(self, model: str, providers: List[str]) -> List[str]:
+        """
+        Упорядочить провайдеров для запроса
+
+        Args:
+            model: Название модели
+            providers: Провайдеры модели из реестра
+
+        Returns:
+            Провайдеры в порядке перебора. Провайдеры с открытым breaker'ом
+            исключаются; провайдер в half-open ставится первым (пробный запрос),
+            не прошедшие фоновую проверку - последними.
+            Пустой список - все провайдеры модели отключены.
+        """
+        now = time.monotonic()
+        probes = []
+        healthy = []
+
+        for index, provider in enumerate(providers):
+            stats = self.stats(model, provider)
+            self._refresh(stats, now)
+
+            if stats.state == HALF_OPEN:
+                if self._probe_free(stats, now):
+                    probes.append(provider)
+                continue
+
+            if stats.state == CLOSED:
+                down = self._provider_health.get(provider) is False
+                healthy.append((down, stats.score(), index, provider))
+
+        healthy.sort()
+        return probes + [provider for _, _, _, provider in healthy]
+
+    def _refresh(self, stats: ProviderStats, now: float):
+        """Open breaker, время которого вышло, переходит в half-open"""
+        if stats.state == OPEN and now - stats.opened_at >= self.open_seconds:
+            stats.state = HALF_OPEN
+            stats.probe_started_at = None
+
+    def _probe_free(self, stats: ProviderStats, now: float) -> bool:
+        # Один пробный запрос за раз; зависший пробник не блокирует навсегда
+        return stats.probe_started_at is None or now - stats.probe_started_at >= self.open_seconds
+
+    def claim(self, model: str, provider: str) -> bool:
+        """
+        Начать попытку к провайдеру
+
+        Returns:
+            False - пробовать нельзя: breaker открыт или пробный запрос в
+            half-open уже идёт (его занял другой запрос после order())
+        """
+        now = time.monotonic()
+        stats = self.stats(model, provider)
+        self._refresh(stats, now)
+        if stats.state == OPEN:
+            return False
+        if stats.state == HALF_OPEN:
+            if not self._probe_free(stats, now):
+                return False
+            stats.probe_started_at = now
+        return True
+
+    def release_probe(self, model: str, provider: str):
+        """Попытка отменена без результата: освободить слот пробного запроса"""
+        stats = self.stats(model, provider)
+        if stats.state == HALF_OPEN:
+            stats.probe_started_at = None
+
+    def record_success(self, model: str, provider: str, latency: Optional[float] = None):
+        """
+        Учесть успешный ответ провайдера
+
+        Args:
+            latency: Время ответа в секундах; None - не обновлять задержку
+        """
+        stats = self.stats(model, provider)
+        stats.successes += 1
+        stats.consecutive_failures = 0
+        stats.error_rate *= 1.0 - self.ewma_alpha
+        stats.last_success_at = time.time()
+
+        if latency is not None:
+            stats.latencies.append(latency)
+            if stats.ewma_latency is None:
+                stats.ewma_latency = latency
+            else:
+                stats.ewma_latency += self.ewma_alpha * (latency - stats.ewma_latency)
+
+        stats.state = CLOSED
+        stats.probe_started_at = None
+
+    def record_failure(self, model: str, provider: str, error: str):
+        """Учесть ошибку провайдера и при необходимости открыть breaker"""
+        stats = self.stats(model, provider)
+        stats.failures += 1
+        stats.consecutive_failures += 1
+        stats.error_rate += self.ewma_alpha * (1.0 - stats.error_rate)
+        stats.last_error = error
+        stats.last_failure_at = time.time()
+
+        if stats.state == HALF_OPEN or stats.consecutive_failures >= self.failure_threshold:
+            stats.state = OPEN
+            stats.opened_at = time.monotonic()
+            stats.probe_started_at = None
+
+    def snapshot(self) -> dict:
+        """Текущее состояние роутера для админского endpoint'а"""
+        now = time.monotonic()
+        models: Dict[str, dict] = {}
+
+        for (model, provider), stats in self._stats.items():
+            reopen_in = None
+            if stats.state == OPEN:
+                reopen_in = max(0.0, self.open_seconds - (now - stats.opened_at))
+
+            models.setdefault(model, {})[provider] = {
+                "state": stats.state,
+                "score": stats.score(),
+                "ewma_latency": stats.ewma_latency,
+                "p50_latency": stats.percentile(0.5),
+                "p95_latency": stats.percentile(0.95),
+                "error_rate": stats.error_rate,
+                "successes": stats.successes,
+                "failures": stats.failures,
+                "consecutive_failures": stats.consecutive_failures,
+                "reopen_in": reopen_in,
+                "last_error": stats.last_error,
+                "last_success_at": stats.last_success_at,
+                "last_failure_at": stats.last_failure_at,
+            }
+
+        return {
+            "failure_threshold": self.failure_threshold,
+            "open_seconds": self.open_seconds,
+            "entries": len(self._stats),
+            "max_entries": self.max_entries,
+            "provider_health": dict(self._provider_health),
+            "models": models,
+        }
+
+
+provider_router = ProviderRouter(
+    failure_threshold=config.ROUTER_FAILURE_THRESHOLD,
+    open_seconds=config.ROUTER_OPEN_SECONDS,
+    ewma_alpha=config.ROUTER_EWMA_ALPHA,
+    window=config.ROUTER_LATENCY_WINDOW,
+    max_entries=config.ROUTER_MAX_ENTRIES
+)
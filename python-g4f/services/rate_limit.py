@@ -0,0 +1,234 @@
+"""
+Квоты API ключей: запросы в минуту и одновременные запросы
+
+Запросы в минуту ограничиваются token bucket'ом (ёмкость = лимит в минуту,
+пополнение равномерное), одновременные запросы - счётчиком. Обе проверки
+O(1) и выполняются в памяти процесса, а при нескольких процессах
+(SHARED_STATE_PATH) - одной короткой транзакцией в общем состоянии
+(services.shared_state), чтобы лимит был общим для всех процессов.
+Транзакции общего состояния выполняются в его собственном потоке
+(SharedState.offload): ожидание блокировки файла не останавливает event
+loop, а занятый провайдерами executor не задерживает проверку квот.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Set, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimited(Exception):
+    """Квота ключа исчерпана"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def take_token(tokens: float, elapsed: float, per_minute: int) -> Tuple[float, float]:
+    """
+    Пополнить token bucket за прошедшее время и взять один токен
+
+    Args:
+        tokens: Токенов в bucket'е при прошлом обращении
+        elapsed: Секунд с прошлого обращения
+        per_minute: Лимит запросов в минуту (ёмкость bucket'а)
+
+    Returns:
+        (токенов осталось, ожидание): ожидание 0 - токен взят, иначе через
+        сколько секунд появится следующий
+    """
+    rate = per_minute / 60.0
+    tokens = min(per_minute, tokens + elapsed * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self.tokens = float(per_minute)
+        self.updated_at = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Взять один токен
+
+        Returns:
+            0 - токен взят, иначе через сколько секунд появится следующий
+        """
+        now = time.monotonic()
+        self.tokens, wait = take_token(self.tokens, now - self.updated_at, self.per_minute)
+        self.updated_at = now
+        return wait
+
+
+class Lease:
+    """
+    Занятый слот одновременного запроса; release() идемпотентен
+
+    Слот нужно освободить явно: release() в общем состоянии выполняется в
+    потоке, а из сборщика мусора его вызывать нельзя.
+    """
+
+    def __init__(self, limiter: "KeyLimiter", key: str, shared=None):
+        self._limiter = limiter
+        self._key = key
+        # Общее состояние, в котором занят слот (None - память процесса)
+        self._shared = shared
+        self._released = False
+        self.detached = False
+
+    def release(self) -> Optional[asyncio.Task]:
+        """Освободить слот; в общем состоянии - задача освобождения, которую можно дождаться"""
+        if not self._released:
+            self._released = True
+            return self._limiter._release(self._key, self._shared)
+        return None
+
+    async def arelease(self):
+        """Освободить слот и дождаться, пока он освободится и в общем состоянии"""
+        task = self.release()
+        if task is not None:
+            await asyncio.shield(task)
+
+    def detach(self) -> "Lease":
+        """Передать освобождение слота дальше (например, в потоковый ответ)"""
+        self.detached = True
+        return self
+
+
+class KeyLimiter:
+    def __init__(self, default_per_minute: int, default_max_concurrent: int):
+        self.default_per_minute = default_per_minute
+        self.default_max_concurrent = default_max_concurrent
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._in_flight: Dict[str, int] = {}
+        # services.shared_state.SharedState при нескольких процессах (подключается в lifespan)
+        self.shared = None
+        # Освобождения слотов в общем состоянии, которые ещё выполняются
+        self._releasing: Set[asyncio.Task] = set()
+
+        self.rejected_rate = 0
+        self.rejected_concurrency = 0
+
+    async def acquire(self, key: str, per_minute: Optional[int] = None, max_concurrent: Optional[int] = None) -> Lease:
+        """
+        Проверить квоты ключа и занять слот
+
+        Args:
+            key: API ключ
+            per_minute: Лимит запросов в минуту (None - по умолчанию, 0 - без ограничения)
+            max_concurrent: Лимит одновременных запросов (None - по умолчанию, 0 - без ограничения)
+
+        Returns:
+            Lease, который нужно освободить по завершении запроса
+
+        Raises:
+            RateLimited: квота исчерпана
+        """
+        if per_minute is None:
+            per_minute = self.default_per_minute
+        if max_concurrent is None:
+            max_concurrent = self.default_max_concurrent
+
+        if self.shared is not None:
+            return await self._acquire_shared(key, per_minute, max_concurrent)
+
+        in_flight = self._in_flight.get(key, 0)
+        if max_concurrent and in_flight >= max_concurrent:
+            self.rejected_concurrency += 1
+            raise RateLimited(f"Превышен лимит одновременных запросов для ключа ({max_concurrent})", 1)
+
+        if per_minute:
+            bucket = self._buckets.get(key)
+            if bucket is None or bucket.per_minute != per_minute:
+                bucket = self._buckets[key] = TokenBucket(per_minute)
+            wait = bucket.take()
+            if wait:
+                self.rejected_rate += 1
+                raise RateLimited(f"Превышен лимит запросов в минуту для ключа ({per_minute})", wait)
+
+        self._in_flight[key] = in_flight + 1
+        return Lease(self, key)
+
+    async def _acquire_shared(self, key: str, per_minute: int, max_concurrent: int) -> Lease:
+        """Проверка квот в общем состоянии процессов; ключ без квот туда не записывается"""
+        if not per_minute and not max_concurrent:
+            return Lease(self, key)
+
+        shared = self.shared
+        rejected, wait = await shared.offload(shared.acquire_quota, key, per_minute, max_concurrent)
+        if rejected == "concurrency":
+            self.rejected_concurrency += 1
+            raise RateLimited(f"Превышен лимит одновременных запросов для ключа ({max_concurrent})", 1)
+        if rejected == "rate":
+            self.rejected_rate += 1
+            raise RateLimited(f"Превышен лимит запросов в минуту для ключа ({per_minute})", wait)
+        return Lease(self, key, shared)
+
+    def _release(self, key: str, shared=None) -> Optional[asyncio.Task]:
+        if shared is not None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # Вне event loop (остановка сервиса) ждать некому
+                self._release_shared(key, shared)
+                return None
+            # release() вызывается и из синхронных колбэков закрытия потока - транзакция уходит в поток
+            task = loop.create_task(shared.offload(self._release_shared, key, shared))
+            self._releasing.add(task)
+            task.add_done_callback(self._releasing.discard)
+            return task
+
+        in_flight = self._in_flight.get(key, 0) - 1
+        if in_flight > 0:
+            self._in_flight[key] = in_flight
+        else:
+            self._in_flight.pop(key, None)
+        return None
+
+    @staticmethod
+    def _release_shared(key: str, shared):
+        try:
+            shared.release_quota(key)
+        except Exception as e:
+            logger.warning(f"Не удалось освободить слот ключа в общем состоянии: {e}")
+
+    async def drain(self):
+        """Дождаться освобождения слотов в общем состоянии (перед его закрытием)"""
+        if self._releasing:
+            await asyncio.gather(*self._releasing, return_exceptions=True)
+
+    async def forget(self, key: str):
+        """Сбросить состояние ключа (после отзыва или смены квот)"""
+        self._buckets.pop(key, None)
+        if self.shared is not None:
+            await self.shared.offload(self.shared.forget_quota, key)
+
+    async def usage(self, key: str) -> dict:
+        """Текущее использование квот ключом"""
+        if self.shared is not None:
+            return await self.shared.offload(self.shared.quota_usage, key)
+        bucket = self._buckets.get(key)
+        return {
+            "in_flight": self._in_flight.get(key, 0),
+            "tokens_left": int(bucket.tokens) if bucket is not None else None,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "keys_in_flight": len(self._in_flight),
+            "rejected_rate": self.rejected_rate,
+            "rejected_concurrency": self.rejected_concurrency,
+        }
+
+
+key_limiter = KeyLimiter(
+    default_per_minute=config.API_KEY_DEFAULT_RPM,
+    default_max_concurrent=config.API_KEY_DEFAULT_MAX_CONCURRENT
+)
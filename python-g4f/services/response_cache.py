@@ -0,0 +1,201 @@
+"""
+Кэш ответов для повторяющихся completion-запросов
+
+Ключ - SHA-256 от канонического JSON (модель + сообщения). Два уровня:
+
+- память: LRU с бюджетом в байтах (RESPONSE_CACHE_MAX_BYTES) и TTL;
+- диск (если задан RESPONSE_CACHE_DISK_PATH): SQLite файл, переживает
+  перезапуск. Попадание на диске поднимает запись обратно в память.
+
+Режим для запроса задаётся заголовком X-G4F-Cache:
+on - читать и писать, off - не трогать кэш, refresh - не читать, но записать
+свежий ответ. Без заголовка используется RESPONSE_CACHE_DEFAULT.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import config
+from services import fast_json
+
+logger = logging.getLogger(__name__)
+
+CACHE_MODES = ("on", "off", "refresh")
+
+# Как часто (в записях) чистить просроченные записи на диске
+DISK_PRUNE_EVERY = 100
+
+
+def make_key(model: str, messages: List[dict]) -> str:
+    """Канонический хэш запроса"""
+    canonical = json.dumps(
+        {"model": model, "messages": messages},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class DiskTier:
+    """SQLite хранилище; блокирующие вызовы выполняются в пуле потоков"""
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._puts = 0
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM response_cache WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def _put(self, key: str, value: str, expires_at: float) -> int:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+            evicted = 0
+            self._puts += 1
+            if self._puts % DISK_PRUNE_EVERY == 0:
+                evicted += self._conn.execute(
+                    "DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),)
+                ).rowcount
+                evicted += self._conn.execute(
+                    "DELETE FROM response_cache WHERE key IN ("
+                    "SELECT key FROM response_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                ).rowcount
+            self._conn.commit()
+        return evicted
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def put(self, key: str, value: str, expires_at: float) -> int:
+        return await asyncio.to_thread(self._put, key, value, expires_at)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk: Optional[DiskTier] = None
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+    def open_disk(self, path: str, max_entries: int):
+        """Подключить дисковый уровень (вызывается из lifespan)"""
+        self.disk = DiskTier(path, max_entries)
+        logger.info(f"Дисковый кэш ответов: {path}")
+
+    def close_disk(self):
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+
+    def _memory_put(self, key: str, raw: str, expires_at: float):
+        size = len(raw.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+
+        self._entries[key] = (raw, size, expires_at)
+        self._bytes += size
+
+        while self._bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    async def get(self, key: str) -> Optional[dict]:
+        """Найти ответ в памяти, затем на диске"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            raw, size, expires_at = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return json.loads(raw)
+            del self._entries[key]
+            self._bytes -= size
+
+        if self.disk is not None:
+            try:
+                raw = await self.disk.get(key)
+            except Exception as e:
+                logger.warning(f"Ошибка чтения дискового кэша: {str(e)}")
+                raw = None
+            if raw is not None:
+                self.disk_hits += 1
+                self._memory_put(key, raw, time.time() + self.ttl)
+                return json.loads(raw)
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, value: dict):
+        """Сохранить ответ в оба уровня"""
+        raw = fast_json.dumps_str(value)
+        expires_at = time.time() + self.ttl
+        self._memory_put(key, raw, expires_at)
+
+        if self.disk is not None:
+            try:
+                self.disk_evictions += await self.disk.put(key, raw, expires_at)
+            except Exception as e:
+                logger.warning(f"Ошибка записи дискового кэша: {str(e)}")
+
+    def stats(self) -> dict:
+        """Статистика кэша"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "disk_enabled": self.disk is not None,
+            "disk_evictions": self.disk_evictions,
+        }
+
+
+response_cache = ResponseCache(
+    max_bytes=config.RESPONSE_CACHE_MAX_BYTES,
+    ttl=config.RESPONSE_CACHE_TTL
+)
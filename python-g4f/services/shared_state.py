@@ -0,0 +1,370 @@
+"""
+Общее состояние нескольких процессов сервиса (uvicorn --workers N)
+
+Каждый worker - отдельный процесс со своей памятью, поэтому состояние,
+которое должно быть единым, хранится в локальном SQLite файле
+SHARED_STATE_PATH (WAL, короткие транзакции):
+
+- квоты ключей: token bucket'ы и счётчики одновременных запросов;
+- результаты фоновой проверки провайдеров: проверяет только один процесс
+  (лидер по аренде с продлением), остальные получают его результаты;
+- события: отзыв ключа или смена квот в одном процессе сбрасывают кэш
+  этого ключа во всех остальных.
+
+Дисковый уровень кэша ответов в этом режиме лежит в том же файле.
+
+Фоновая задача run() раз в SHARED_STATE_SYNC_INTERVAL секунд обновляет
+heartbeat процесса и аренду лидера и применяет новые события. Слоты
+одновременных запросов процесса, переставшего обновлять heartbeat
+(упал), освобождаются.
+
+Транзакции выполняются в собственном потоке общего состояния (offload()),
+а не в executor'е event loop'а, который занят синхронными провайдерами g4f:
+ожидание блокировки файла не останавливает event loop, а медленные
+провайдеры не задерживают проверку квот.
+
+Без SHARED_STATE_PATH всё состояние остаётся в памяти процесса.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import config
+from services.key_cache import key_cache
+from services.prober import provider_prober
+from services.provider_router import provider_router
+from services.rate_limit import take_token
+
+logger = logging.getLogger(__name__)
+
+# Аренда фоновой проверки провайдеров
+PROBER_LEASE = "prober"
+
+# Сколько секунд хранятся события
+EVENTS_KEEP = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    owner TEXT PRIMARY KEY, started_at REAL NOT NULL, heartbeat_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    key TEXT PRIMARY KEY, per_minute INTEGER NOT NULL, tokens REAL NOT NULL, updated_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS rate_in_flight (
+    key TEXT NOT NULL, owner TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (key, owner));
+CREATE TABLE IF NOT EXISTS provider_status (
+    provider TEXT PRIMARY KEY, healthy INTEGER, status TEXT NOT NULL, updated_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, owner TEXT NOT NULL, kind TEXT NOT NULL,
+    key TEXT NOT NULL, created_at REAL NOT NULL);
+"""
+
+
+class SharedState:
+    def __init__(self, path: str, sync_interval: float, worker_timeout: float):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.worker_timeout = worker_timeout
+        self.owner: Optional[str] = None
+        self.leader = False
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        # Транзакции идут по одной под _lock - хватает одного потока
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._event_id = 0
+
+        self.syncs = 0
+        self.sync_errors = 0
+        self.events_published = 0
+        self.events_applied = 0
+        self.quota_ops = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._conn is not None
+
+    def open(self):
+        """Подключиться к файлу общего состояния (вызывается из lifespan каждого процесса)"""
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+        with self._transaction() as conn:
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO workers (owner, started_at, heartbeat_at) VALUES (?, ?, ?)",
+                (self.owner, now, now)
+            )
+            self._event_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+            statuses = conn.execute("SELECT provider, healthy, status FROM provider_status").fetchall()
+        for provider, healthy, status in statuses:
+            self._apply_provider_status(provider, healthy, status)
+        logger.info(f"Общее состояние процессов: {self.path} (процесс {self.owner})")
+
+    def close(self):
+        """Освободить слоты и аренду процесса и закрыть файл"""
+        if self._conn is None:
+            return
+        try:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM rate_in_flight WHERE owner = ?", (self.owner,))
+                conn.execute("DELETE FROM leases WHERE owner = ?", (self.owner,))
+                conn.execute("DELETE FROM workers WHERE owner = ?", (self.owner,))
+        except sqlite3.Error as e:
+            logger.warning(f"Не удалось убрать процесс из общего состояния: {e}")
+        with self._lock:
+            self._conn.close()
+            self._conn = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self.leader = False
+
+    async def offload(self, fn: Callable, *args):
+        """Выполнить транзакцию в потоке общего состояния"""
+        if self._executor is None:
+            # Общее состояние уже закрыто: методы сразу выходят или бросают sqlite3.Error
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    @contextmanager
+    def _transaction(self):
+        """Транзакция на запись; BEGIN IMMEDIATE сразу берёт блокировку файла"""
+        with self._lock:
+            conn = self._conn
+            if conn is None:
+                raise sqlite3.ProgrammingError("Общее состояние закрыто")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    # ---------- Квоты ключей ----------
+
+    def acquire_quota(self, key: str, per_minute: int, max_concurrent: int) -> Tuple[Optional[str], float]:
+        """
+        Проверить квоты ключа по всем процессам и занять слот
+
+        Args:
+            key: API ключ
+            per_minute: Лимит запросов в минуту (0 - без ограничения)
+            max_concurrent: Лимит одновременных запросов (0 - без ограничения)
+
+        Returns:
+            (None, 0) - слот занят; ("concurrency" | "rate", через сколько
+            секунд повторить) - квота исчерпана
+        """
+        self.quota_ops += 1
+        now = time.time()
+        with self._transaction() as conn:
+            if max_concurrent:
+                in_flight = conn.execute(
+                    "SELECT COALESCE(SUM(count), 0) FROM rate_in_flight WHERE key = ?", (key,)
+                ).fetchone()[0]
+                if in_flight >= max_concurrent:
+                    return "concurrency", 1.0
+
+            if per_minute:
+                row = conn.execute(
+                    "SELECT per_minute, tokens, updated_at FROM rate_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None or row[0] != per_minute:
+                    tokens, elapsed = float(per_minute), 0.0
+                else:
+                    tokens, elapsed = row[1], max(0.0, now - row[2])
+                tokens, wait = take_token(tokens, elapsed, per_minute)
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_buckets (key, per_minute, tokens, updated_at) VALUES (?, ?, ?, ?)",
+                    (key, per_minute, tokens, now)
+                )
+                if wait:
+                    return "rate", wait
+
+            conn.execute(
+                "INSERT INTO rate_in_flight (key, owner, count) VALUES (?, ?, 1) "
+                "ON CONFLICT (key, owner) DO UPDATE SET count = count + 1",
+                (key, self.owner)
+            )
+        return None, 0.0
+
+    def release_quota(self, key: str):
+        """Освободить слот одновременного запроса, занятый этим процессом"""
+        if self._conn is None:
+            # Процесс уже убрал свои слоты при закрытии
+            return
+        self.quota_ops += 1
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE rate_in_flight SET count = count - 1 WHERE key = ? AND owner = ?", (key, self.owner)
+            )
+            conn.execute("DELETE FROM rate_in_flight WHERE key = ? AND owner = ? AND count <= 0", (key, self.owner))
+
+    def forget_quota(self, key: str):
+        """Сбросить token bucket ключа"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM rate_buckets WHERE key = ?", (key,))
+
+    def quota_usage(self, key: str) -> dict:
+        """Использование квот ключом по всем процессам"""
+        with self._transaction() as conn:
+            in_flight = conn.execute(
+                "SELECT COALESCE(SUM(count), 0) FROM rate_in_flight WHERE key = ?", (key,)
+            ).fetchone()[0]
+            row = conn.execute("SELECT tokens FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+        return {
+            "in_flight": in_flight,
+            "tokens_left": int(row[0]) if row else None,
+        }
+
+    # ---------- События и проверка провайдеров ----------
+
+    def publish_keys(self, keys: Iterable[str]):
+        """Сообщить остальным процессам, что ключи изменились (отзыв, квоты)"""
+        now = time.time()
+        rows = [(self.owner, "key", key, now) for key in keys]
+        with self._transaction() as conn:
+            conn.executemany("INSERT INTO events (owner, kind, key, created_at) VALUES (?, ?, ?, ?)", rows)
+        self.events_published += len(rows)
+
+    def publish_provider_status(self, provider: str, healthy: Optional[bool], status: dict):
+        """Записать результат проверки провайдера для остальных процессов"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO provider_status (provider, healthy, status, updated_at) VALUES (?, ?, ?, ?)",
+                (provider, healthy, json.dumps(status, ensure_ascii=False), now)
+            )
+            conn.execute(
+                "INSERT INTO events (owner, kind, key, created_at) VALUES (?, 'provider', ?, ?)",
+                (self.owner, provider, now)
+            )
+        self.events_published += 1
+
+    def _apply_provider_status(self, provider: str, healthy: Optional[int], status: str):
+        if healthy is not None:
+            provider_router.set_provider_health(provider, bool(healthy))
+        provider_prober.apply_shared(provider, json.loads(status))
+
+    async def sync(self):
+        """
+        Один шаг синхронизации: heartbeat, аренда лидера, события других
+        процессов, освобождение слотов остановленных процессов
+        """
+        leader, events, statuses = await self.offload(self._sync_transaction)
+
+        if self.leader != (leader == self.owner):
+            self.leader = leader == self.owner
+            logger.info(f"Проверка провайдеров: {'этот процесс - лидер' if self.leader else 'лидер ' + leader}")
+
+        for _, owner, kind, key in events:
+            if owner != self.owner and kind == "key":
+                key_cache.invalidate(key)
+                self.events_applied += 1
+        for row in statuses:
+            if row is not None:
+                self._apply_provider_status(*row)
+                self.events_applied += 1
+        if events:
+            self._event_id = events[-1][0]
+        self.syncs += 1
+
+    def _sync_transaction(self) -> Tuple[str, List[tuple], List[Optional[tuple]]]:
+        """Транзакция шага синхронизации; возвращает лидера, новые события и статусы провайдеров"""
+        now = time.time()
+        with self._transaction() as conn:
+            updated = conn.execute("UPDATE workers SET heartbeat_at = ? WHERE owner = ?", (now, self.owner)).rowcount
+            if not updated:
+                conn.execute(
+                    "INSERT OR REPLACE INTO workers (owner, started_at, heartbeat_at) VALUES (?, ?, ?)",
+                    (self.owner, now, now)
+                )
+
+            stale = [
+                row[0] for row in conn.execute(
+                    "SELECT owner FROM workers WHERE heartbeat_at < ?", (now - self.worker_timeout,)
+                )
+            ]
+            for owner in stale:
+                conn.execute("DELETE FROM rate_in_flight WHERE owner = ?", (owner,))
+                conn.execute("DELETE FROM workers WHERE owner = ?", (owner,))
+            if stale:
+                logger.warning(f"Процессы без heartbeat удалены из общего состояния: {', '.join(stale)}")
+
+            conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+                (PROBER_LEASE, self.owner, now + self.worker_timeout, now)
+            )
+            leader = conn.execute("SELECT owner FROM leases WHERE name = ?", (PROBER_LEASE,)).fetchone()[0]
+
+            events = conn.execute(
+                "SELECT id, owner, kind, key FROM events WHERE id > ? ORDER BY id", (self._event_id,)
+            ).fetchall()
+            providers = {key for _, owner, kind, key in events if kind == "provider" and owner != self.owner}
+            statuses = [
+                conn.execute(
+                    "SELECT provider, healthy, status FROM provider_status WHERE provider = ?", (provider,)
+                ).fetchone()
+                for provider in providers
+            ]
+            conn.execute("DELETE FROM events WHERE created_at < ?", (now - EVENTS_KEEP,))
+        return leader, events, statuses
+
+    def leads(self) -> bool:
+        """Проверяет ли провайдеров этот процесс (без общего состояния - всегда да)"""
+        return not self.enabled or self.leader
+
+    async def run(self):
+        """Синхронизироваться раз в sync_interval секунд, пока задача не будет отменена"""
+        while True:
+            try:
+                await self.sync()
+            except sqlite3.Error as e:
+                self.sync_errors += 1
+                logger.error(f"Ошибка синхронизации общего состояния: {e}")
+            await asyncio.sleep(self.sync_interval)
+
+    def _workers(self) -> List[dict]:
+        with self._transaction() as conn:
+            return [
+                {"owner": owner, "started_at": started_at, "heartbeat_at": heartbeat_at}
+                for owner, started_at, heartbeat_at in conn.execute(
+                    "SELECT owner, started_at, heartbeat_at FROM workers ORDER BY started_at"
+                )
+            ]
+
+    async def stats(self) -> dict:
+        workers = await self.offload(self._workers) if self.enabled else []
+        return {
+            "enabled": self.enabled,
+            "path": self.path or None,
+            "owner": self.owner,
+            "leader": self.leader,
+            "workers": workers,
+            "syncs": self.syncs,
+            "sync_errors": self.sync_errors,
+            "events_published": self.events_published,
+            "events_applied": self.events_applied,
+            "quota_ops": self.quota_ops,
+        }
+
+
+shared_state = SharedState(
+    path=config.SHARED_STATE_PATH,
+    sync_interval=config.SHARED_STATE_SYNC_INTERVAL,
+    worker_timeout=config.SHARED_STATE_WORKER_TIMEOUT
+)
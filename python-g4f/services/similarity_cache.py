@@ -0,0 +1,254 @@
+"""
+Кэш ответов на почти одинаковые запросы
+
+Дополняет точный кэш ответов (response_cache): запрос, который отличается
+от уже отвеченного пробелами, регистром, знаками препинания в конце или
+несколькими словами, получает сохранённый ответ без обращения к провайдеру.
+
+Сравнивается только последнее сообщение пользователя, и только с записями
+той же модели и той же (после нормализации) предшествующей истории -
+иначе длинная общая история делала бы похожими разные вопросы.
+
+Последнее сообщение нормализуется (NFKC, нижний регистр, пробелы,
+пунктуация в конце), разбивается на слова и пары соседних слов (без
+типографской пунктуации), по ним считается 64-битный SimHash. Индекс LSH
+делит подпись на SIMILARITY_CACHE_BANDS полос: кандидаты - записи,
+совпавшие хотя бы в одной полосе. Кандидат проверяется по сходству Жаккара множеств слов и пар,
+ответ отдаётся при сходстве не ниже SIMILARITY_CACHE_THRESHOLD.
+
+Кэш в памяти процесса, ограничен SIMILARITY_CACHE_MAX_ENTRIES (LRU) и
+RESPONSE_CACHE_TTL.
+"""
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple
+
+import config
+
+SIGNATURE_BITS = 64
+_MASK = (1 << SIGNATURE_BITS) - 1
+
+# Кандидатов, проверяемых за один поиск
+MAX_CANDIDATES = 32
+
+_SPACES = re.compile(r"\s+")
+_TOKENS = re.compile(r"\w+|[^\w\s]")
+_TRAILING = " \t\n.,;:!?…"
+# Пунктуация, которая не меняет смысла запроса (символы вроде + = < > остаются признаками)
+_TYPOGRAPHIC = set(".,;:!?…\"'`«»“”„‘’()[]-–—")
+
+
+def normalize(text: str) -> str:
+    """Текст без различий в регистре, пробелах и пунктуации в конце"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return _SPACES.sub(" ", text).strip(_TRAILING)
+
+
+def features(text: str) -> FrozenSet[int]:
+    """Хэши слов и пар соседних слов нормализованного текста"""
+    tokens = [token for token in _TOKENS.findall(text) if token not in _TYPOGRAPHIC]
+    shingles = tokens + [a + " " + b for a, b in zip(tokens, tokens[1:])]
+    # hash() строк стабилен в пределах процесса, а кэш живёт только в памяти процесса
+    return frozenset(hash(shingle) & _MASK for shingle in shingles)
+
+
+def simhash(hashes: FrozenSet[int]) -> int:
+    """64-битный SimHash по хэшам признаков"""
+    threshold = len(hashes) / 2
+    signature = 0
+    for bit in range(SIGNATURE_BITS):
+        if sum((h >> bit) & 1 for h in hashes) > threshold:
+            signature |= 1 << bit
+    return signature
+
+
+def jaccard(a: FrozenSet[int], b: FrozenSet[int]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def context_key(model: str, messages: List[dict]) -> str:
+    """Хэш модели и нормализованной истории до последнего сообщения"""
+    canonical = json.dumps(
+        [model] + [[message["role"], normalize(message["content"])] for message in messages[:-1]],
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class _Entry(NamedTuple):
+    context: str
+    text: str
+    features: FrozenSet[int]
+    bands: Tuple[int, ...]
+    value: dict
+    expires_at: float
+
+
+class SimilarityCache:
+    def __init__(self, enabled: bool, threshold: float, bands: int, max_entries: int, max_chars: int, ttl: float):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.bands = max(1, min(bands, SIGNATURE_BITS))
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.ttl = ttl
+        self._band_width = SIGNATURE_BITS // self.bands
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        # (контекст, нормализованный текст) -> запись
+        self._exact: Dict[Tuple[str, str], int] = {}
+        # (контекст, номер полосы, значение полосы) -> записи
+        self._index: Dict[Tuple[str, int, int], Set[int]] = {}
+        self._next_id = 0
+
+        self.lookups = 0
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.candidates = 0
+        self.verified_candidates = 0
+        self.similarity_sum = 0.0
+        self.evictions = 0
+
+    def _bands(self, signature: int) -> Tuple[int, ...]:
+        mask = (1 << self._band_width) - 1
+        return tuple((signature >> (band * self._band_width)) & mask for band in range(self.bands))
+
+    def _prepare(self, model: str, messages: List[dict]) -> Optional[Tuple[str, str]]:
+        """Контекст и нормализованный текст последнего сообщения (None - запрос не кэшируется)"""
+        if not messages or messages[-1]["role"] != "user" or len(messages[-1]["content"]) > self.max_chars:
+            return None
+        text = normalize(messages[-1]["content"])
+        if not text:
+            return None
+        return context_key(model, messages), text
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        self._exact.pop((entry.context, entry.text), None)
+        for band, value in enumerate(entry.bands):
+            ids = self._index.get((entry.context, band, value))
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._index[(entry.context, band, value)]
+
+    def get(self, model: str, messages: List[dict]) -> Optional[Tuple[dict, float]]:
+        """
+        Найти ответ на такой же или похожий запрос
+
+        Args:
+            model: Название модели
+            messages: Сообщения в формате OpenAI
+
+        Returns:
+            (сохранённый ответ, сходство) или None
+        """
+        if not self.enabled:
+            return None
+        prepared = self._prepare(model, messages)
+        if prepared is None:
+            return None
+        context, text = prepared
+        self.lookups += 1
+        now = time.time()
+
+        entry_id = self._exact.get((context, text))
+        if entry_id is not None:
+            entry = self._entries[entry_id]
+            if entry.expires_at > now:
+                self._entries.move_to_end(entry_id)
+                self.exact_hits += 1
+                return entry.value, 1.0
+            self._remove(entry_id)
+
+        query = features(text)
+        candidates: Set[int] = set()
+        for band, value in enumerate(self._bands(simhash(query))):
+            candidates.update(self._index.get((context, band, value), ()))
+            if len(candidates) >= MAX_CANDIDATES:
+                break
+
+        best_id, best_similarity = None, 0.0
+        for candidate_id in list(candidates)[:MAX_CANDIDATES]:
+            entry = self._entries[candidate_id]
+            if entry.expires_at <= now:
+                self._remove(candidate_id)
+                continue
+            self.candidates += 1
+            similarity = jaccard(query, entry.features)
+            if similarity >= self.threshold:
+                self.verified_candidates += 1
+                if similarity > best_similarity:
+                    best_id, best_similarity = candidate_id, similarity
+
+        if best_id is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(best_id)
+        self.near_hits += 1
+        self.similarity_sum += best_similarity
+        return self._entries[best_id].value, best_similarity
+
+    def put(self, model: str, messages: List[dict], value: dict):
+        """Сохранить ответ на запрос"""
+        if not self.enabled:
+            return
+        prepared = self._prepare(model, messages)
+        if prepared is None:
+            return
+        context, text = prepared
+
+        old_id = self._exact.get((context, text))
+        if old_id is not None:
+            self._remove(old_id)
+
+        hashes = features(text)
+        entry = _Entry(context, text, hashes, self._bands(simhash(hashes)), value, time.time() + self.ttl)
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        self._exact[(context, text)] = entry_id
+        for band, band_value in enumerate(entry.bands):
+            self._index.setdefault((context, band, band_value), set()).add(entry_id)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        hits = self.exact_hits + self.near_hits
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "bands": self.bands,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "lookups": self.lookups,
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_ratio": hits / self.lookups if self.lookups else 0.0,
+            # Точность отбора кандидатов индексом LSH: доля кандидатов, которые прошли
+            # проверку сходством (не точность ответов из кэша)
+            "lsh_candidate_precision": self.verified_candidates / self.candidates if self.candidates else 0.0,
+            "candidates": self.candidates,
+            "mean_near_similarity": self.similarity_sum / self.near_hits if self.near_hits else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+similarity_cache = SimilarityCache(
+    enabled=config.SIMILARITY_CACHE_ENABLED,
+    threshold=config.SIMILARITY_CACHE_THRESHOLD,
+    bands=config.SIMILARITY_CACHE_BANDS,
+    max_entries=config.SIMILARITY_CACHE_MAX_ENTRIES,
+    max_chars=config.SIMILARITY_CACHE_MAX_CHARS,
+    ttl=config.RESPONSE_CACHE_TTL
+)
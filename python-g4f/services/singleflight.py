@@ -0,0 +1,161 @@
+"""
+Объединение одинаковых запросов, выполняющихся одновременно (single-flight)
+
+Пока запрос с каноническим ключом выполняется, такие же запросы не идут
+к провайдеру, а ждут общий результат.
+
+- Обычные запросы ждут общую задачу. Задача отменяется, только когда
+  ушли все ожидающие.
+- Потоковые запросы читают общий буфер чанков: опоздавшие сначала
+  получают уже пришедшие чанки, затем следуют за живым потоком. Новый
+  чанк запрашивается у провайдера, когда его ждёт самый быстрый
+  подписчик, так что backpressure сохраняется.
+"""
+import asyncio
+from functools import partial
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SharedStream:
+    """Один поток от провайдера, разделяемый несколькими подписчиками"""
+
+    def __init__(self, source: AsyncIterator):
+        self.source = source
+        self.on_done: Optional[Callable[[], None]] = None
+        self.buffer = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._pending: Optional[asyncio.Task] = None
+
+    async def _pull(self):
+        try:
+            self.buffer.append(await anext(self.source))
+        except StopAsyncIteration:
+            self._finish()
+        except Exception as e:
+            self.error = e
+            self._finish()
+        finally:
+            self._pending = None
+
+    def _finish(self):
+        self.done = True
+        if self.on_done is not None:
+            self.on_done()
+
+    async def _fetch(self):
+        # Чтение идёт в отдельной задаче: отмена одного подписчика не ломает поток остальным
+        if self._pending is None:
+            self._pending = asyncio.create_task(self._pull())
+        await asyncio.shield(self._pending)
+
+    async def subscribe(self) -> AsyncIterator:
+        """Все чанки потока с начала, затем новые по мере поступления"""
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                if index < len(self.buffer):
+                    yield self.buffer[index]
+                    index += 1
+                elif self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                else:
+                    await self._fetch()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                # Все подписчики ушли - останавливаем провайдера
+                self._finish()
+                pending = self._pending
+                if pending is not None:
+                    pending.cancel()
+                    await asyncio.gather(pending, return_exceptions=True)
+                await self.source.aclose()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, SharedStream] = {}
+
+        self.leaders = 0
+        self.coalesced = 0
+        self.stream_leaders = 0
+        self.stream_coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        """
+        Выполнить fn() один раз для всех одновременных запросов с ключом key
+
+        Returns:
+            Результат fn() (или его исключение) - общий для всех ожидающих
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.create_task(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(self._calls, key, call))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def stream(self, key: str, open_source: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """
+        Подписаться на общий поток для ключа key
+
+        Args:
+            open_source: Открывает поток у провайдера, если общего ещё нет
+
+        Returns:
+            Async-итератор чанков; закрывать через aclose()
+        """
+        shared = self._streams.get(key)
+        if shared is None:
+            shared = SharedStream(open_source())
+            shared.on_done = partial(self._forget, self._streams, key, shared)
+            self._streams[key] = shared
+            self.stream_leaders += 1
+        else:
+            self.stream_coalesced += 1
+        return shared.subscribe()
+
+    def in_flight(self, key: str, stream: bool = False) -> bool:
+        """Выполняется ли уже запрос с ключом key"""
+        return key in (self._streams if stream else self._calls)
+
+    @staticmethod
+    def _forget(registry: dict, key: str, value):
+        if registry.get(key) is value:
+            del registry[key]
+
+    def stats(self) -> dict:
+        """Статистика объединения запросов"""
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "streams_in_flight": len(self._streams),
+            "stream_leaders": self.stream_leaders,
+            "stream_coalesced": self.stream_coalesced,
+        }
+
+
+singleflight = SingleFlight()
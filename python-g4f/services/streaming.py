@@ -0,0 +1,253 @@
+"""
+Потоковая отдача chat completion в формате OpenAI (text/event-stream)
+"""
+import asyncio
+import logging
+import secrets
+import time
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from starlette.responses import StreamingResponse
+
+from services import fast_json, metrics, upstream
+from services.deadline import Deadline, DeadlineExceeded, blames_provider
+from services.provider_router import provider_router
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Отключает буферизацию в nginx, чтобы каждый чанк уходил сразу
+    "X-Accel-Buffering": "no",
+}
+
+
+class StreamUnavailable(Exception):
+    """Ни один провайдер не начал поток"""
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse, который всегда закрывает поток и освобождает слоты
+
+    Если клиент отключился до первого чанка, Starlette не начинает генератор
+    и его finally не выполняется - слоты освобождает on_finish.
+    """
+
+    def __init__(self, content: AsyncIterator, on_finish: Callable[[], None], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_finish = on_finish
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_finish()
+            await self.body_iterator.aclose()
+
+
+async def open_stream(model: str, messages: List[dict], providers: List[str],
+                      deadline: Optional[Deadline] = None) -> Tuple[str, object, AsyncIterator]:
+    """
+    Открыть поток у первого провайдера, который вернул хотя бы один чанк
+
+    Переключение на следующий провайдер возможно только до первого чанка:
+    после этого клиент уже получает ответ. Со сроком запроса каждый
+    провайдер ждёт первый чанк не дольше своей доли оставшегося времени.
+
+    Args:
+        model: Название модели
+        messages: Сообщения в формате OpenAI
+        providers: Провайдеры в порядке перебора
+        deadline: Срок запроса или None
+
+    Returns:
+        (провайдер, первый чанк, оставшийся поток)
+    """
+    last_error = None
+    for index, provider in enumerate(providers):
+        timeout = deadline.attempt_timeout(len(providers) - index) if deadline is not None else None
+        if timeout is not None and timeout <= 0:
+            raise DeadlineExceeded(last_error)
+        if not provider_router.claim(model, provider):
+            logger.info(f"Провайдер {provider} пропущен: пробный запрос half-open уже идёт")
+            continue
+        logger.info(f"Пробуем провайдер (stream): {provider}")
+        stream = upstream.stream_completion(model=model, messages=messages, provider=provider)
+        # Таймаут в текущей задаче: поток не остаётся занятым в отдельной задаче wait_for
+        attempt_deadline = asyncio.timeout(timeout)
+        try:
+            async with attempt_deadline:
+                first_chunk = await anext(stream)
+        except asyncio.CancelledError:
+            provider_router.release_probe(model, provider)
+            await stream.aclose()
+            raise
+        except StopAsyncIteration:
+            last_error = "пустой ответ"
+            logger.warning(f"Провайдер {provider} вернул пустой поток")
+            metrics.ERRORS.inc("provider_stream", "EmptyStream")
+            provider_router.record_failure(model, provider, last_error)
+            continue
+        except asyncio.TimeoutError as e:
+            await stream.aclose()
+            if not attempt_deadline.expired():
+                # Таймаут самого провайдера
+                last_error = str(e) or type(e).__name__
+                logger.warning(f"Провайдер {provider} не работает: {last_error}")
+                metrics.ERRORS.inc("provider_stream", type(e).__name__)
+                provider_router.record_failure(model, provider, last_error)
+                continue
+            last_error = f"нет первого чанка за {timeout:.1f} с"
+            logger.warning(f"Провайдер {provider} не уложился в срок: {last_error}")
+            metrics.ERRORS.inc("provider_stream", "DeadlineExceeded")
+            if blames_provider(timeout):
+                provider_router.record_failure(model, provider, last_error)
+            else:
+                # Срок клиента слишком короткий, чтобы судить о провайдере
+                provider_router.release_probe(model, provider)
+            continue
+        except Exception as e:
+            await stream.aclose()
+            last_error = str(e)
+            logger.warning(f"Провайдер {provider} не работает: {last_error}")
+            metrics.ERRORS.inc("provider_stream", type(e).__name__)
+            provider_router.record_failure(model, provider, last_error)
+            continue
+
+        # Время до первого чанка несравнимо с полным ответом, задержку не учитываем
+        provider_router.record_success(model, provider)
+        logger.info(f"Поток открыт! Провайдер: {provider}")
+        return provider, first_chunk, stream
+
+    if deadline is not None and deadline.expired():
+        raise DeadlineExceeded(last_error)
+    raise StreamUnavailable(last_error)
+
+
+async def provider_stream(
+    model: str,
+    messages: List[dict],
+    providers: List[str],
+    on_open: Optional[Callable[[str], None]] = None,
+    deadline: Optional[Deadline] = None
+) -> AsyncIterator:
+    """
+    Поток чанков от первого доступного провайдера
+
+    Первый anext() бросает StreamUnavailable, если ни один провайдер не ответил,
+    или DeadlineExceeded, если срок истёк раньше.
+
+    Args:
+        on_open: Вызывается с именем провайдера, открывшего поток
+        deadline: Срок запроса или None
+    """
+    provider, first_chunk, stream = await open_stream(model, messages, providers, deadline)
+    if on_open is not None:
+        on_open(provider)
+    try:
+        yield first_chunk
+        async for chunk in stream:
+            yield chunk
+    finally:
+        await stream.aclose()
+
+
+def chunk_length(chunk) -> int:
+    """Символов текста в чанке g4f"""
+    return len(chunk.choices[0].delta.content or "")
+
+
+def format_chunk(chunk, completion_id: str, created: int, model: str) -> Optional[str]:
+    """Преобразовать чанк g4f в SSE событие OpenAI"""
+    choices = getattr(chunk, "choices", None)
+    if not choices:
+        return None
+
+    choice = choices[0]
+    content = getattr(choice.delta, "content", None)
+    if not content and choice.finish_reason is None:
+        return None
+
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "delta": {"content": content} if content else {},
+            "finish_reason": choice.finish_reason,
+        }],
+    }
+    return f"data: {fast_json.dumps_str(payload)}\n\n"
+
+
+async def sse_events(
+    model: str,
+    first_chunk,
+    stream: AsyncIterator,
+    on_close: Optional[Callable[[int, bool], None]] = None,
+    deadline: Optional[Deadline] = None
+) -> AsyncIterator[str]:
+    """
+    SSE поток для StreamingResponse
+
+    Следующий чанк запрашивается у провайдера только после отправки
+    предыдущего клиенту, так что медленный клиент притормаживает и
+    чтение из провайдера. При отключении клиента поток закрывается
+    и слот провайдера освобождается. Когда истекает срок запроса, клиент
+    получает событие с ошибкой и поток тоже закрывается.
+
+    Args:
+        on_close: Вызывается с (символов ответа отправлено, была ли ошибка),
+            когда поток завершён или клиент отключился
+        deadline: Срок запроса или None
+    """
+    completion_id = f"chatcmpl-{secrets.token_hex(12)}"
+    created = int(time.time())
+    completion_chars = 0
+    failed = False
+
+    try:
+        event = format_chunk(first_chunk, completion_id, created, model)
+        if event:
+            completion_chars += chunk_length(first_chunk)
+            yield event
+
+        while True:
+            # Таймаут в текущей задаче, а не в задаче wait_for: при отключении клиента
+            # генератор не выполняется в другой задаче, и aclose() его закрывает
+            timeout = asyncio.timeout(deadline.remaining() if deadline is not None else None)
+            try:
+                async with timeout:
+                    chunk = await anext(stream)
+            except StopAsyncIteration:
+                break
+            except asyncio.TimeoutError:
+                if not timeout.expired():
+                    raise
+                raise DeadlineExceeded()
+            event = format_chunk(chunk, completion_id, created, model)
+            if event:
+                completion_chars += chunk_length(chunk)
+                yield event
+    except DeadlineExceeded:
+        failed = True
+        logger.warning(f"Истёк срок потокового запроса ({deadline.budget:g} с)")
+        metrics.ERRORS.inc("stream", "DeadlineExceeded")
+        error = {"error": {"message": f"Истёк срок запроса ({deadline.budget:g} с)", "type": "timeout_error"}}
+        yield f"data: {fast_json.dumps_str(error)}\n\n"
+    except Exception as e:
+        failed = True
+        logger.error(f"Ошибка во время стриминга: {str(e)}")
+        metrics.ERRORS.inc("stream", type(e).__name__)
+        error = {"error": {"message": f"Ошибка при обращении к AI: {str(e)}", "type": "api_error"}}
+        yield f"data: {fast_json.dumps_str(error)}\n\n"
+    finally:
+        # Слоты освобождаются до первого await: при отмене задачи он может не выполниться
+        if on_close is not None:
+            on_close(completion_chars, failed)
+        await stream.aclose()
+
+    yield "data: [DONE]\n\n"
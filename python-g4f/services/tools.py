@@ -0,0 +1,196 @@
+"""
+Вызов функций (tools) внутри сервиса
+
+POST /v1/chat/tools выполняет цикл модель -> функции -> модель целиком в
+сервисе: Node.js присылает историю и определения функций один раз, а
+функции каждого шага выполняет по обратному вызову TOOLS_CALLBACK_URL.
+Туда уходят только вызовы функций шага, а не вся история, и все вызовы
+одного шага - одним запросом.
+
+Контракт обратного вызова:
+
+    POST TOOLS_CALLBACK_URL
+    X-Tools-Secret: TOOLS_CALLBACK_SECRET
+    {"tool_calls": [{"id", "name", "arguments"}], "context": {"session": tool_session}}
+    -> {"results": [{"tool_call_id", "content"}]}
+
+tool_session - непрозрачный идентификатор, который Node.js выдал на время
+запроса: пользователя и ключ он находит по нему у себя, из запроса к
+сервису они не берутся. Без TOOLS_CALLBACK_SECRET обратный вызов не
+выполняется. Ошибка обратного вызова не прерывает цикл: модель получает её текстом как
+результат функции. После TOOLS_MAX_STEPS шагов модель вызывается с
+tool_choice="none" и должна ответить без функций.
+"""
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+import config
+from services.http_pool import http_pool
+
+logger = logging.getLogger(__name__)
+
+# (сообщения, параметры g4f) -> ChatCompletion
+CompleteStep = Callable[[List[dict], dict], Awaitable[object]]
+
+
+class ToolCallbackError(Exception):
+    """Обратный вызов не выполнил функции"""
+
+
+def _field(value: Any, name: str) -> Any:
+    return value.get(name) if isinstance(value, dict) else getattr(value, name, None)
+
+
+def tool_call_dict(call: Any, fallback_id: str) -> dict:
+    """Вызов функции из ответа g4f (модель pydantic, объект или dict) в формате OpenAI"""
+    function = _field(call, "function")
+    arguments = _field(function, "arguments")
+    if not isinstance(arguments, str):
+        arguments = json.dumps(arguments if arguments is not None else {}, ensure_ascii=False)
+    return {
+        "id": _field(call, "id") or fallback_id,
+        "type": "function",
+        "function": {"name": _field(function, "name"), "arguments": arguments},
+    }
+
+
+class ToolOrchestrator:
+    def __init__(self, callback_url: str, callback_secret: str, callback_timeout: float, max_steps: int):
+        self.callback_url = callback_url
+        self.callback_secret = callback_secret
+        self.callback_timeout = callback_timeout
+        self.max_steps = max_steps
+
+        self.runs = 0
+        self.steps = 0
+        self.tool_calls = 0
+        self.callback_errors = 0
+        self.callback_seconds = 0.0
+
+    async def execute(self, calls: List[dict], session: Optional[str]) -> Dict[str, str]:
+        """
+        Выполнить вызовы функций шага одним обратным вызовом
+
+        Returns:
+            tool_call_id -> результат функции (строка)
+
+        Raises:
+            ToolCallbackError: обратный вызов не настроен, недоступен или вернул ошибку
+        """
+        if not self.callback_url:
+            raise ToolCallbackError("TOOLS_CALLBACK_URL не задан")
+        if not self.callback_secret:
+            # Без секрета обратный вызов мог бы прислать кто угодно
+            raise ToolCallbackError("TOOLS_CALLBACK_SECRET не задан")
+
+        payload = {
+            "tool_calls": [
+                {"id": call["id"], "name": call["function"]["name"], "arguments": call["function"]["arguments"]}
+                for call in calls
+            ],
+            "context": {"session": session},
+        }
+        headers = {"X-Tools-Secret": self.callback_secret}
+        timeout = aiohttp.ClientTimeout(total=self.callback_timeout)
+        started = time.perf_counter()
+        try:
+            # Соединение с Node.js переиспользуется через общий пул, если он открыт
+            async with aiohttp.ClientSession(connector=http_pool.connector, connector_owner=http_pool.connector is None,
+                                             timeout=timeout) as http:
+                async with http.post(self.callback_url, json=payload, headers=headers) as response:
+                    if response.status != 200:
+                        raise ToolCallbackError(f"Обратный вызов вернул HTTP {response.status}")
+                    body = await response.json()
+        except ToolCallbackError:
+            raise
+        except Exception as e:
+            raise ToolCallbackError(f"Обратный вызов недоступен: {str(e) or type(e).__name__}")
+        finally:
+            self.callback_seconds += time.perf_counter() - started
+
+        if not isinstance(body, dict) or not isinstance(body.get("results"), list):
+            raise ToolCallbackError("Обратный вызов вернул ответ без results")
+        results = {}
+        for result in body["results"]:
+            content = result.get("content")
+            results[result.get("tool_call_id")] = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+        return results
+
+    async def run(self, messages: List[dict], tools: List[dict], tool_choice: Any, session: Optional[str],
+                  max_steps: Optional[int], complete: CompleteStep) -> Tuple[object, List[dict], List[dict]]:
+        """
+        Цикл модель -> функции -> модель
+
+        Args:
+            messages: История в формате OpenAI
+            tools: Определения функций в формате OpenAI
+            tool_choice: tool_choice для шагов с функциями
+            session: Идентификатор запроса в Node.js для обратного вызова (tool_session)
+            max_steps: Шагов с вызовом функций (не больше TOOLS_MAX_STEPS)
+            complete: Запрос к модели с учётом admission control и перебора провайдеров
+
+        Returns:
+            (последний ChatCompletion, выполненные вызовы функций, добавленные в историю сообщения)
+        """
+        max_steps = min(max_steps or self.max_steps, self.max_steps)
+        history = list(messages)
+        executed: List[dict] = []
+        self.runs += 1
+
+        for step in range(max_steps + 1):
+            # Шаги закончились - модель должна ответить без функций
+            options = {"tools": tools, "tool_choice": tool_choice if step < max_steps else "none"}
+            response = await complete(history, options)
+            message = response.choices[0].message
+            calls = [
+                tool_call_dict(call, f"call_{step}_{index}")
+                for index, call in enumerate(getattr(message, "tool_calls", None) or [])
+            ]
+            if not calls or step == max_steps:
+                return response, executed, history[len(messages):]
+
+            self.steps += 1
+            self.tool_calls += len(calls)
+            logger.info(f"Шаг {step + 1}: модель вызвала функции {', '.join(call['function']['name'] for call in calls)}")
+
+            try:
+                results = await self.execute(calls, session)
+            except ToolCallbackError as e:
+                self.callback_errors += 1
+                logger.warning(f"Функции не выполнены: {e}")
+                error = json.dumps({"success": False, "error": str(e)}, ensure_ascii=False)
+                results = {call["id"]: error for call in calls}
+
+            history.append({"role": "assistant", "content": message.content or "", "tool_calls": calls})
+            for call in calls:
+                content = results.get(call["id"], json.dumps({"success": False, "error": "Нет результата функции"}))
+                history.append({
+                    "role": "tool", "tool_call_id": call["id"], "name": call["function"]["name"], "content": content
+                })
+                executed.append({**call, "result": content})
+
+        raise RuntimeError(f"Цикл вызова функций завершился без ответа модели (max_steps={max_steps})")
+
+    def stats(self) -> dict:
+        return {
+            "callback_url": self.callback_url,
+            "callback_secret_set": bool(self.callback_secret),
+            "max_steps": self.max_steps,
+            "runs": self.runs,
+            "steps": self.steps,
+            "tool_calls": self.tool_calls,
+            "callback_errors": self.callback_errors,
+            "callback_seconds": round(self.callback_seconds, 3),
+        }
+
+
+tool_orchestrator = ToolOrchestrator(
+    callback_url=config.TOOLS_CALLBACK_URL,
+    callback_secret=config.TOOLS_CALLBACK_SECRET,
+    callback_timeout=config.TOOLS_CALLBACK_TIMEOUT,
+    max_steps=config.TOOLS_MAX_STEPS
+)
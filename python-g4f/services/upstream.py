@@ -0,0 +1,148 @@
+"""
+Асинхронное выполнение запросов к провайдерам G4F
+
+Все обращения к g4f идут через AsyncClient и ограничены семафором
+G4F_MAX_CONCURRENCY, поэтому медленный провайдер не блокирует event loop,
+а число одновременных запросов в процессе ограничено.
+
+Сам g4f (импорт всех провайдеров) загружается не при импорте модуля,
+а при первом обращении - обычно фоновым прогревом из lifespan, - чтобы
+процесс стартовал быстро.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import config
+
+# Асинхронный G4F клиент (создаётся при первом обращении, см. get_client)
+client = None
+_client_loading: Optional[asyncio.Future] = None
+
+_semaphore = asyncio.Semaphore(config.G4F_MAX_CONCURRENCY)
+_in_flight = 0
+
+
+def create_executor() -> ThreadPoolExecutor:
+    """
+    Пул потоков для синхронных провайдеров g4f
+
+    Синхронные провайдеры g4f запускаются через run_in_executor
+    в executor'е по умолчанию, поэтому его размер совпадает с лимитом
+    одновременных запросов.
+    """
+    return ThreadPoolExecutor(
+        max_workers=config.G4F_MAX_CONCURRENCY,
+        thread_name_prefix="g4f"
+    )
+
+
+def _load_client():
+    from g4f.client import AsyncClient
+
+    return AsyncClient()
+
+
+async def get_client():
+    """
+    G4F клиент; при первом вызове g4f импортируется в пуле потоков
+
+    Одновременные вызовы ждут одну и ту же загрузку.
+    """
+    global client, _client_loading
+
+    if client is not None:
+        return client
+    if _client_loading is None:
+        _client_loading = asyncio.ensure_future(asyncio.to_thread(_load_client))
+    try:
+        loaded = await asyncio.shield(_client_loading)
+    except Exception:
+        # Следующий вызов попробует загрузить g4f заново
+        _client_loading = None
+        raise
+    if client is None:
+        client = loaded
+    return client
+
+
+def is_loaded() -> bool:
+    """Загружен ли g4f"""
+    return client is not None
+
+
+def in_flight() -> int:
+    """Число запросов к провайдерам, выполняющихся прямо сейчас"""
+    return _in_flight
+
+
+async def create_completion(model: str, messages: List[dict], provider: Optional[str] = None, **kwargs):
+    """
+    Выполнить chat completion через G4F, не блокируя event loop
+
+    Args:
+        model: Название модели
+        messages: Сообщения в формате OpenAI
+        provider: Имя провайдера g4f или "auto"/None для автовыбора
+        **kwargs: Дополнительные параметры для g4f
+
+    Returns:
+        ChatCompletion от g4f
+    """
+    global _in_flight
+
+    if provider == "auto":
+        provider = None
+
+    g4f_client = await get_client()
+
+    async with _semaphore:
+        _in_flight += 1
+        try:
+            return await g4f_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                provider=provider,
+                **kwargs
+            )
+        finally:
+            _in_flight -= 1
+
+
+async def stream_completion(model: str, messages: List[dict], provider: Optional[str] = None, **kwargs):
+    """
+    Потоковый chat completion через G4F
+
+    Слот семафора занят, пока поток не дочитан или не закрыт (aclose),
+    поэтому стриминговые запросы тоже учитываются в G4F_MAX_CONCURRENCY.
+
+    Args:
+        model: Название модели
+        messages: Сообщения в формате OpenAI
+        provider: Имя провайдера g4f или "auto"/None для автовыбора
+        **kwargs: Дополнительные параметры для g4f
+
+    Yields:
+        ChatCompletionChunk от g4f по мере генерации
+    """
+    global _in_flight
+
+    if provider == "auto":
+        provider = None
+
+    g4f_client = await get_client()
+
+    async with _semaphore:
+        _in_flight += 1
+        try:
+            stream = g4f_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                provider=provider,
+                stream=True,
+                **kwargs
+            )
+            async for chunk in stream:
+                yield chunk
+        finally:
+            _in_flight -= 1
@@ -0,0 +1,178 @@
+"""
+Учёт использования API ключей
+
+Запросы, ошибки и объём промптов/ответов (в символах) копятся в памяти
+по (ключ, модель, день) и записываются в базу данных пачками одной
+транзакцией - раз в USAGE_FLUSH_INTERVAL секунд или раньше, если
+накопилось USAGE_FLUSH_MAX_ENTRIES записей. На горячем пути запроса
+обращения к базе нет. При остановке сервиса lifespan сбрасывает остаток.
+
+Модели вне реестра учитываются как "other" - название модели приходит от
+клиента. Если пачка не записалась, записи пишутся по одной: ошибка одной
+записи не задерживает остальные, а запись, которая не записалась
+MAX_FLUSH_ATTEMPTS раз, когда другие записывались, отбрасывается.
+"""
+import asyncio
+import logging
+import math
+from datetime import date, datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
+
+import config
+from models.api_key import APIKeyUsage
+from services.model_registry import model_registry
+
+logger = logging.getLogger(__name__)
+
+# Порядок счётчиков в буфере
+FIELDS = ("requests", "errors", "cached", "prompt_chars", "completion_chars")
+
+# Символов на токен для оценки числа токенов
+CHARS_PER_TOKEN = 4
+
+# Попыток записи, после которых запись статистики отбрасывается
+MAX_FLUSH_ATTEMPTS = 3
+
+
+def estimate_tokens(chars: int) -> int:
+    return math.ceil(chars / CHARS_PER_TOKEN)
+
+
+class UsageRecorder:
+    def __init__(self, enabled: bool, flush_interval: float, flush_max_entries: int):
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.flush_max_entries = flush_max_entries
+        self._buffer: Dict[Tuple[str, str, date], list] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        # Неудачные попытки записи по записям буфера
+        self._attempts: Dict[Tuple[str, str, date], int] = {}
+
+        self.flushes = 0
+        self.flushed_entries = 0
+        self.flush_errors = 0
+        self.dropped_entries = 0
+        self.last_flush_seconds = 0.0
+
+    def record(self, key: str, model: str, prompt_chars: int, completion_chars: int = 0,
+               error: bool = False, cached: bool = False):
+        """Учесть запрос (только память, O(1))"""
+        if not self.enabled:
+            return
+        entry_key = (key, model_registry.metric_label(model), datetime.now(timezone.utc).date())
+        entry = self._buffer.get(entry_key)
+        if entry is None:
+            entry = self._buffer[entry_key] = [0, 0, 0, 0, 0]
+        entry[0] += 1
+        entry[1] += int(error)
+        entry[2] += int(cached)
+        entry[3] += prompt_chars
+        entry[4] += completion_chars
+
+        if len(self._buffer) >= self.flush_max_entries and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    @staticmethod
+    async def _write(entry_key: Tuple[str, str, date], counters: list):
+        key, model, day = entry_key
+        values = dict(zip(FIELDS, counters))
+        updated = await APIKeyUsage.filter(key=key, model=model, day=day).update(
+            **{field: F(field) + value for field, value in values.items()}
+        )
+        if not updated:
+            await APIKeyUsage.create(key=key, model=model, day=day, **values)
+
+    def _retry_later(self, entry_key: Tuple[str, str, date], counters: list, error: Exception):
+        """Вернуть запись в буфер до следующей попытки или отбросить после MAX_FLUSH_ATTEMPTS"""
+        attempts = self._attempts.get(entry_key, 0) + 1
+        if attempts >= MAX_FLUSH_ATTEMPTS:
+            self._attempts.pop(entry_key, None)
+            self.dropped_entries += 1
+            logger.error(f"Статистика использования {entry_key} отброшена после {attempts} попыток: {error}")
+            return
+        self._attempts[entry_key] = attempts
+        self._merge(entry_key, counters)
+
+    def _merge(self, entry_key: Tuple[str, str, date], counters: list):
+        entry = self._buffer.setdefault(entry_key, [0, 0, 0, 0, 0])
+        for index, value in enumerate(counters):
+            entry[index] += value
+
+    async def flush(self) -> int:
+        """
+        Записать накопленное в базу данных одной транзакцией
+
+        Returns:
+            Сколько записей (ключ, модель, день) записано. Если транзакция не
+            прошла, записи пишутся по одной; незаписанные возвращаются в
+            буфер до следующей попытки.
+        """
+        async with self._flush_lock:
+            if not self._buffer:
+                return 0
+
+            batch, self._buffer = self._buffer, {}
+            started = asyncio.get_running_loop().time()
+            written = len(batch)
+            try:
+                async with in_transaction():
+                    for entry_key, counters in batch.items():
+                        await self._write(entry_key, counters)
+            except Exception as e:
+                self.flush_errors += 1
+                logger.warning(f"Пачка статистики использования не записана, запись по одной: {e}")
+                failed = []
+                for entry_key, counters in batch.items():
+                    try:
+                        async with in_transaction():
+                            await self._write(entry_key, counters)
+                    except Exception as row_error:
+                        failed.append((entry_key, counters, row_error))
+                        continue
+                    self._attempts.pop(entry_key, None)
+                written -= len(failed)
+                for entry_key, counters, row_error in failed:
+                    if written:
+                        self._retry_later(entry_key, counters, row_error)
+                    else:
+                        # Не записалось ничего - база недоступна, записи не виноваты
+                        self._merge(entry_key, counters)
+            else:
+                for entry_key in batch:
+                    self._attempts.pop(entry_key, None)
+
+            self.flushes += 1
+            self.flushed_entries += written
+            self.last_flush_seconds = asyncio.get_running_loop().time() - started
+            return written
+
+    async def run(self):
+        """Сбрасывать буфер каждые flush_interval секунд, пока задача не будет отменена"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # Отмена задачи при остановке не должна обрывать начатую запись
+            await asyncio.shield(self.flush())
+
+    def stats(self) -> dict:
+        return {
+            "pending_entries": len(self._buffer),
+            "flushes": self.flushes,
+            "flushed_entries": self.flushed_entries,
+            "flush_errors": self.flush_errors,
+            "dropped_entries": self.dropped_entries,
+            "last_flush_ms": self.last_flush_seconds * 1000,
+        }
+
+
+usage_recorder = UsageRecorder(
+    enabled=config.USAGE_ENABLED,
+    flush_interval=config.USAGE_FLUSH_INTERVAL,
+    flush_max_entries=config.USAGE_FLUSH_MAX_ENTRIES
+)
@@ -100,6 +100,35 @@ async function processToolCalls(aiResponse, context) {
     };
 }
 
+/**
+ * Выполнить вызовы функций одного шага (обратный вызов Python G4F /v1/chat/tools)
+ * @param {Array} toolCalls - [{id, name, arguments}]
+ * @param {object} context - Контекст выполнения (userId, apiKeyId)
+ * @returns {Promise<Array>} [{tool_call_id, content}]
+ */
+async function executeToolCalls(toolCalls, context) {
+    return Promise.all(toolCalls.map(async (toolCall) => {
+        let functionArgs;
+        try {
+            functionArgs = typeof toolCall.arguments === 'string'
+                ? JSON.parse(toolCall.arguments || '{}')
+                : (toolCall.arguments || {});
+        } catch (error) {
+            console.error(`❌ Ошибка парсинга аргументов для ${toolCall.name}:`, error);
+            return {
+                tool_call_id: toolCall.id,
+                content: JSON.stringify({ success: false, error: 'Invalid function arguments' })
+            };
+        }
+
+        console.log(`🔧 Выполнение: ${toolCall.name}(${JSON.stringify(functionArgs).substring(0, 100)}...)`);
+        const result = await registry.execute(toolCall.name, functionArgs, context);
+        console.log(`✅ Результат ${toolCall.name}:`, result.success ? 'успех' : 'ошибка');
+
+        return { tool_call_id: toolCall.id, content: JSON.stringify(result) };
+    }));
+}
+
 /**
  * Создать сообщения для второго запроса с результатами функций
  */
@@ -139,6 +168,7 @@ function supportsTools(model) {
 module.exports = {
     injectTools,
     processToolCalls,
+    executeToolCalls,
     createFollowUpMessages,
     supportsTools
 };
@@ -1,17 +1,88 @@
 const express = require('express');
 const router = express.Router();
 const axios = require('axios');
+const crypto = require('crypto');
 const { requireApiKey, logRequest } = require('../middleware/auth');
-const { injectTools, processToolCalls, createFollowUpMessages, supportsTools } = require('../middleware/function-calling');
+const { injectTools, executeToolCalls, supportsTools } = require('../middleware/function-calling');
 
 // Python G4F API - локальный FastAPI сервис с g4f библиотекой
-// Endpoints: POST /v1/chat/completions, GET /v1/models
+// Endpoints: POST /v1/chat/completions, POST /v1/chat/tools, GET /v1/models
 const PYTHON_G4F_API = process.env.PYTHON_G4F_API || 'http://localhost:5000';
 const PYTHON_G4F_ADMIN_KEY = process.env.PYTHON_G4F_ADMIN_KEY || '56ce83efbb8ae2467f567ced95023b0958cda1f8a0704d84b6b7040628e1c632';
+// Общий секрет обратного вызова /ai/tools/execute (TOOLS_CALLBACK_SECRET Python сервиса);
+// без него обратный вызов отклоняется
+const PYTHON_G4F_TOOLS_SECRET = process.env.PYTHON_G4F_TOOLS_SECRET || '';
 
 // Конфигурация по умолчанию
 const DEFAULT_MODEL = 'gpt-4';
 
+// Таймауты запросов к Python G4F. Срок, который получает Python сервис (X-Request-Deadline),
+// на 5 секунд меньше: он успевает отменить работу с провайдерами и ответить 504 до таймаута axios
+const COMPLETION_TIMEOUT_MS = 120000;
+const TOOLS_TIMEOUT_MS = 300000; // несколько шагов модели и функций
+const STREAM_TIMEOUT_MS = 605000; // весь поток: Python сервис получает срок 600 секунд
+
+function deadlineHeader(timeoutMs) {
+  return String(timeoutMs / 1000 - 5);
+}
+
+// Запросы с функциями, которые ждут обратных вызовов: tool_session -> {userId, apiKeyId, expiresAt}.
+// Python сервис получает только tool_session - пользователь и ключ берутся отсюда, а не из тела вызова
+const toolSessions = new Map();
+
+function openToolSession(req) {
+  const now = Date.now();
+  // Сессии добавляются с одинаковым сроком - истёкшие всегда в начале Map
+  for (const [id, session] of toolSessions) {
+    if (session.expiresAt > now) break;
+    toolSessions.delete(id);
+  }
+  const id = crypto.randomBytes(24).toString('hex');
+  toolSessions.set(id, { userId: req.user?.id, apiKeyId: req.apiKey?.id, expiresAt: now + TOOLS_TIMEOUT_MS });
+  return id;
+}
+
+function toolsSecretMatches(value) {
+  const expected = Buffer.from(PYTHON_G4F_TOOLS_SECRET);
+  const actual = Buffer.from(value || '');
+  return actual.length === expected.length && crypto.timingSafeEqual(actual, expected);
+}
+
+// Последние ответы /v1/models и /v1/providers с их ETag: пока список не изменился,
+// Python сервис отвечает 304 без тела, а клиенту отдаётся сохранённая копия
+const listingCache = {};
+
+async function fetchListing(path) {
+  const cached = listingCache[path];
+  const headers = { 'X-API-Key': PYTHON_G4F_ADMIN_KEY };
+  if (cached) {
+    headers['If-None-Match'] = cached.etag;
+  }
+
+  const response = await axios.get(`${PYTHON_G4F_API}${path}`, {
+    headers,
+    validateStatus: (status) => (status >= 200 && status < 300) || status === 304
+  });
+
+  if (response.status === 304 && cached) {
+    return cached;
+  }
+
+  const listing = { etag: response.headers.etag, data: response.data };
+  if (listing.etag) {
+    listingCache[path] = listing;
+  }
+  return listing;
+}
+
+// Отдать список с ETag: Express сам ответит 304, если он совпал с If-None-Match клиента
+function sendListing(res, listing) {
+  if (listing.etag) {
+    res.set('ETag', listing.etag);
+  }
+  res.json(listing.data);
+}
+
 /**
  * @swagger
  * /ai/chat/completions:
@@ -127,6 +198,7 @@ const DEFAULT_MODEL = 'gpt-4';
  *                   example: Ошибка при обращении к AI
  */
 router.post('/chat/completions', requireApiKey, async (req, res) => {
+  let toolSession = null;
   try {
     const { messages, model = DEFAULT_MODEL, stream = false, provider, api = 'interference', tools } = req.body;
     
@@ -174,9 +246,50 @@ router.post('/chat/completions', requireApiKey, async (req, res) => {
     console.log('📝 Модель:', model);
     console.log('📨 Сообщений:', messages.length);
     
-    // Streaming пока не поддерживается в Python версии
+    // Клиент отключился до ответа - запрос к Python отменяется, и Python отменяет работу
+    // с провайдерами, а не держит их слоты ради ответа, который никто не прочитает
+    const abortController = new AbortController();
+    res.on('close', () => {
+      if (!res.writableFinished) {
+        abortController.abort();
+      }
+    });
+
+    // Streaming: проксируем SSE поток от Python G4F без буферизации
+    if (stream === true && !(tools && tools.length > 0)) {
+      const pythonG4fStream = await axios.post(`${PYTHON_G4F_API}/v1/chat/completions`, {
+        model: model,
+        messages: messages,
+        stream: true
+      }, {
+        timeout: STREAM_TIMEOUT_MS,
+        responseType: 'stream',
+        signal: abortController.signal,
+        headers: {
+          'Content-Type': 'application/json',
+          'X-API-Key': req.apiKeyValue || PYTHON_G4F_ADMIN_KEY,
+          'X-Request-Deadline': deadlineHeader(STREAM_TIMEOUT_MS)
+        }
+      });
+
+      console.log('🌊 Streaming ответ от Python G4F');
+
+      res.setHeader('Content-Type', 'text/event-stream');
+      res.setHeader('Cache-Control', 'no-cache');
+      res.setHeader('Connection', 'keep-alive');
+      res.setHeader('X-Accel-Buffering', 'no');
+      res.flushHeaders();
+
+      // pipe учитывает backpressure: медленный клиент притормаживает чтение из Python
+      pythonG4fStream.data.pipe(res);
+
+      // Клиент отключился - закрываем соединение с Python, чтобы освободить провайдера
+      res.on('close', () => pythonG4fStream.data.destroy());
+      return;
+    }
+
     if (stream === true) {
-      console.log('⚠️ Streaming режим пока не поддерживается Python G4F, используем обычный режим');
+      console.log('⚠️ Streaming с tools не поддерживается, используем обычный режим');
     }
     
     // Для не-streaming запросов
@@ -210,14 +323,36 @@ router.post('/chat/completions', requireApiKey, async (req, res) => {
       }
     }
     
-    // Отправляем запрос к Python G4F
-    const pythonG4fResponse = await axios.post(`${PYTHON_G4F_API}/v1/chat/completions`, requestBody, {
-      timeout: 120000, // 2 минуты для g4f
-      headers: {
-        'Content-Type': 'application/json',
-        'X-API-Key': req.apiKeyValue || PYTHON_G4F_ADMIN_KEY // Используем API ключ пользователя или admin ключ
-      }
-    });
+    // Отправляем запрос к Python G4F. С tools цикл модель -> функции -> модель выполняет
+    // Python сервис (/v1/chat/tools), а функции вызывает через /ai/tools/execute
+    if (hasTools) {
+      toolSession = openToolSession(req);
+    }
+    const pythonG4fResponse = hasTools
+      ? await axios.post(`${PYTHON_G4F_API}/v1/chat/tools`, {
+          model: model,
+          messages: messages,
+          tools: requestBody.tools,
+          tool_choice: requestBody.tool_choice,
+          tool_session: toolSession
+        }, {
+          timeout: TOOLS_TIMEOUT_MS,
+          signal: abortController.signal,
+          headers: {
+            'Content-Type': 'application/json',
+            'X-API-Key': req.apiKeyValue || PYTHON_G4F_ADMIN_KEY,
+            'X-Request-Deadline': deadlineHeader(TOOLS_TIMEOUT_MS)
+          }
+        })
+      : await axios.post(`${PYTHON_G4F_API}/v1/chat/completions`, requestBody, {
+          timeout: COMPLETION_TIMEOUT_MS, // 2 минуты для g4f
+          signal: abortController.signal,
+          headers: {
+            'Content-Type': 'application/json',
+            'X-API-Key': req.apiKeyValue || PYTHON_G4F_ADMIN_KEY, // Используем API ключ пользователя или admin ключ
+            'X-Request-Deadline': deadlineHeader(COMPLETION_TIMEOUT_MS)
+          }
+        });
     
     console.log('✅ Ответ получен от Python G4F');
     console.log('📊 Статус:', pythonG4fResponse.status);
@@ -237,50 +372,9 @@ router.post('/chat/completions', requireApiKey, async (req, res) => {
     console.log('📦 Получен ответ от Python G4F');
     
     // Извлекаем данные
-    let responseData = rawData.data;
-
-    // Обработка Function Calling - проверяем есть ли tool_calls
-    if (hasTools && responseData.choices?.[0]?.message?.tool_calls) {
-      console.log('🔧 Обнаружены tool_calls в ответе AI');
-      
-      try {
-        const context = {
-          userId: req.user?.id,
-          apiKeyId: req.apiKey?.id,
-          timeout: 5000
-        };
-
-        // Обрабатываем tool_calls
-        const { toolResults, needsSecondCall } = await processToolCalls(responseData, context);
-
-        if (needsSecondCall && toolResults) {
-          console.log('🔄 Отправляем второй запрос к AI с результатами функций');
-
-          // Создаем новые сообщения с результатами
-          const followUpMessages = createFollowUpMessages(messages, responseData, toolResults);
-
-          // Второй запрос к AI
-          const secondRequest = {
-            model: model,
-            messages: followUpMessages,
-            stream: false
-          };
-
-          const secondResponse = await axios.post(`${PYTHON_G4F_API}/v1/chat/completions`, secondRequest, {
-            timeout: 120000,
-            headers: {
-              'Content-Type': 'application/json',
-              'X-API-Key': req.apiKeyValue || PYTHON_G4F_ADMIN_KEY
-            }
-          });
-
-          console.log('✅ Получен финальный ответ после выполнения функций');
-          responseData = secondResponse.data.data; // Python G4F возвращает {success, data}
-        }
-      } catch (error) {
-        console.error('❌ Ошибка обработки tool_calls:', error);
-        // Продолжаем с исходным ответом
-      }
+    const responseData = rawData.data;
+    if (hasTools && responseData.tool_calls?.length) {
+      console.log(`🔧 Выполнено функций: ${responseData.tool_calls.length} за ${responseData.tool_steps} шагов`);
     }
     
     // Отправляем ответ клиенту
@@ -292,6 +386,10 @@ router.post('/chat/completions', requireApiKey, async (req, res) => {
     }
     
   } catch (error) {
+    if (axios.isCancel(error)) {
+      console.log('⚠️ Клиент отключился, запрос к Python G4F отменён');
+      return;
+    }
     console.error('Ошибка AI запроса:', error);
     
     // Возвращаем ошибку в OpenAI формате
@@ -302,6 +400,45 @@ router.post('/chat/completions', requireApiKey, async (req, res) => {
         code: error.response?.status || 500
       }
     });
+  } finally {
+    if (toolSession) {
+      toolSessions.delete(toolSession);
+    }
+  }
+});
+
+// Обратный вызов Python G4F (/v1/chat/tools): выполнить функции одного шага
+// Тело: {tool_calls: [{id, name, arguments}], context: {session}}
+// Ответ: {results: [{tool_call_id, content}]}
+router.post('/tools/execute', async (req, res) => {
+  if (!PYTHON_G4F_TOOLS_SECRET) {
+    return res.status(503).json({ success: false, error: 'Обратный вызов отключён: PYTHON_G4F_TOOLS_SECRET не задан' });
+  }
+  if (!toolsSecretMatches(req.get('X-Tools-Secret'))) {
+    return res.status(403).json({ success: false, error: 'Доступ запрещён' });
+  }
+
+  const { tool_calls: toolCalls, context = {} } = req.body;
+  if (!Array.isArray(toolCalls)) {
+    return res.status(400).json({ success: false, error: 'Массив tool_calls обязателен' });
+  }
+
+  // Пользователь и ключ - только из сессии, открытой этим сервисом для запроса с функциями
+  const session = typeof context.session === 'string' ? toolSessions.get(context.session) : undefined;
+  if (!session || session.expiresAt <= Date.now()) {
+    return res.status(403).json({ success: false, error: 'Сессия вызова функций не найдена или истекла' });
+  }
+
+  try {
+    const results = await executeToolCalls(toolCalls, {
+      userId: session.userId,
+      apiKeyId: session.apiKeyId,
+      timeout: 5000
+    });
+    res.json({ results });
+  } catch (error) {
+    console.error('❌ Ошибка выполнения функций:', error);
+    res.status(500).json({ success: false, error: error.message });
   }
 });
 
@@ -339,12 +476,7 @@ router.post('/chat/completions', requireApiKey, async (req, res) => {
  */
 router.get('/models', async (req, res) => {
   try {
-    const response = await axios.get(`${PYTHON_G4F_API}/v1/models`, {
-      headers: {
-        'X-API-Key': PYTHON_G4F_ADMIN_KEY
-      }
-    });
-    res.json(response.data);
+    sendListing(res, await fetchListing('/v1/models'));
   } catch (error) {
     console.error('Ошибка получения моделей:', error);
     res.status(500).json({
@@ -391,12 +523,7 @@ router.get('/models', async (req, res) => {
  */
 router.get('/providers', async (req, res) => {
   try {
-    const response = await axios.get(`${PYTHON_G4F_API}/v1/providers`, {
-      headers: {
-        'X-API-Key': PYTHON_G4F_ADMIN_KEY
-      }
-    });
-    res.json(response.data);
+    sendListing(res, await fetchListing('/v1/providers'));
   } catch (error) {
     console.error('Ошибка получения провайдеров:', error);
     res.status(500).json({